@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import argparse as argp
+import math
+import time
+
+# Dead reckoning from yaw rate and wheel speed. Heading is the running integral
+# of the yaw rate, and position the running integral of speed along the heading,
+# so every method is a cumulative sum over per-step increments instead of a
+# Python loop. As in mapper.py, heading is measured from +y and a positive yaw
+# rate turns toward +x (x uses sin, y uses cos).
+#
+#   euler:     rates and speed held at the start of each step (mapper.py)
+#   trapezoid: average of the start and end of each step
+#   rk2:       midpoint rule; speed and yaw rate at mid-step, heading advanced half a step
+
+mph_to_mps = 0.44704
+methods = ['euler', 'trapezoid', 'rk2']
+
+def ffill(arr, first=0.0):
+    # forward_propagate without the loop: NaNs take the last valid value, leading NaNs take first
+    arr = np.asarray(arr, dtype=float)
+    valid = ~np.isnan(arr)
+    idx = np.where(valid, np.arange(len(arr)), -1)
+    np.maximum.accumulate(idx, out=idx)
+    return np.where(idx >= 0, arr[np.maximum(idx, 0)], first)
+
+def time_steps(interval, dt=None):
+    # seconds from each sample to the next (one fewer than samples); Interval is in ms
+    if dt is not None:
+        return np.full(max(len(interval) - 1, 0), float(dt))
+    steps = np.diff(np.asarray(interval, dtype=float)) / 1000.0
+    # a stray out-of-order or missing timestamp contributes no motion
+    steps[~(steps > 0)] = 0.0
+    return steps
+
+def dead_reckon(speed, yaw_rate, interval=None, dt=None, method='euler', psi0=0.0, degrees=True, speed_scale=mph_to_mps):
+    # x, y (m) and heading psi (rad) at every sample. speed is wheel speed (mph
+    # by default, see speed_scale), yaw_rate is deg/s (rad/s with degrees=False).
+    # Steps come from the Interval timestamps, or are all dt seconds when dt is given.
+    if interval is None and dt is None:
+        raise ValueError("dead_reckon needs Interval timestamps or a fixed dt")
+    v = ffill(speed) * speed_scale
+    r = ffill(yaw_rate)
+    if degrees:
+        r = np.deg2rad(r)
+    n = len(v)
+    if n == 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    h = time_steps(v if interval is None else interval, dt)
+
+    if method == 'euler':
+        dpsi = r[:-1] * h
+    elif method in ('trapezoid', 'rk2'):
+        dpsi = 0.5 * (r[:-1] + r[1:]) * h
+    else:
+        raise ValueError(f"unknown method {method!r}, expected one of {methods}")
+    psi = np.concatenate([[psi0], psi0 + np.cumsum(dpsi)])
+
+    if method == 'euler':
+        dx = v[:-1] * np.sin(psi[:-1]) * h
+        dy = v[:-1] * np.cos(psi[:-1]) * h
+    elif method == 'trapezoid':
+        sx, sy = v * np.sin(psi), v * np.cos(psi)
+        dx = 0.5 * (sx[:-1] + sx[1:]) * h
+        dy = 0.5 * (sy[:-1] + sy[1:]) * h
+    else:
+        # heading at mid-step from the start-of-step rate, speed interpolated to mid-step
+        mid = psi[:-1] + 0.5 * r[:-1] * h
+        v_mid = 0.5 * (v[:-1] + v[1:])
+        dx = v_mid * np.sin(mid) * h
+        dy = v_mid * np.cos(mid) * h
+    x = np.concatenate([[0.0], np.cumsum(dx)])
+    y = np.concatenate([[0.0], np.cumsum(dy)])
+    return x, y, psi
+
+def reckon_loop(speed, yaw_rate, dt=0.020):
+    # reference: the per-sample Euler loop of mapper.py (yaw rate used as rad/s, speed in mph)
+    n = len(speed)
+    x_pos, y_pos, psi = np.zeros(n), np.zeros(n), np.zeros(n)
+    for i in range(n - 1):
+        psi[i+1] = psi[i] + yaw_rate[i]*dt
+        y_pos[i+1] = y_pos[i] + speed[i]*0.44704*math.cos((psi[i]))*dt
+        x_pos[i+1] = x_pos[i] + speed[i]*0.44704*math.sin((psi[i]))*dt
+    return x_pos, y_pos, psi
+
+def load_csv(path):
+    df = pd.read_csv(path, usecols=['Interval', 'WSFR', 'Yaw'])
+    return df['Interval'].to_numpy(dtype=float), df['WSFR'].to_numpy(dtype=float), df['Yaw'].to_numpy(dtype=float)
+
+def main(args):
+    interval, wsfr, yaw = load_csv(args.filename)
+    if args.repeat > 1:
+        # a longer run: the same log laid end to end
+        span = interval[-1] - interval[0] + 20
+        interval = np.concatenate([interval + k * span for k in range(args.repeat)])
+        wsfr, yaw = np.tile(wsfr, args.repeat), np.tile(yaw, args.repeat)
+    print(f"{args.filename}: {len(interval)} samples")
+
+    # mapper.py's Euler output: fixed 20 ms steps, yaw rate taken as rad/s
+    t0 = time.perf_counter()
+    ref = reckon_loop(ffill(wsfr), ffill(yaw), 0.020)
+    t_loop = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    out = dead_reckon(wsfr, yaw, dt=0.020, degrees=False)
+    t_vec = time.perf_counter() - t0
+    err = max(np.abs(a - b).max() for a, b in zip(ref, out))
+    print(f"euler, fixed dt: loop {t_loop*1000:.1f} ms, vectorized {t_vec*1000:.2f} ms "
+          f"({t_loop/t_vec:.0f}x), max difference {err:.2e}")
+
+    # the methods on the real Interval timestamps, yaw rate in deg/s
+    for method in methods:
+        t0 = time.perf_counter()
+        x, y, psi = dead_reckon(wsfr, yaw, interval, method=method)
+        elapsed = time.perf_counter() - t0
+        print(f"{method:9s} on Interval: {elapsed*1000:.2f} ms, end at ({x[-1]:.1f}, {y[-1]:.1f}) m, "
+              f"heading {np.rad2deg(psi[-1]):.1f} deg, path {np.hypot(np.diff(x), np.diff(y)).sum():.0f} m")
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Dead reckon a run from Yaw and WSFR and compare against the Euler loop")
+    parser.add_argument("filename", help="csv with Interval, WSFR and Yaw columns")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="lay the log end to end this many times")
+    args = parser.parse_args()
+    main(args)
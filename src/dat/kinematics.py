@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+import argparse as argp
+import os
+import shutil
+import tempfile
+import time
+from deadreckon import ffill, mph_to_mps
+
+# The yaw/wheel speed kinematics of tools/old/yaw_steeringangle_wheelspeed_comparison.py
+# as one in-memory call: forward-fill Yaw and WSFR, interpolate ElapsedTime,
+# integrate yaw into a heading and speed along it into a position. The old
+# script ran these as separate steps that handed arrays to each other through
+# csv files; here every step is an array operation on the previous one.
+# As in that script each step uses the rates at its end, and x follows cos of
+# the heading.
+
+def elapsed_seconds(df):
+    # ElapsedTime (minutes) interpolated over the rows without it, zeroed, in seconds;
+    # logs without ElapsedTime use Interval (ms)
+    if 'ElapsedTime' not in df:
+        interval = df['Interval'].to_numpy(dtype=float)
+        return (interval - interval[0]) / 1000.0
+    elapsed = df['ElapsedTime'].to_numpy(dtype=float)
+    valid = ~np.isnan(elapsed)
+    elapsed = np.interp(np.arange(len(elapsed)), np.flatnonzero(valid), elapsed[valid])
+    return (elapsed - elapsed[0]) * 60.0
+
+def kinematics(source):
+    # source: a csv path or a frame with Yaw, WSFR and ElapsedTime or Interval
+    df = pd.read_csv(source) if isinstance(source, str) else source
+    t = elapsed_seconds(df)
+    yaw = ffill(df['Yaw'].to_numpy())             # deg/s
+    speed = ffill(df['WSFR'].to_numpy()) * mph_to_mps
+    dt = np.diff(t, prepend=t[:1])
+    heading = np.cumsum(np.deg2rad(yaw) * dt)      # rad, 0 at the first row
+    x = np.cumsum(speed * np.cos(heading) * dt)
+    y = np.cumsum(speed * np.sin(heading) * dt)
+    return {'time': t, 'yaw': yaw, 'speed': speed, 'heading': heading, 'x': x, 'y': y}
+
+def plot_kinematics(k):
+    import matplotlib.pyplot as plt
+    fig, (ax_pos, ax_yaw) = plt.subplots(1, 2, figsize=(14, 6))
+    ax_pos.plot(k['x'], k['y'], color='b')
+    ax_pos.set_title("Position Vectors")
+    ax_pos.set_xlabel("X Position (m)")
+    ax_pos.set_ylabel("Y Position (m)")
+    ax_pos.grid(True)
+    ax_pos.set_aspect('equal', 'datalim')
+    ax_yaw.plot(k['time'], np.rad2deg(k['heading']), color='r')
+    ax_yaw.set_title("Yaw Angle Over Time")
+    ax_yaw.set_xlabel("Time (seconds)")
+    ax_yaw.set_ylabel("Yaw Angle (degrees)")
+    ax_yaw.grid(True)
+    fig.tight_layout()
+    return fig
+
+def file_flow(path, workdir):
+    # reference: the old script's steps, loops and intermediate csvs included (without its prints)
+    cwd = os.getcwd()
+    path = os.path.abspath(path)
+    os.chdir(workdir)
+    try:
+        df = pd.read_csv(path)
+        if 'ElapsedTime' in df:
+            elapsed_time = df["ElapsedTime"].to_numpy()
+            elapsed_time_interpolated = np.interp(
+                np.arange(len(elapsed_time)),
+                np.where(~np.isnan(elapsed_time))[0],
+                elapsed_time[~np.isnan(elapsed_time)]
+            )
+            seconds = (elapsed_time_interpolated - elapsed_time_interpolated[0]) * 60.0
+        else:
+            seconds = elapsed_seconds(df)
+        pd.DataFrame({"ElapsedTimeInterpolated_Seconds": seconds}).to_csv("ElapsedTimeInterpolated_Seconds.csv", index=False)
+
+        df = pd.read_csv(path)
+        elapsed_time_interpolated_seconds_zeroed = pd.read_csv("ElapsedTimeInterpolated_Seconds.csv")["ElapsedTimeInterpolated_Seconds"].to_numpy()
+        yaw = df["Yaw"].to_numpy().copy()
+        for i in range(1, len(yaw)):
+            if np.isnan(yaw[i]):
+                yaw[i] = yaw[i - 1]
+        wsfr = df["WSFR"].to_numpy().copy()
+        for i in range(1, len(wsfr)):
+            if np.isnan(wsfr[i]):
+                wsfr[i] = wsfr[i - 1]
+        wsfr_mps = wsfr * 0.44704
+        pd.DataFrame({"LinearVelocities_mps": wsfr_mps}).to_csv("LinearVelocities_mps.csv", index=False)
+        pd.DataFrame({"AngularVelocities_degrees_per_second": yaw}).to_csv("AngularVelocities_degrees_per_second.csv", index=False)
+
+        yaw_static = [0]
+        for i in range(1, len(elapsed_time_interpolated_seconds_zeroed)):
+            dt = elapsed_time_interpolated_seconds_zeroed[i] - elapsed_time_interpolated_seconds_zeroed[i - 1]
+            yaw_change = np.deg2rad(yaw[i]) * dt
+            yaw_static.append(yaw_static[-1] + yaw_change)
+        pd.DataFrame({"Yaw_Static_radians": np.array(yaw_static)}).to_csv("Yaw_Static_radians.csv", index=False)
+
+        position_vectors = [(0, 0)]
+        for i in range(1, len(elapsed_time_interpolated_seconds_zeroed)):
+            dt = elapsed_time_interpolated_seconds_zeroed[i] - elapsed_time_interpolated_seconds_zeroed[i - 1]
+            angle = yaw_static[i]
+            dx = wsfr_mps[i] * np.cos(angle) * dt
+            dy = wsfr_mps[i] * np.sin(angle) * dt
+            x, y = position_vectors[-1]
+            position_vectors.append((x + dx, y + dy))
+        pd.DataFrame(position_vectors, columns=["Position_X", "Position_Y"]).to_csv("PositionVectors.csv", index=False)
+
+        # the plotting steps read their inputs back from disk
+        positions = pd.read_csv("PositionVectors.csv")
+        heading = pd.read_csv("Yaw_Static_radians.csv")["Yaw_Static_radians"].to_numpy()
+        return {'time': elapsed_time_interpolated_seconds_zeroed, 'heading': heading,
+                'x': positions["Position_X"].to_numpy(), 'y': positions["Position_Y"].to_numpy()}
+    finally:
+        os.chdir(cwd)
+
+def main(args):
+    df = pd.read_csv(args.filename)
+    # start where Yaw and WSFR have both been sampled: the old loops cannot fill leading NaNs
+    first = max(df['Yaw'].first_valid_index(), df['WSFR'].first_valid_index())
+    df = df.loc[first:].reset_index(drop=True)
+    if args.repeat > 1:
+        df = pd.concat([df] * args.repeat, ignore_index=True)
+        df['Interval'] = df['Interval'].iloc[0] + 20 * np.arange(len(df))
+    if 'ElapsedTime' not in df:
+        # RaceCapture logs have no ElapsedTime; give it one (minutes) at the GPS rows, as the old logs had
+        df['ElapsedTime'] = np.where(df['Latitude'].notna(), df['Interval'] / 60000.0, np.nan)
+        df.loc[0, 'ElapsedTime'] = df.loc[0, 'Interval'] / 60000.0
+    workdir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(workdir, 'input.csv')
+        df.to_csv(source, index=False)
+        t0 = time.perf_counter()
+        ref = file_flow(source, workdir)
+        t_files = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        k = kinematics(source)
+        t_mem = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        kinematics(df)
+        t_calc = time.perf_counter() - t0
+    finally:
+        shutil.rmtree(workdir)
+    err = max(np.abs(k[c] - ref[c]).max() for c in ['time', 'heading', 'x', 'y'])
+    print(f"{args.filename}: {len(df)} rows, file-based flow {t_files*1000:.0f} ms, "
+          f"in-memory {t_mem*1000:.1f} ms ({t_files/t_mem:.0f}x; {t_calc*1000:.2f} ms of it after reading the csv), "
+          f"max difference {err:.1e}")
+    if args.show_plot == 'y':
+        import matplotlib.pyplot as plt
+        plot_kinematics(k)
+        plt.show()
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Yaw/wheel speed kinematics in one call, benchmarked against the old csv-based steps")
+    parser.add_argument("filename", help="csv with Yaw, WSFR and ElapsedTime or Interval")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="lay the log end to end this many times")
+    parser.add_argument("-s", "--show_plot", default='n', choices=['y', 'n'], help="show the position and yaw plots")
+    args = parser.parse_args()
+    main(args)
@@ -41,17 +41,10 @@ time_vals = df["Interval"].values
 yaw_vals  = df["Yaw_rad"].values
 v_vals    = df["WSFR_mps"].values
 
-N = len(df)
-x = np.zeros(N)
-y = np.zeros(N)
-
-# Starting position
-x[0], y[0] = 0.0, 0.0
-
-for k in range(N-1):
-    dt = (time_vals[k+1] - time_vals[k])
-    x[k+1] = x[k] + v_vals[k] * dt * np.cos(yaw_vals[k])
-    y[k+1] = y[k] + v_vals[k] * dt * np.sin(yaw_vals[k])
+# Starting position (0, 0); each step adds v*dt along the heading at its start
+dt = np.diff(time_vals)
+x = np.concatenate([[0.0], np.cumsum(v_vals[:-1] * dt * np.cos(yaw_vals[:-1]))])
+y = np.concatenate([[0.0], np.cumsum(v_vals[:-1] * dt * np.sin(yaw_vals[:-1]))])
 
 df["x_m"] = x
 df["y_m"] = y
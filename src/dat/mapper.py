@@ -3,17 +3,7 @@ import pandas as pd
 import math
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
-
-def forward_propagate(arr):
-    most_recent_number = 0
-    for i in range(len(arr)):
-        if np.isnan(arr[i]):
-            arr[i] = most_recent_number
-        else:
-            most_recent_number = arr[i]
-        #print(arr[i])
-    valid = arr
-    return valid
+from deadreckon import dead_reckon, ffill
 
 def process_csv(filename):
     # Load CSV file
@@ -24,14 +14,9 @@ def process_csv(filename):
     wsfr = df["WSFR"].to_numpy()
     yaw = df["Yaw"].to_numpy()
     
-    # Forward propagation for NaN values
-    wsfr = forward_propagate(wsfr)
-    yaw = forward_propagate(yaw)
-    
-    # Create x_pos and y_pos arrays of zeros
-    x_pos = np.zeros(42546)
-    y_pos = np.zeros(42546)
-    psi = np.zeros(42546)
+    # Forward propagation for NaN values (0 before the first sample)
+    wsfr = ffill(wsfr)
+    yaw = ffill(yaw)
     
     # Remove first 310 values from each relevant array
     interval = interval[310:]
@@ -39,29 +24,13 @@ def process_csv(filename):
     yaw = yaw[310:]
     #yaw = yaw - 1.2
     
-    # Save arrays to CSV for inspection
-    output_df = pd.DataFrame({
-        "Interval": interval,
-        "WSFR": wsfr,
-        "Yaw": yaw,
-        "X_Pos": x_pos,
-        "Y_Pos": y_pos
-    })
-    output_df.to_csv("processed_data.csv", index=False)
-    
-    return interval, wsfr, yaw, x_pos, y_pos, psi
+    return interval, wsfr, yaw
 
-def plot_position(interval, wsfr, yaw, x_pos, y_pos, psi):
+def plot_position(interval, wsfr, yaw, method='euler', fixed_dt=None):
     # 1mph = 0.44704 m/s
-    dt = 0.020
-    for i in range(len(interval) - 1):
-        #print("WS = ", wsfr[i])
-        #print("YAW = ", yaw[i])
-        psi[i+1] = psi[i] + yaw[i]*dt
-        #y_pos[i+1] = y_pos[i] + wsfr[i]*0.44704*math.cos(math.radians(psi[i]))*dt
-        #x_pos[i+1] = x_pos[i] + wsfr[i]*0.44704*math.sin(math.radians(psi[i]))*dt
-        y_pos[i+1] = y_pos[i] + wsfr[i]*0.44704*math.cos((psi[i]))*dt
-        x_pos[i+1] = x_pos[i] + wsfr[i]*0.44704*math.sin((psi[i]))*dt
+    # heading and position for any run length, stepped by the Interval timestamps
+    # (fixed_dt=0.020 gives the old fixed-step output); Yaw is used as rad/s as before
+    x_pos, y_pos, psi = dead_reckon(wsfr, yaw, interval, dt=fixed_dt, method=method, degrees=False)
     # Save arrays to CSV for inspection
     output_df = pd.DataFrame({
         "Interval": interval,
@@ -104,19 +73,10 @@ def plot_position(interval, wsfr, yaw, x_pos, y_pos, psi):
     dot, = ax.plot([], [], 'ro', markersize=8)  # Red dot
     trail, = ax.plot([], [], 'r-', alpha=0.5)   # Red trail
 
-    # Ensure x and y are lists
-    x_data, y_data = [], []
-
-    # Update function for animation
+    # Update function for animation; the trail is a view of the positions so far
     def update(frame):
-        print(x_pos[frame], y_pos[frame])
-        x_data.append(float(x_pos[frame]))  # Store past x positions
-        y_data.append(float(y_pos[frame]))  # Store past y positions
-        #print(x_data, y_data)
-        
         dot.set_data([x_pos[frame]], [y_pos[frame]])  # Move dot
-        trail.set_data(x_data, y_data)  # Update trail
-        #print(dot, trail)
+        trail.set_data(x_pos[:frame + 1], y_pos[:frame + 1])  # Update trail
         return dot, trail
 
     # Create animation
@@ -129,6 +89,6 @@ def plot_position(interval, wsfr, yaw, x_pos, y_pos, psi):
 
 # Run the function
 filepath = "C:/Users/dunca/Documents/TerpsRacing/ActiveAerodynamicsProcessing/TR25-Corner-Sentient/src/eamon.csv"
-interval, wsfr, yaw, x_pos, y_pos, psi = process_csv(filepath)
-plot_position(interval, wsfr, yaw, x_pos, y_pos, psi)
+interval, wsfr, yaw = process_csv(filepath)
+plot_position(interval, wsfr, yaw)
 
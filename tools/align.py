@@ -0,0 +1,138 @@
+import pandas as pd
+import numpy as np
+import argparse as argp
+import glob
+import os
+import time
+from run import get_run
+from laps import read_gate, folder_gate, lap_table, run_track
+
+# Laps on a common distance axis. Each lap (from the lap index of laps.py) is
+# cut out of its run between the interpolated gate crossings, its cumulative
+# arc length is taken from the projected track, and time and channels are
+# resampled onto one distance grid, scaled to each lap's own length so that
+# corners line up even when one lap runs a little wider. Each lap is read with
+# one searchsorted and one set of weights for time and all channels, so a
+# comparison plot can be re-aligned (another reference, another spacing)
+# interactively. Delta time and channel deltas are taken against a reference
+# lap, the fastest by default.
+
+align_channels = ['speed', 'Speed', 'AccelX', 'AccelY', 'TPS', 'FrontBP', 'SteerAng', 'Yaw']
+
+def arc_length(x, y):
+    return np.concatenate([[0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))])
+
+def lap_arrays(path, entry, gate, channels=align_channels):
+    # time (s from the start crossing), distance (m from it) and channels (fixes, channels)
+    # of one lap, from the fix before its start crossing to the fix after its end crossing
+    run = get_run(path)
+    xy, t = run_track(run, gate)
+    s, e = entry['start'] - 1, min(entry['end'] + 1, len(t))
+    t = t[s:e] - entry['start_time']
+    d = arc_length(xy[s:e, 0], xy[s:e, 1])
+    d -= np.interp(0.0, t, d)
+    cols = [run.speed_mph() if c == 'speed' else run.gps[c].to_numpy(dtype=float) if c in run.gps
+            else np.zeros(len(run.gps)) for c in channels]
+    values = np.column_stack(cols)[s:e] if cols else np.zeros((e - s, 0))
+    # standstill repeats a distance; keep the first fix at each one so distance increases strictly
+    keep = np.concatenate([[True], np.diff(d) > 0])
+    return {'time': t[keep], 'distance': d[keep], 'values': values[keep],
+            'length': float(np.interp(entry['time'], t, d)), 'lap_time': entry['time']}
+
+def resample(lap, queries):
+    # time and channels of a lap at the given distances: one searchsorted and one set of
+    # weights for all of them -> (m, 1 + channels)
+    d = lap['distance']
+    F = np.column_stack([lap['time'], lap['values']])
+    q = np.clip(queries, d[0], d[-1])
+    i = np.clip(np.searchsorted(d, q, side='right') - 1, 0, len(d) - 2)
+    w = (q - d[i]) / (d[i+1] - d[i])
+    return F[i] + (F[i+1] - F[i]) * w[:, None]
+
+def align_laps(laps, ref=0, step=1.0, normalize=True, names=align_channels):
+    # laps: lap_arrays dicts. One grid over the reference lap's length; with normalize, every
+    # lap is read at the same fraction of its own length
+    ref_length = laps[ref]['length']
+    distance = np.arange(0, ref_length, step)
+    out = np.stack([resample(lap, distance * (lap['length'] / ref_length if normalize else 1.0)) for lap in laps])
+    t = out[..., 0]
+    channels = {name: out[..., k + 1] for k, name in enumerate(names)}
+    return {
+        'distance': distance, 'time': t, 'delta': t - t[ref],
+        'channels': channels, 'deltas': {name: v - v[ref] for name, v in channels.items()},
+    }
+
+def load_laps(table, gate, channels=align_channels):
+    return [lap_arrays(row['run'], row, gate, channels) for row in table.to_dict('records')]
+
+def plot_delta(aligned, labels, channel='Speed', ref=0):
+    # channel over distance for every lap, and each lap's time delta to the reference
+    import matplotlib.pyplot as plt
+    fig, (ax_ch, ax_dt) = plt.subplots(2, 1, figsize=(12, 8), sharex=True)
+    d = aligned['distance']
+    for k, label in enumerate(labels):
+        lw = 2 if k == ref else 0.8
+        ax_ch.plot(d, aligned['channels'][channel][k], lw=lw, label=label)
+        ax_dt.plot(d, aligned['delta'][k], lw=lw)
+    ax_ch.set_ylabel(channel)
+    ax_ch.legend(fontsize=7, ncol=2)
+    ax_ch.grid(True)
+    ax_dt.set_xlabel('Distance (m) along the reference lap')
+    ax_dt.set_ylabel(f'Delta time (s) to {labels[ref]}')
+    ax_dt.grid(True)
+    fig.tight_layout()
+    return fig
+
+def main(args):
+    gate = read_gate(args.gate or folder_gate(args.input_folders[0]))
+    files = [f for folder in args.input_folders for f in sorted(glob.glob(os.path.join(folder, 'rc_*.csv')))]
+    table = lap_table(files, gate)
+    if table.empty:
+        print(f"no laps through gate {gate.get('name', '')}")
+        return
+    table = pd.concat([table] * args.repeat, ignore_index=True)
+    ref = int(table['time'].idxmin()) if args.reference is None else args.reference
+    t0 = time.perf_counter()
+    laps = load_laps(table, gate)
+    t_load = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    aligned = align_laps(laps, ref, args.step)
+    t_align = time.perf_counter() - t0
+    # against np.interp, one lap and channel at a time
+    q = [aligned['distance'] * lap['length'] / laps[ref]['length'] for lap in laps]
+    err = max(max(np.abs(aligned['time'][k] - np.interp(q[k], lap['distance'], lap['time'])).max(),
+                  max(np.abs(aligned['channels'][c][k] - np.interp(q[k], lap['distance'], lap['values'][:, j])).max()
+                      for j, c in enumerate(align_channels)))
+              for k, lap in enumerate(laps))
+    print(f"{len(laps)} laps ({len(align_channels)} channels) on {len(aligned['distance'])} points every {args.step} m: "
+          f"cut out in {t_load*1000:.0f} ms, aligned in {t_align*1000:.2f} ms, max difference to np.interp {err:.1e}")
+    t0 = time.perf_counter()
+    for r in range(len(laps)):
+        align_laps(laps, r, args.step)
+    elapsed = time.perf_counter() - t0
+    print(f"re-aligned on each of them as reference in {elapsed*1000:.0f} ms ({elapsed/len(laps)*1000:.2f} ms each)")
+
+    labels = [f"{os.path.basename(r)} lap {n}" for r, n in zip(table['run'], table['lap'])]
+    print(f"reference {labels[ref]} ({table['time'][ref]:.2f} s, {laps[ref]['length']:.0f} m)")
+    n = len(table) // args.repeat
+    for k in range(n):
+        print(f"  {labels[k]:16s} {table['time'][k]:6.2f} s  {laps[k]['length']:5.0f} m  "
+              f"delta at the end {aligned['delta'][k, -1]:+6.2f} s  "
+              f"Speed delta {np.mean(aligned['deltas']['Speed'][k]):+5.2f} kph on average")
+    if args.show_plot == 'y':
+        import matplotlib.pyplot as plt
+        plot_delta({**aligned, 'channels': {c: v[:n] for c, v in aligned['channels'].items()}, 'delta': aligned['delta'][:n]},
+                   labels[:n], ref=ref % n)
+        plt.show()
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Resample laps onto a common distance grid and compare them with a reference lap")
+    parser.add_argument("input_folders", nargs='+', help="test folders, e.g. 'data/test 10'")
+    parser.add_argument("-g", "--gate", default=None, help="gate file (default: data/gates/<first folder>.json)")
+    parser.add_argument("-r", "--reference", type=int, default=None, help="row of the reference lap (default: the fastest)")
+    parser.add_argument("-d", "--step", type=float, default=1.0, help="grid spacing (m)")
+    parser.add_argument("-n", "--repeat", type=int, default=1, help="align the laps this many times over (benchmark)")
+    parser.add_argument("-s", "--show_plot", default='n', choices=['y', 'n'], help="show speed and delta time over distance")
+    args = parser.parse_args()
+    main(args)
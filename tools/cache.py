@@ -0,0 +1,177 @@
+import pandas as pd
+import numpy as np
+import argparse as argp
+import hashlib
+import json
+import os
+import shutil
+import time
+import glob
+from log2dat import read_log, schema_for, typed_frame
+
+# Parsed runs are cached as one columnar data.bin per run (each channel stored
+# contiguously at its own typed offset) plus a meta.json holding the column
+# order, dtypes and offsets. Entries are keyed by the absolute path, size and
+# mtime of the source, so editing or replacing a log invalidates its entry.
+# meta.json also records cache_format; entries written by another version of
+# the parsers (log2dat.typed_frame, narrow_dtype, ...) are parsed again.
+
+cache_root = os.environ.get('TR25_CACHE', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache'))
+
+# bump whenever parsing or the entry layout changes what an entry holds
+cache_format = 2
+
+def cache_key(path):
+    st = os.stat(path)
+    ident = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+    return hashlib.sha1(ident.encode()).hexdigest()
+
+def entry_dir(path, kind='runs'):
+    return os.path.join(cache_root, kind, cache_key(path))
+
+def parse(path, typed=False):
+    if path.endswith('.log'):
+        return read_log(path, typed)
+    df = pd.read_csv(path)
+    return typed_frame(df, schema_for(path)) if typed else df
+
+def write_entry(df, entry, source):
+    # build the entry in a temp dir and rename it into place so readers never see half an entry
+    tmp = f"{entry}.tmp{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    cols = []
+    offset = 0
+    def put(f, arr):
+        nonlocal offset
+        start = offset
+        f.write(arr.tobytes())
+        offset += arr.nbytes
+        pad = -offset % 8  # keep every channel 8-byte aligned
+        f.write(b'\0' * pad)
+        offset += pad
+        return start
+
+    with open(os.path.join(tmp, 'data.bin'), 'wb') as f:
+        for col in df.columns:
+            series = df[col]
+            entry_col = {'name': str(col)}
+            if pd.api.types.is_extension_array_dtype(series.dtype) and series.dtype.kind in 'iu':
+                # nullable integer channels: values and gap mask stored side by side
+                arr = series.to_numpy(dtype=series.dtype.numpy_dtype, na_value=0)
+                entry_col['nullable'] = series.dtype.name
+                entry_col['mask_offset'] = put(f, np.ascontiguousarray(series.isna().to_numpy()))
+            else:
+                arr = series.to_numpy()
+                if arr.dtype == object:
+                    arr = arr.astype(str)
+            arr = np.ascontiguousarray(arr)
+            entry_col['dtype'] = arr.dtype.str
+            entry_col['offset'] = put(f, arr)
+            cols.append(entry_col)
+    meta = {
+        'format': cache_format,
+        'source': os.path.abspath(source),
+        'rows': len(df),
+        'columns': cols,
+        'attrs': df.attrs,
+    }
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    # a refreshed or outdated entry is moved aside first: os.replace will not overwrite a non-empty dir
+    old = f"{entry}.old{os.getpid()}"
+    try:
+        os.replace(entry, old)
+    except FileNotFoundError:
+        pass
+    try:
+        os.replace(tmp, entry)
+    except OSError:
+        # only fine if another process finished the same entry first
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not entry_current(entry):
+            raise
+    finally:
+        shutil.rmtree(old, ignore_errors=True)
+
+def read_meta(entry):
+    with open(os.path.join(entry, 'meta.json')) as f:
+        return json.load(f)
+
+def entry_current(entry):
+    # the entry exists and was written by this version of the parsers
+    try:
+        return read_meta(entry).get('format') == cache_format
+    except (OSError, ValueError):
+        return False
+
+def read_entry(entry, columns=None):
+    meta = read_meta(entry)
+    path = os.path.join(entry, 'data.bin')
+    if columns is None:
+        buf = np.fromfile(path, dtype=np.uint8)
+        wanted = meta['columns']
+    else:
+        # only the pages of the requested channels get read
+        buf = np.memmap(path, dtype=np.uint8, mode='c') if os.path.getsize(path) else np.empty(0, np.uint8)
+        by_name = {c['name']: c for c in meta['columns']}
+        wanted = [by_name[c] for c in columns]
+    data = {}
+    for c in wanted:
+        arr = np.frombuffer(buf, dtype=np.dtype(c['dtype']), count=meta['rows'], offset=c['offset'])
+        if arr.dtype.kind == 'U':
+            arr = arr.astype(object)
+        if 'nullable' in c:
+            mask = np.frombuffer(buf, dtype=bool, count=meta['rows'], offset=c['mask_offset'])
+            arr = pd.array(arr, dtype=c['nullable']).copy()
+            arr[mask] = pd.NA
+        data[c['name']] = arr
+    df = pd.DataFrame(data, columns=[c['name'] for c in wanted], copy=False)
+    df.attrs.update(meta.get('attrs', {}))
+    return df
+
+def load_run(path, columns=None, refresh=False, typed=False):
+    # drop-in for pd.read_csv / read_log that parses each file only once;
+    # typed=True narrows every channel using the log header (see log2dat.typed_frame)
+    entry = entry_dir(path, 'typed' if typed else 'runs')
+    if refresh or not entry_current(entry):
+        df = parse(path, typed)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        write_entry(df, entry, path)
+        return df if columns is None else df[columns]
+    return read_entry(entry, columns)
+
+def clear(paths):
+    for path in paths:
+        for kind in ('runs', 'typed'):
+            shutil.rmtree(entry_dir(path, kind), ignore_errors=True)
+
+def main(args):
+    files = []
+    for folder in args.input_folders:
+        files += sorted(glob.glob(os.path.join(folder, '*.csv')))
+        files += sorted(glob.glob(os.path.join(folder, 'logfiles', '*.log')))
+    clear(files)
+
+    t0 = time.perf_counter()
+    for f in files:
+        load_run(f)
+    cold = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for f in files:
+        load_run(f)
+    warm = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for f in files:
+        load_run(f, columns=['Interval', 'Latitude', 'Longitude', 'Speed'])
+    subset = time.perf_counter() - t0
+
+    print(f"{len(files)} files: cold {cold:.2f} s, warm {warm:.3f} s ({cold/warm:.0f}x), "
+          f"4-channel warm {subset:.3f} s ({cold/subset:.0f}x)")
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Benchmark cold vs warm run loads through the binary cache")
+    parser.add_argument("input_folders", nargs='+', help="test folders, e.g. 'data/test 5'")
+    args = parser.parse_args()
+    main(args)
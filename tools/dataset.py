@@ -0,0 +1,176 @@
+import numpy as np
+import argparse as argp
+import json
+import os
+import queue
+import resource
+import threading
+import time
+from numpy.lib.format import open_memmap
+
+# Training store for the windows written by features.py. The shards are copied
+# once into one memory-mapped .npy per field (X, y, region, state, run, center) plus
+# index.json, which holds the [start, end) rows of every run and of every
+# labeled stretch (consecutive windows of one segment type) within it, and the
+# per-feature mean/std for normalization. Nothing has to fit in RAM: the
+# loader hands out mini-batches as slices of the memory maps (views, not
+# copies), shuffled by block, and can fault the next batches in from disk on
+# a background thread while the current one trains.
+
+fields = ['X', 'y', 'region', 'state', 'run', 'center']
+
+def build_store(feature_dir, store_dir):
+    with open(os.path.join(feature_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    total = sum(s['windows'] for s in manifest['shards'])
+    first = np.load(os.path.join(feature_dir, manifest['shards'][0]['file']))
+    os.makedirs(store_dir, exist_ok=True)
+    arrays = {k: open_memmap(os.path.join(store_dir, f'{k}.npy'), mode='w+', dtype=first[k].dtype,
+                             shape=(total,) + first[k].shape[1:]) for k in fields}
+    # shards are copied one at a time; sums for the normalization in float64
+    pos = 0
+    s1 = np.zeros(first['X'].shape[1:])
+    s2 = np.zeros(first['X'].shape[1:])
+    for shard in manifest['shards']:
+        data = np.load(os.path.join(feature_dir, shard['file']))
+        n = len(data['y'])
+        for k in fields:
+            arrays[k][pos:pos + n] = data[k]
+        X = data['X'].astype(np.float64)
+        s1 += X.sum(axis=0)
+        s2 += (X**2).sum(axis=0)
+        pos += n
+    for arr in arrays.values():
+        arr.flush()
+    mean = s1 / max(total, 1)
+    std = np.sqrt(np.maximum(s2 / max(total, 1) - mean**2, 0))
+
+    # run and labeled-stretch offsets; rows are grouped by run in manifest order
+    run, y = np.asarray(arrays['run']), np.asarray(arrays['y'])
+    run_starts = np.searchsorted(run, np.arange(len(manifest['runs'])), side='left')
+    run_ends = np.searchsorted(run, np.arange(len(manifest['runs'])), side='right')
+    cut = np.flatnonzero((run[1:] != run[:-1]) | (y[1:] != y[:-1])) + 1
+    seg_starts = np.concatenate([[0], cut]) if total else np.zeros(0, dtype=int)
+    seg_ends = np.append(cut, total) if total else np.zeros(0, dtype=int)
+    index = {
+        'windows': int(total),
+        'channels': manifest['channels'], 'stats': manifest['stats'],
+        'window': manifest['window'], 'stride': manifest['stride'],
+        'labels': manifest['labels'], 'states': manifest['states'], 'regions': manifest['regions'],
+        'mean': mean.tolist(), 'std': std.tolist(),
+        'runs': [{'path': p, 'start': int(s), 'end': int(e)} for p, s, e in zip(manifest['runs'], run_starts, run_ends)],
+        'segments': [[int(s), int(e), int(y[s])] for s, e in zip(seg_starts, seg_ends)],
+    }
+    with open(os.path.join(store_dir, 'index.json'), 'w') as f:
+        json.dump(index, f)
+    return index
+
+class Store:
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, 'index.json')) as f:
+            self.index = json.load(f)
+        # read-only memory maps; slicing them never copies
+        for k in fields:
+            setattr(self, k, np.load(os.path.join(store_dir, f'{k}.npy'), mmap_mode='r'))
+        self.mean = np.array(self.index['mean'], dtype=np.float32)
+        self.std = np.array(self.index['std'], dtype=np.float32)
+        self.std[self.std == 0] = 1
+
+    def __len__(self):
+        return self.index['windows']
+
+    def run_ranges(self, runs=None):
+        # [start, end) rows of the given run ids (default all)
+        runs = range(len(self.index['runs'])) if runs is None else runs
+        return [(self.index['runs'][r]['start'], self.index['runs'][r]['end']) for r in runs]
+
+    def loader(self, batch_size=256, runs=None, shuffle=True, seed=0, prefetch=0, fields=('X', 'y')):
+        return Loader(self, batch_size, self.run_ranges(runs), shuffle, seed, prefetch, fields)
+
+class Loader:
+    # mini-batches (X, y by default) as contiguous slices of the store. Shuffling
+    # permutes the order of the batch-sized blocks each epoch (and where they
+    # start, by a random offset), so every batch stays a zero-copy view.
+    def __init__(self, store, batch_size, ranges, shuffle=True, seed=0, prefetch=0, fields=('X', 'y')):
+        self.store, self.batch_size, self.ranges = store, batch_size, ranges
+        self.shuffle, self.prefetch, self.fields = shuffle, prefetch, fields
+        self.rng = np.random.default_rng(seed)
+
+    def blocks(self):
+        starts, ends = [], []
+        for s, e in self.ranges:
+            offset = int(self.rng.integers(self.batch_size)) if self.shuffle and e - s > self.batch_size else 0
+            edges = np.unique(np.concatenate([[s], np.arange(s + offset, e, self.batch_size), [e]]))
+            starts.append(edges[:-1])
+            ends.append(edges[1:])
+        starts, ends = np.concatenate(starts or [[]]).astype(int), np.concatenate(ends or [[]]).astype(int)
+        order = self.rng.permutation(len(starts)) if self.shuffle else np.arange(len(starts))
+        return starts[order], ends[order]
+
+    def batches(self):
+        arrays = [getattr(self.store, k) for k in self.fields]
+        for s, e in zip(*self.blocks()):
+            yield tuple(arr[s:e] for arr in arrays)
+
+    def __iter__(self):
+        if not self.prefetch:
+            return self.batches()
+        return prefetched(self.batches(), self.prefetch)
+
+def touch(arr):
+    # read one value per page so the OS has the batch in memory before it is used
+    flat = arr.reshape(-1)
+    step = max(1, 4096 // arr.itemsize)
+    return flat[::step].sum() if flat.size else 0
+
+def prefetched(batches, depth):
+    # runs the batch iterator `depth` batches ahead on a background thread
+    q = queue.Queue(maxsize=depth)
+    done = object()
+    def worker():
+        for batch in batches:
+            touch(batch[0])
+            q.put(batch)
+        q.put(done)
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    while True:
+        item = q.get()
+        if item is done:
+            return
+        yield item
+
+def main(args):
+    t0 = time.perf_counter()
+    index = build_store(args.feature_folder, args.store_folder)
+    print(f"store of {index['windows']} windows, {len(index['runs'])} runs, {len(index['segments'])} labeled stretches "
+          f"built in {time.perf_counter() - t0:.2f} s at {args.store_folder}")
+
+    store = Store(args.store_folder)
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for prefetch in [0, args.prefetch]:
+        loader = store.loader(args.batch_size, prefetch=prefetch)
+        t0 = time.perf_counter()
+        seen, batches, views, total = 0, 0, 0, 0.0
+        for _ in range(args.epochs):
+            for X, y in loader:
+                # stand-in for a training step: normalize the batch and reduce it
+                total += float((((X - store.mean) / store.std)**2).mean())
+                seen += len(y)
+                batches += 1
+                views += np.shares_memory(X, store.X)
+        elapsed = time.perf_counter() - t0
+        print(f"prefetch {prefetch}: {args.epochs} epochs, {seen} windows in {elapsed:.2f} s "
+              f"({seen/elapsed:,.0f} windows/s), {views} of {batches} batches are views of the store")
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"peak RSS grew by {(rss - rss0)/1024:.1f} MB while iterating; store is {store.X.nbytes/1e6:.1f} MB")
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Build the memory-mapped training store from feature shards and time the loader")
+    parser.add_argument("-i", "--feature_folder", default=os.path.join('.cache', 'features'), help="features.py output")
+    parser.add_argument("-o", "--store_folder", default=os.path.join('.cache', 'dataset'), help="folder for the .npy files and index.json")
+    parser.add_argument("-b", "--batch_size", type=int, default=256, help="windows per batch")
+    parser.add_argument("-e", "--epochs", type=int, default=5, help="epochs to iterate in the benchmark")
+    parser.add_argument("-p", "--prefetch", type=int, default=4, help="batches to prefetch on a background thread")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,200 @@
+import numpy as np
+import argparse as argp
+import glob
+import os
+import time
+from run import get_run
+
+# Level-of-detail tracks for plotting. Douglas-Peucker is run once per run,
+# recording for every fix the tolerance at which it would first be kept (its
+# importance, clamped to the importance of the split above it so the levels
+# nest). Any level is then one comparison over that array: the fixes with
+# importance at or above the tolerance are exactly what Douglas-Peucker would
+# keep at it. Distances are measured in pixels of a full-run plot, with the
+# color channels as extra dimensions scaled so that a small fraction of their
+# color range weighs as much as a pixel, so a decimated track keeps the
+# peaks and dips of the colors as well as the shape. Fixes where a
+# categorical channel (the FSM state) changes are always kept.
+
+lod_params = {
+    'width': 600,        # pixels across a plot of the whole run
+    'pixel': 0.5,        # tolerance, in pixels of that plot or of the viewport
+    'color': 0.2,        # color deviation (fraction of the 5-95% range) worth 'pixel'
+    'floor': 0.05,       # importance below this (pixels) is not resolved
+}
+
+def chord_distance(points, a, b):
+    # distance of each point to the segment a-b, in as many dimensions as the points have
+    v = b - a
+    w = points - a
+    vv = v @ v
+    t = np.clip(w @ v / vv, 0, 1) if vv > 0 else np.zeros(len(points))
+    return np.sqrt(((w - t[:, None] * v)**2).sum(axis=1))
+
+def importance(points, breaks=(), floor=0.0):
+    # Douglas-Peucker importance of every point; ends and breaks are always kept (inf)
+    n = len(points)
+    imp = np.zeros(n)
+    fixed = np.unique(np.concatenate([[0, n - 1], np.asarray(breaks, dtype=int)])) if n else np.zeros(0, int)
+    imp[fixed] = np.inf
+    stack = [(a, b, np.inf) for a, b in zip(fixed[:-1], fixed[1:])]
+    while stack:
+        a, b, parent = stack.pop()
+        if b - a < 2:
+            continue
+        dist = chord_distance(points[a+1:b], points[a], points[b])
+        m = int(np.argmax(dist))
+        d = min(dist[m], parent)
+        if d < floor:
+            continue
+        k = a + 1 + m
+        imp[k] = d
+        stack.append((a, k, d))
+        stack.append((k, b, d))
+    return imp
+
+def importance_loop(points, tol):
+    # reference: recursive Douglas-Peucker at one tolerance, returns the kept indices
+    def simplify(a, b):
+        if b - a < 2:
+            return [a]
+        best, k = -1.0, a
+        for i in range(a + 1, b):
+            d = chord_distance(points[i:i+1], points[a], points[b])[0]
+            if d > best:
+                best, k = d, i
+        if best < tol:
+            return [a]
+        return simplify(a, k) + simplify(k, b)
+    return np.array(simplify(0, len(points) - 1) + [len(points) - 1]) if len(points) > 1 else np.arange(len(points))
+
+class TrackLOD:
+    # x/y with continuous color channels (name -> values per fix) and categorical ones
+    # whose changes are always kept
+    def __init__(self, x, y, channels=None, categories=None, p=lod_params):
+        self.x, self.y, self.p = np.asarray(x, float), np.asarray(y, float), p
+        extent = max(np.ptp(self.x) if len(self.x) else 0, np.ptp(self.y) if len(self.y) else 0, 1e-9)
+        self.px = p['width'] / extent                    # full-view pixels per meter
+        dims = [self.x * self.px, self.y * self.px]
+        for values in (channels or {}).values():
+            values = np.nan_to_num(np.asarray(values, float))
+            lo, hi = np.percentile(values, [5, 95]) if len(values) else (0, 0)
+            if hi > lo:
+                dims.append(values * p['pixel'] / (p['color'] * (hi - lo)))
+        breaks = []
+        for values in (categories or {}).values():
+            change = np.flatnonzero(np.diff(np.asarray(values)) != 0) + 1
+            breaks += [change - 1, change]
+        breaks = np.concatenate(breaks) if breaks else np.zeros(0, int)
+        self.importance = importance(np.column_stack(dims), breaks, p['floor'])
+
+    def level(self, pixel=None):
+        # indices of the fixes kept at a tolerance (pixels of the full-run plot)
+        return np.flatnonzero(self.importance >= (self.p['pixel'] if pixel is None else pixel))
+
+    def view(self, xlim, ylim, width_px=None, pixel=None):
+        # segments to draw for a viewport as (start, end) fix indices: the tolerance shrinks with
+        # the zoom, and a segment of the level is kept when its bounding box overlaps the view
+        width_px = width_px or self.p['width']
+        scale = (xlim[1] - xlim[0]) * self.px / width_px   # full-view pixels per viewport pixel (equal aspect)
+        idx = self.level((self.p['pixel'] if pixel is None else pixel) * scale)
+        a, b = idx[:-1], idx[1:]
+        xa, xb, ya, yb = self.x[a], self.x[b], self.y[a], self.y[b]
+        keep = ((np.minimum(xa, xb) <= xlim[1]) & (np.maximum(xa, xb) >= xlim[0])
+                & (np.minimum(ya, yb) <= ylim[1]) & (np.maximum(ya, yb) >= ylim[0]))
+        return a[keep], b[keep]
+
+    def segments(self, idx, end=None):
+        # (n, 2, 2) segments joining consecutive fixes of idx, or idx[k] to end[k]
+        a, b = (idx[:-1], idx[1:]) if end is None else (idx, end)
+        return np.stack([np.column_stack([self.x[a], self.y[a]]), np.column_stack([self.x[b], self.y[b]])], axis=1)
+
+def run_lod(run, origin=None):
+    # the track of a run with the channels its views color it by
+    xs, ys = run.track(origin)
+    channels = {'speed': run.speed_mph(origin), 'accel': run.accel(origin), 'curvature': np.abs(run.curvature(origin))}
+    return TrackLOD(xs, ys, channels, {'state': run.states})
+
+def follow_view(ax, lod, collections):
+    # re-decimate the line collections for the current view when they are drawn, so a zoom or
+    # pan (which changes both limits) is decimated once; collections: [(LineCollection, values
+    # per fix)], a segment takes the value at its end
+    limits = [None]
+    def update():
+        view = (tuple(ax.get_xlim()), tuple(ax.get_ylim()), ax.bbox.width)
+        if view == limits[0]:
+            return
+        limits[0] = view
+        a, b = lod.view(*view)
+        segs = lod.segments(a, b)
+        for lc, values in collections:
+            lc.set_segments(segs)
+            lc.set_array(np.asarray(values)[b])
+    for lc, _ in collections:
+        def draw(renderer, draw=lc.draw):
+            update()
+            return draw(renderer)
+        lc.draw = draw
+    return update
+
+def main(args):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from vis_all import plot_all_metrics
+
+    files = []
+    for name in args.inputs:
+        files += sorted(glob.glob(os.path.join(name, 'rc_*.csv'))) if os.path.isdir(name) else [name]
+    runs = sorted((get_run(f) for f in files), key=lambda r: -len(r.gps))[:args.count]
+
+    # importance against recursive Douglas-Peucker at the default tolerance, on the longest run
+    run = runs[0]
+    t0 = time.perf_counter()
+    lod = run.lod()
+    t_build = time.perf_counter() - t0
+    xs, ys = run.track()
+    pts = np.column_stack([xs * lod.px, ys * lod.px])
+    t0 = time.perf_counter()
+    ref = importance_loop(pts, lod_params['pixel'])
+    t_loop = time.perf_counter() - t0
+    same = np.array_equal(ref, TrackLOD(xs, ys).level())
+    print(f"{os.path.basename(run.path)}: {len(xs)} fixes, importance in {t_build*1000:.0f} ms, "
+          f"recursive Douglas-Peucker at one tolerance {t_loop*1000:.0f} ms, kept sets {'identical' if same else 'DIFFERENT'}")
+    for pixel in [2.0, 1.0, 0.5, 0.25, 0.1]:
+        t0 = time.perf_counter()
+        idx = lod.level(pixel)
+        print(f"  level {pixel:4} px: {len(idx) - 1:5d} segments of {len(xs) - 1} ({(time.perf_counter() - t0)*1e6:.0f} us)")
+
+    # vis_all with every segment against the level for the figure, drawn and compared pixel by pixel
+    total = {True: 0.0, False: 0.0}
+    for run in runs:
+        images = {}
+        for decimated in (False, True):
+            t0 = time.perf_counter()
+            try:
+                fig = plot_all_metrics(run, decimate=decimated)
+            except ValueError as e:
+                # accel percentiles that do not straddle 0 (see run.py)
+                print(f"{run.path}: skipped ({e})")
+                break
+            fig.canvas.draw()
+            total[decimated] += time.perf_counter() - t0
+            drawn = len(fig.axes[0].collections[0].get_segments())
+            images[decimated] = np.asarray(fig.canvas.buffer_rgba())[..., :3].astype(int)
+            plt.close(fig)
+        if len(images) < 2:
+            continue
+        diff = np.abs(images[True] - images[False]).max(axis=-1)
+        print(f"{os.path.basename(os.path.dirname(run.path))}/{os.path.basename(run.path)}: "
+              f"{len(run.gps) - 1} -> {drawn} segments drawn, "
+              f"{(diff > 32).mean()*100:.3f}% of pixels differ visibly, {(diff > 0).mean()*100:.2f}% at all")
+    print(f"vis_all on {len(runs)} runs: every segment {total[False]:.2f} s, decimated {total[True]:.2f} s "
+          f"(building the levels included)")
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Decimate tracks into nested levels of detail and compare vis_all with and without them")
+    parser.add_argument("inputs", nargs='+', help="csvs or folders of rc_*.csv")
+    parser.add_argument("-n", "--count", type=int, default=5, help="longest runs to compare")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,170 @@
+import pandas as pd
+import numpy as np
+import argparse as argp
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from numpy.lib.stride_tricks import sliding_window_view
+from run import Run, wheel_cols
+from segment import segment_table, fix_labels, segment_types
+from regions import read_map, map_index, map_xy
+
+# Sliding-window features for training. Each run's channels, aligned at its
+# GPS fixes, are viewed as overlapping windows through a strided view (no copy
+# per window); per-window statistics are reduced from that view into a
+# float32 tensor of shape (windows, channels, stats). Each window is labeled
+# with the segment type (segment.py) and, given a region map, the region of
+# its center fix, and with the FSM state at its last fix. Runs are processed in parallel and written out in shards of
+# bounded size, so memory does not grow with the number of runs.
+
+feature_channels = ['AccelX', 'AccelY', 'Yaw', 'SteerAng', 'TPS', 'FrontBP', 'Speed'] + wheel_cols + ['curvature']
+stat_names = ['mean', 'std', 'min', 'max', 'delta', 'last']
+
+def run_channels(run):
+    # (fixes, channels) float32 matrix; channels a run does not log are 0
+    gps = run.gps
+    cols = [gps[c].to_numpy(dtype=np.float32) if c in gps else np.zeros(len(gps), dtype=np.float32)
+            for c in feature_channels[:-1]]
+    cols.append(run.curvature().astype(np.float32))
+    return np.column_stack(cols) if len(gps) else np.zeros((0, len(feature_channels)), dtype=np.float32)
+
+def window_stats(channels, window, stride):
+    # (windows, channels, stats) from a strided view of (fixes, channels)
+    if len(channels) < window:
+        return np.zeros((0, channels.shape[1], len(stat_names)), dtype=np.float32)
+    view = sliding_window_view(channels, window, axis=0)[::stride]   # (windows, channels, window), a view
+    out = np.empty(view.shape[:2] + (len(stat_names),), dtype=np.float32)
+    np.mean(view, axis=-1, out=out[..., 0])
+    np.std(view, axis=-1, out=out[..., 1])
+    np.min(view, axis=-1, out=out[..., 2])
+    np.max(view, axis=-1, out=out[..., 3])
+    np.subtract(view[..., -1], view[..., 0], out=out[..., 4])
+    out[..., 5] = view[..., -1]
+    return out
+
+def window_stats_loop(channels, window, stride):
+    # reference: one copied window at a time
+    out = []
+    for start in range(0, len(channels) - window + 1, stride):
+        w = channels[start:start + window].copy()
+        out.append(np.stack([w.mean(0), w.std(0), w.min(0), w.max(0), w[-1] - w[0], w[-1]], axis=-1))
+    return np.array(out, dtype=np.float32).reshape(-1, channels.shape[1], len(stat_names))
+
+def run_features(path, window=20, stride=5, region_map=None):
+    # features, segment label codes, region label codes (-1 without a map), FSM state at
+    # the last fix and center fix of each window
+    # a Run of its own rather than get_run, whose memo would keep every run a worker has seen
+    run = Run(path)
+    X = window_stats(run_channels(run), window, stride)
+    center = np.arange(len(X), dtype=np.int32) * stride + window // 2
+    n = len(run.gps)
+    seg = fix_labels(segment_table(run), n)
+    codes = {t: i for i, t in enumerate(segment_types)}
+    y = np.array([codes[t] for t in seg], dtype=np.int8)[center] if len(X) else np.zeros(0, dtype=np.int8)
+    region = np.full(len(X), -1, dtype=np.int16)
+    if region_map is not None and len(X):
+        # labeled at the fixes of Run.gps (time ordered, unlike the raw rows label_run caches)
+        region = map_index(region_map).label_codes(map_xy(run.gps.iloc[center], region_map)).astype(np.int16)
+    last = np.arange(len(X)) * stride + window - 1
+    state = run.states[last].astype(np.int8)
+    return {'X': X, 'y': y, 'region': region, 'state': state, 'center': center}
+
+def bounded_map(pool, fn, items, ahead):
+    # like pool.map, but with at most `ahead` results waiting, so memory stays bounded
+    items = iter(items)
+    pending = [pool.submit(fn, item) for _, item in zip(range(ahead), items)]
+    while pending:
+        result = pending.pop(0).result()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            break
+        yield result
+
+def _features(job):
+    path, window, stride, region_map = job
+    return path, run_features(path, window, stride, region_map)
+
+class ShardWriter:
+    # collects windows and writes shard_NNNNN.npz files of at most shard_size windows
+    def __init__(self, out_dir, shard_size):
+        self.out_dir, self.shard_size = out_dir, shard_size
+        self.parts, self.count, self.shards = [], 0, []
+        os.makedirs(out_dir, exist_ok=True)
+
+    def add(self, run_id, fields):
+        n = len(fields['X'])
+        self.parts.append(dict(fields, run=np.full(n, run_id, dtype=np.int32)))
+        self.count += n
+        while self.count >= self.shard_size:
+            self.write(self.shard_size)
+
+    def write(self, n):
+        joined = {k: np.concatenate([part[k] for part in self.parts]) for k in self.parts[0]}
+        total = len(joined['X'])
+        name = f"shard_{len(self.shards):05d}.npz"
+        np.savez(os.path.join(self.out_dir, name), **{k: v[:n] for k, v in joined.items()})
+        self.shards.append({'file': name, 'windows': int(min(n, total))})
+        self.parts = [{k: v[n:] for k, v in joined.items()}] if total > n else []
+        self.count = total - min(n, total)
+
+    def close(self):
+        if self.count:
+            self.write(self.count)
+
+def write_features(files, out_dir, window=20, stride=5, shard_size=65536, region_map=None, workers=None):
+    writer = ShardWriter(out_dir, shard_size)
+    jobs = [(f, window, stride, region_map) for f in files]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for run_id, (path, feats) in enumerate(bounded_map(pool, _features, jobs, 2 * (workers or os.cpu_count() or 1))):
+            writer.add(run_id, feats)
+    writer.close()
+    manifest = {
+        'channels': feature_channels, 'stats': stat_names, 'window': window, 'stride': stride,
+        'labels': segment_types, 'states': 3,
+        'regions': [r['name'] for r in region_map['regions']] if region_map is not None else [],
+        'runs': files, 'shards': writer.shards,
+    }
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+def main(args):
+    folders = args.input_folders or sorted(glob.glob(os.path.join('data', 'test *')))
+    files = [f for folder in folders for f in sorted(glob.glob(os.path.join(folder, 'rc_*.csv')))]
+    region_map = read_map(args.region_map) if args.region_map is not None else None
+
+    # strided statistics against copying each window, on the longest run
+    channels = max((run_channels(Run(f)) for f in files[:10]), key=len)
+    t0 = time.perf_counter()
+    ref = window_stats_loop(channels, args.window, args.stride)
+    t_loop = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    out = window_stats(channels, args.window, args.stride)
+    t_view = time.perf_counter() - t0
+    print(f"{len(out)} windows: copy per window {t_loop*1000:.1f} ms, strided view {t_view*1000:.2f} ms, "
+          f"max difference {np.abs(out - ref).max():.1e}")
+
+    t0 = time.perf_counter()
+    manifest = write_features(files, args.output_folder, args.window, args.stride, args.shard_size, region_map, args.workers)
+    elapsed = time.perf_counter() - t0
+    total = sum(s['windows'] for s in manifest['shards'])
+    size = sum(os.path.getsize(os.path.join(args.output_folder, s['file'])) for s in manifest['shards'])
+    print(f"{len(files)} runs -> {total} windows of {len(feature_channels)}x{len(stat_names)} float32 "
+          f"in {len(manifest['shards'])} shards ({size/1e6:.1f} MB) in {elapsed:.2f} s, at {args.output_folder}")
+    counts = np.bincount(np.concatenate([np.load(os.path.join(args.output_folder, s['file']))['y'] for s in manifest['shards']]),
+                         minlength=len(segment_types))
+    print('  ' + ', '.join(f"{t} {c}" for t, c in zip(segment_types, counts)))
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Extract sliding-window features and labels from every run into training shards")
+    parser.add_argument("-i", "--input_folders", nargs='*', default=None, help="test folders (default: data/test *)")
+    parser.add_argument("-o", "--output_folder", default=os.path.join('.cache', 'features'), help="folder for the shards and manifest.json")
+    parser.add_argument("-n", "--window", type=int, default=20, help="fixes per window")
+    parser.add_argument("-s", "--stride", type=int, default=5, help="fixes between window starts")
+    parser.add_argument("--shard_size", type=int, default=65536, help="windows per shard")
+    parser.add_argument("-m", "--region_map", default=None, help="also label windows with this region map (json)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args()
+    main(args)
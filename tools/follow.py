@@ -0,0 +1,217 @@
+import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
+import argparse as argp
+import io
+import os
+import threading
+import time
+from log2dat import read_header
+from stream import RunStream, stream_cols
+
+# Follow a .log that is still being written. Only the bytes appended since the
+# last poll are parsed; a partial last line is kept until its newline arrives.
+# Each batch of new rows goes through the same incremental pipeline as
+# stream.py (projection, speed, curvature, FSM state). A log that is
+# truncated or replaced (a new inode) starts a new session with a fresh
+# RunStream.
+
+class LogTail:
+    def __init__(self, path):
+        self.path = path
+        self.columns = None
+        self.offset = 0
+        self.partial = b''
+        self.inode = None
+
+    def poll(self):
+        # (new complete rows since the last call or None if nothing was appended,
+        #  whether the file was truncated or replaced since the last call)
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None, False
+        size = st.st_size
+        reset = self.inode is not None and (st.st_ino != self.inode or size < self.offset)
+        if reset:
+            # a new session: start over from its header
+            self.columns, self.offset, self.partial = None, 0, b''
+        self.inode = st.st_ino
+        if size == self.offset:
+            return None, reset
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = self.partial + f.read(size - self.offset)
+        self.offset = size
+        cut = data.rfind(b'\n') + 1
+        data, self.partial = data[:cut], data[cut:]
+        if self.columns is None:
+            if not data:
+                return None, reset
+            # the header is the first line; read_header also numbers duplicate names
+            self.columns = [c.name for c in read_header(self.path)]
+            data = data[data.find(b'\n') + 1:]
+        if not data.strip():
+            return None, reset
+        rows = pd.read_csv(io.BytesIO(data), names=self.columns, delimiter=',', na_values=['', ' '], on_bad_lines='warn')
+        return rows[stream_cols], reset
+
+def replay_log(src, dst, speed=1.0):
+    # write src into dst at the pace given by its Interval column, one 50 Hz row at a time
+    with open(src) as f:
+        header = f.readline()
+        lines = f.read().splitlines()
+    with open(dst, 'w') as out:
+        out.write(header)
+        out.flush()
+        t_start = time.perf_counter()
+        t0 = None
+        for line in lines:
+            try:
+                t = float(line.split(',', 1)[0])
+            except ValueError:
+                t = None
+            if t is not None:
+                t0 = t if t0 is None else t0
+                wait = (t - t0) / 1000.0 / speed - (time.perf_counter() - t_start)
+                if wait > 0:
+                    time.sleep(wait)
+            out.write(line + '\n')
+            out.flush()
+
+class LivePlot:
+    colors = np.array(['tab:red', 'tab:orange', 'tab:green'])
+
+    def __init__(self):
+        plt.ion()
+        self.fig, self.ax = plt.subplots(figsize=(8, 8))
+        self.ax.set_aspect('equal', 'box')
+        self.ax.set_title('FSM state (0 max downforce, 1 medium, 2 low drag)')
+        self.ax.set_xlabel('x (m)')
+        self.ax.set_ylabel('y (m)')
+        self.points = self.ax.scatter([], [], s=6)
+        self.head, = self.ax.plot([], [], 'ko', markersize=8)
+        self.text = self.ax.text(0.02, 0.98, '', transform=self.ax.transAxes, va='top')
+        self.reset()
+
+    def reset(self):
+        # final fixes so far in buffers that double when full, so a session appends in O(n)
+        self.xy = np.empty((1024, 2))
+        self.state = np.empty(1024, dtype=int)
+        self.n = 0
+
+    def append(self, xy, state):
+        # returns the filled part of the buffers with xy/state added after it
+        end = self.n + len(xy)
+        if end > len(self.xy):
+            size = max(end, 2 * len(self.xy))
+            self.xy = np.concatenate([self.xy[:self.n], np.empty((size - self.n, 2))])
+            self.state = np.concatenate([self.state[:self.n], np.empty(size - self.n, dtype=int)])
+        self.xy[self.n:end] = xy
+        self.state[self.n:end] = state
+        return self.xy[:end], self.state[:end]
+
+    def update(self, final, live):
+        if final is not None and len(final):
+            self.append(final[['x', 'y']].to_numpy(), final['state'].to_numpy())
+            self.n += len(final)
+        # the provisional rows go after the final ones without being kept
+        if live is not None:
+            xy, state = self.append(live[['x', 'y']].to_numpy(), live['state'].to_numpy())
+        else:
+            xy, state = self.xy[:self.n], self.state[:self.n]
+        if not len(xy):
+            return
+        self.points.set_offsets(xy)
+        self.points.set_color(self.colors[state])
+        self.head.set_data(xy[-1:, 0], xy[-1:, 1])
+        if live is not None and len(live):
+            self.text.set_text(f"{live['speed_mph'].iloc[-1]:.1f} mph   state {live['state'].iloc[-1]}")
+        self.ax.update_datalim(xy)
+        self.ax.autoscale_view()
+        self.fig.canvas.draw_idle()
+        self.fig.canvas.flush_events()
+
+def follow(path, interval=0.05, idle=None, on_update=None, on_restart=None):
+    # poll the file until it stops growing for `idle` seconds (forever if None); latency
+    # covers reading and parsing the new bytes as well as the derived channels
+    tail = LogTail(path)
+    rs = RunStream()
+    latencies = []
+    last_growth = time.perf_counter()
+    while True:
+        t0 = time.perf_counter()
+        rows, reset = tail.poll()
+        if reset:
+            # the previous session ends with its held-back rows; the new one starts from scratch
+            final = rs.flush()
+            if on_update is not None and final is not None:
+                on_update(None, final, None, 0.0)
+            if on_restart is not None:
+                on_restart()
+            rs = RunStream()
+        if rows is None:
+            if idle is not None and time.perf_counter() - last_growth > idle:
+                break
+            time.sleep(interval)
+            continue
+        last_growth = t0
+        final = rs.update(rows)
+        live = rs.provisional()
+        latencies.append(time.perf_counter() - t0)
+        if on_update is not None:
+            on_update(rows, final, live, latencies[-1])
+    final = rs.flush()
+    if on_update is not None and final is not None:
+        on_update(None, final, None, 0.0)
+    return np.array(latencies)
+
+def main(args):
+    writer = None
+    if args.replay is not None:
+        if os.path.exists(args.filename):
+            os.remove(args.filename)
+        writer = threading.Thread(target=replay_log, args=(args.replay, args.filename, args.speed), daemon=True)
+        writer.start()
+
+    plot = LivePlot() if args.plot else None
+    out = open(args.output_file, 'w') if args.output_file is not None else None
+    header = [True]
+
+    def on_update(rows, final, live, latency):
+        if out is not None and final is not None and len(final):
+            final.to_csv(out, header=header[0], index=False)
+            header[0] = False
+        if plot is not None:
+            plot.update(final, live)
+        if live is not None and len(live):
+            head = live.iloc[-1]
+            print(f"t={head['Utc']:.0f} +{len(rows)} rows  x={head['x']:8.1f} y={head['y']:8.1f}  "
+                  f"{head['speed_mph']:5.1f} mph  curv={head['curv']:+.4f}  state {int(head['state'])}  "
+                  f"({latency*1000:.1f} ms)")
+
+    def on_restart():
+        print(f"{args.filename} was truncated or replaced: new session")
+        if plot is not None:
+            plot.reset()
+
+    try:
+        latencies = follow(args.filename, args.interval, args.idle, on_update, on_restart)
+    finally:
+        if out is not None:
+            out.close()
+    if len(latencies):
+        ms = latencies * 1000
+        print(f"{len(ms)} updates: median {np.median(ms):.1f} ms, p99 {np.percentile(ms, 99):.1f} ms, max {ms.max():.1f} ms")
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Follow a growing RaceCapture log and show trajectory and FSM state live")
+    parser.add_argument("filename", help="log file being written")
+    parser.add_argument("--replay", default=None, help="existing log to write into filename at real-time speed (for testing)")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between polls")
+    parser.add_argument("--idle", type=float, default=None, help="stop after the file has not grown for this many seconds")
+    parser.add_argument("--plot", action='store_true', help="live trajectory plot colored by FSM state")
+    parser.add_argument("-o", "--output_file", default=None, help="append final rows (with derived channels) to this csv")
+    args = parser.parse_args()
+    main(args)
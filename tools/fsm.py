@@ -0,0 +1,144 @@
+import pandas as pd
+import numpy as np
+import argparse as argp
+import time
+import itertools
+from cache import load_run
+
+sensor_cols = ['AccelX', 'AccelY', 'TPS', 'Speed', 'FrontBP', 'SteerAng']
+
+# Each sample is turned into a transition table row: table[i, s] is the state
+# the FSM moves to from state s given sample i. The rows are then composed with
+# a doubling scan so the whole state history is resolved with array operations.
+
+# Thresholds used by the transition rules, keyed so they can be swept
+thresholds = {
+    'brake': 30,        # brake pressure that drops to max downforce
+    'brake_max': 50,    # brake pressure allowed when entering medium downforce
+    'accel_x': 0.3,     # longitudinal accel that drops to max downforce
+    'accel_x_max': 0.4, # longitudinal accel allowed when entering medium downforce
+    'accel_y': 1.1,     # lateral accel that drops to max downforce
+    'accel_y_low': 0.5, # lateral accel below which low drag is allowed
+    'steer': 40,        # steering angle that drops to max downforce
+    'steer_mid': 30,    # steering angle allowed when leaving max downforce
+    'steer_low': 20,    # steering angle below which low drag is allowed
+    'tps': 20,          # throttle for low drag
+    'speed': 15,        # speed for medium downforce
+}
+
+def transition_table(ax, ay, tps, sp, bp, sa, th=thresholds):
+    ay = np.abs(ay)
+    N = len(ax)
+    table = np.empty((N, 3), dtype=np.int8)
+
+    # state 1: medium downforce
+    to0 = (bp > th['brake']) | (ax > th['accel_x']) | (sa > th['steer']) | (ay > th['accel_y'])
+    to2 = (ay < th['accel_y_low']) & (sa < th['steer_low']) & (tps > th['tps'])
+    table[:, 1] = np.where(to0, 0, np.where(to2, 2, 1))
+
+    # state 2: low drag
+    to0 = (tps < th['tps']) & ((sa > th['steer']) | (ay > th['accel_y']) | (bp > th['brake']) | (ax > th['accel_x']))
+    to1 = (sp > th['speed']) & ((ay > th['accel_y_low']) | (sa > th['steer_low']))
+    table[:, 2] = np.where(to0, 0, np.where(to1, 1, 2))
+
+    # state 0: maximum downforce
+    to2 = (tps > th['tps']) & (sa < th['steer_mid']) & (ay < th['accel_y_low']) & (bp < th['brake'])
+    to1 = (sp > th['speed']) & (ay < th['accel_y']) & (sa < th['steer_mid']) & (bp < th['brake_max']) & (ax < th['accel_x_max'])
+    table[:, 0] = np.where(to2, 2, np.where(to1, 1, 0))
+    return table
+
+_compose = {}
+
+def compose_lut(K):
+    # every map {0..K-1} -> {0..K-1} gets a code; lut[f, g] is the code of f after g
+    if K not in _compose:
+        maps = np.array(list(itertools.product(range(K), repeat=K)), dtype=np.int8)
+        weights = K ** np.arange(K-1, -1, -1)
+        lut = np.array([[(f[g] * weights).sum() for g in maps] for f in maps], dtype=np.uint8)
+        _compose[K] = (maps, weights, lut)
+    return _compose[K]
+
+def resolve_states(table, initial=0):
+    # prefix[i] = map taking the state before sample 0 to the state after sample i
+    N, K = table.shape
+    step = 1
+    if K**K <= 256:
+        maps, weights, lut = compose_lut(K)
+        prefix = (table.astype(np.intp) @ weights).astype(np.uint8)
+        while step < N:
+            prefix[step:] = lut[prefix[step:], prefix[:-step]]
+            step *= 2
+        return maps[prefix, initial].astype(int)
+    prefix = np.array(table, dtype=np.int8)
+    while step < N:
+        prefix[step:] = np.take_along_axis(prefix[step:], prefix[:-step].astype(np.intp), axis=1)
+        step *= 2
+    return prefix[:, initial].astype(int)
+
+def compute_states(gps):
+    # forward-fill missing sensor data in place, as the per-row loop did
+    gps[sensor_cols] = gps[sensor_cols].ffill()
+    ax, ay, tps, sp, bp = (gps[c].to_numpy(dtype=float) for c in sensor_cols[:5])
+    # sa = gps['SteerAng'].to_numpy(dtype=float) #TODO this is the CORRECT calculation
+    sa = np.zeros(len(gps)) #! this is a PLACEEHOLDER line while the steer angle sensor is getting fixed
+    return resolve_states(transition_table(ax, ay, tps, sp, bp, sa))
+
+# Reference implementation: the original per-row loop, kept for benchmarking
+def compute_states_loop(gps):
+    N = len(gps)
+    states = np.zeros(N, dtype=int)
+    cs = 0
+    for i in range(N):
+        if i > 0:
+            gps.loc[i, sensor_cols] = gps.loc[i, sensor_cols].fillna(gps.loc[i-1, sensor_cols])
+        ax = gps.at[i,'AccelX']
+        ay = gps.at[i,'AccelY']
+        tps = gps.at[i,'TPS']
+        sp = gps.at[i,'Speed']
+        bp = gps.at[i,'FrontBP']
+        sa = 0
+
+        ns = cs
+        if cs == 1:
+            if bp>30 or ax>0.3 or sa>40 or abs(ay)>1.1: ns = 0
+            elif abs(ay)<0.5 and sa<20 and tps>20: ns = 2
+        elif cs == 2:
+            if tps<20 and ((sa>40 or abs(ay)>1.1) or (bp>30 or ax>0.3)): ns = 0
+            elif sp>15 and (abs(ay)>0.5 or sa>20): ns = 1
+        else:
+            if tps>20 and sa<30 and abs(ay)<0.5 and bp<30: ns = 2
+            elif sp>15 and abs(ay)<1.1 and sa<30 and (bp<50 and ax<0.4): ns = 1
+        cs = ns
+        states[i] = cs
+    return states
+
+def main(args):
+    total_loop, total_vec = 0.0, 0.0
+    mismatches = 0
+    for run in args.filenames:
+        df = load_run(run)
+        gps = df.dropna(subset=['Latitude', 'Longitude']).reset_index(drop=True)
+
+        t0 = time.perf_counter()
+        vec = compute_states(gps.copy())
+        t_vec = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        ref = compute_states_loop(gps.copy())
+        t_loop = time.perf_counter() - t0
+
+        same = np.array_equal(vec, ref)
+        mismatches += not same
+        total_loop += t_loop
+        total_vec += t_vec
+        print(f"{run}: {len(gps)} rows, loop {t_loop*1000:.1f} ms, vectorized {t_vec*1000:.2f} ms, "
+              f"{'identical' if same else 'MISMATCH'}")
+
+    print(f"total: loop {total_loop:.2f} s, vectorized {total_vec:.3f} s, "
+          f"speedup {total_loop/max(total_vec, 1e-9):.0f}x, {mismatches} mismatching runs")
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Benchmark the vectorized FSM against the per-row loop")
+    parser.add_argument("filenames", nargs='+', help="A list of csvs")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,268 @@
+import pandas as pd
+import numpy as np
+import argparse as argp
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multirate import MultiRateRun
+from run import project, unproject, fusion_cols
+
+# GPS/IMU/wheel speed fusion onto a regular 50 Hz grid. The pose is split into
+# scalar Kalman filters, each followed by an RTS smoother:
+#   heading: integrates Yaw, corrected by the GPS course between fixes
+#   speed:   integrates AccelX, corrected by GPS Speed and the front wheel speed
+#   x, y:    integrate speed along the smoothed heading, corrected by the fixes
+# A scalar filter's variance recursion is a Mobius map and its mean recursion an
+# affine map of the previous step, so both are resolved with a doubling scan
+# (as fsm.resolve_states does for transition tables) over all samples at once.
+# Filters with the same inputs are stacked on a leading axis and run together.
+# Heading is counterclockwise from +x (the frame of run.project), which is the
+# sign the Yaw channel has.
+
+fusion_params = {
+    'rate': 50,               # output rate (Hz)
+    'gps_sigma': 1.5,         # fix noise (m) per unit of GPSDOP
+    'gps_speed_sigma': 0.3,   # GPS Speed noise (m/s)
+    'wheel_sigma': 0.6,       # front wheel speed noise (m/s)
+    'min_course_speed': 3.0,  # slowest speed (m/s) at which a GPS course is used
+    'heading_q': 0.02,        # heading random walk (rad^2/s), gyro noise and bias
+    'speed_q': 1.0,           # speed random walk ((m/s)^2/s), accelerometer noise
+    'pos_q': 0.5,             # position random walk (m^2/s), slip and heading error
+}
+
+kph_to_mps = 1 / 3.6
+mph_to_mps = 0.44704
+g = 9.80665
+
+def affine_scan(a, b, x0):
+    # x[k] = a[k] * x[k-1] + b[k] with x[-1] = x0, along the last axis
+    a, b = np.array(a, dtype=float), np.array(b, dtype=float)
+    n = a.shape[-1]
+    step = 1
+    while step < n:
+        # later maps absorb the ones step before them: (a2, b2) after (a1, b1) = (a2 a1, a2 b1 + b2)
+        b[..., step:] = a[..., step:] * b[..., :-step] + b[..., step:]
+        a[..., step:] = a[..., step:] * a[..., :-step]
+        step *= 2
+    return a * np.asarray(x0, dtype=float)[..., None] + b
+
+def mobius_scan(a, b, c, d, p0):
+    # p[k] = (a[k] p[k-1] + b[k]) / (c[k] p[k-1] + d[k]) with p[-1] = p0, along the last axis
+    a, b, c, d = (np.array(arr, dtype=float) for arr in np.broadcast_arrays(a, b, c, d))
+    n = a.shape[-1]
+    step = 1
+    while step < n:
+        # the 2x2 product [[a, b], [c, d]] @ (the map step before), written out per entry
+        a1, b1, c1, d1 = a[..., :-step], b[..., :-step], c[..., :-step], d[..., :-step]
+        a2, b2, c2, d2 = a[..., step:], b[..., step:], c[..., step:], d[..., step:]
+        a2[:], b2[:], c2[:], d2[:] = a2*a1 + b2*c1, a2*b1 + b2*d1, c2*a1 + d2*c1, c2*b1 + d2*d1
+        # a Mobius map does not change with the scale of its matrix; keep the entries bounded
+        scale = np.abs(a2) + np.abs(b2) + np.abs(c2) + np.abs(d2)
+        a2 /= scale; b2 /= scale; c2 /= scale; d2 /= scale
+        step *= 2
+    p0 = np.asarray(p0, dtype=float)[..., None]
+    return (a * p0 + b) / (c * p0 + d)
+
+def kalman_scan(u, q, z, w, m0, p0):
+    # scalar random walk x[k] = x[k-1] + u[k] (+ noise of variance q[k]), measured as z[k]
+    # with precision w[k] (0 where there is no measurement); filtered and predicted mean/variance
+    u = np.asarray(u, dtype=float)
+    q, w = np.broadcast_to(q, u.shape), np.broadcast_to(w, u.shape)
+    m0 = np.broadcast_to(np.asarray(m0, dtype=float), u.shape[:-1])
+    p0 = np.broadcast_to(np.asarray(p0, dtype=float), u.shape[:-1])
+    # p[k] = (p[k-1] + q) / (w (p[k-1] + q) + 1)
+    p = mobius_scan(1.0, q, w, w * q + 1, p0)
+    p_pred = np.concatenate([p0[..., None], p[..., :-1]], axis=-1) + q
+    gain = p_pred * w / (1 + p_pred * w)
+    m = affine_scan(1 - gain, (1 - gain) * u + gain * np.where(w > 0, z, 0), m0)
+    m_pred = np.concatenate([m0[..., None], m[..., :-1]], axis=-1) + u
+    return m, p, m_pred, p_pred
+
+def rts_scan(m, p, m_pred, p_pred):
+    # Rauch-Tung-Striebel: the same affine scan run backwards from the last filtered sample
+    gain = p[..., :-1] / p_pred[..., 1:]
+    rev = lambda arr: arr[..., ::-1]
+    ms = affine_scan(rev(gain), rev(m[..., :-1] - gain * m_pred[..., 1:]), m[..., -1])
+    ps = affine_scan(rev(gain**2), rev(p[..., :-1] - gain**2 * p_pred[..., 1:]), p[..., -1])
+    return np.concatenate([rev(ms), m[..., -1:]], axis=-1), np.concatenate([rev(ps), p[..., -1:]], axis=-1)
+
+def kalman_loop(u, q, z, w, m0, p0):
+    # reference: the textbook per-sample filter and smoother for one scalar channel
+    n = len(u)
+    q, w = np.broadcast_to(q, (n,)), np.broadcast_to(w, (n,))
+    m, p, m_pred, p_pred = np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n)
+    mk, pk = m0, p0
+    for k in range(n):
+        m_pred[k], p_pred[k] = mk + u[k], pk + q[k]
+        mk, pk = m_pred[k], p_pred[k]
+        if w[k] > 0:
+            gain = pk / (pk + 1 / w[k])
+            mk, pk = mk + gain * (z[k] - mk), (1 - gain) * pk
+        m[k], p[k] = mk, pk
+    ms, ps = m.copy(), p.copy()
+    for k in range(n - 2, -1, -1):
+        gain = p[k] / p_pred[k+1]
+        ms[k] = m[k] + gain * (ms[k+1] - m_pred[k+1])
+        ps[k] = p[k] + gain**2 * (ps[k+1] - p_pred[k+1])
+    return ms, ps
+
+def smooth(u, q, z, w, m0, p0=1e6):
+    return rts_scan(*kalman_scan(u, q, z, w, m0, p0))
+
+def on_grid(t, grid, values, sigma):
+    # measurements at their nearest grid row; several in one row become one precision-weighted value
+    n = len(grid)
+    rows = np.clip(np.rint((t - grid[0]) / (grid[1] - grid[0] if n > 1 else 1)).astype(int), 0, n - 1)
+    w = 1 / np.broadcast_to(np.asarray(sigma, dtype=float), np.shape(values))**2
+    prec = np.bincount(rows, w, n)
+    with np.errstate(invalid='ignore'):
+        z = np.bincount(rows, w * values, n) / prec
+    return np.nan_to_num(z), prec
+
+empty_pose = ['Interval', 'x', 'y', 'heading', 'speed', 'vx', 'vy', 'Latitude', 'Longitude', 'sigma_xy']
+
+def fuse(mr, p=fusion_params):
+    # 50 Hz pose of one run; x/y in meters around the mean fix, heading in degrees (unwrapped)
+    if 'Latitude' not in mr:
+        return pd.DataFrame(columns=empty_pose)
+    fix_cols = ['Latitude', 'Longitude'] + [c for c in ['GPSDOP', 'GPSQual'] if c in mr]
+    fixes = mr.align(fix_cols, t=mr.sampled_at(['Latitude', 'Longitude']))
+    if 'GPSQual' in fixes:
+        fixes = fixes[fixes['GPSQual'] > 0]
+    if len(fixes) < 2:
+        return pd.DataFrame(columns=empty_pose)
+    t_fix = fixes.index.to_numpy(dtype=float)
+    lat, lon = fixes['Latitude'].to_numpy(), fixes['Longitude'].to_numpy()
+    lat0, lon0 = lat.mean(), lon.mean()
+    fx, fy = project(lat, lon, lat0, lon0)
+    dop = fixes['GPSDOP'].clip(lower=0.5).to_numpy() if 'GPSDOP' in fixes else np.ones(len(fixes))
+    gps_sigma = p['gps_sigma'] * dop
+
+    # the output grid covers the fixes; IMU channels are interpolated onto it
+    step = 1000.0 / p['rate']
+    grid = np.arange(t_fix[0], t_fix[-1] + step / 2, step)
+    h = np.diff(grid, prepend=grid[0]) / 1000.0
+    imu = mr.align([c for c in ['Yaw', 'AccelX'] if c in mr], t=grid, method='linear', bfill=True)
+    yaw = np.deg2rad(imu['Yaw'].to_numpy()) if 'Yaw' in imu else np.zeros(len(grid))
+    ax = imu['AccelX'].to_numpy() * g if 'AccelX' in imu else np.zeros(len(grid))
+
+    # speed measurements: GPS Speed (kph) and the front right wheel (mph; the rears are driven and slip)
+    t_spd, z_spd, s_spd = [], [], []
+    if 'Speed' in mr:
+        ts, v = mr.channel('Speed')
+        t_spd.append(ts); z_spd.append(v.astype(float) * kph_to_mps); s_spd.append(np.full(len(ts), p['gps_speed_sigma']))
+    if 'WSFR' in mr:
+        ts, v = mr.channel('WSFR')
+        t_spd.append(ts); z_spd.append(v.astype(float) * mph_to_mps); s_spd.append(np.full(len(ts), p['wheel_sigma']))
+    t_spd = np.concatenate(t_spd) if t_spd else t_fix
+    z_spd = np.concatenate(z_spd) if z_spd else np.zeros(len(t_fix))
+    s_spd = np.concatenate(s_spd) if s_spd else np.full(len(t_fix), np.inf)
+    keep = np.isfinite(z_spd) & (t_spd >= grid[0]) & (t_spd <= grid[-1])
+    z_v, w_v = on_grid(t_spd[keep], grid, z_spd[keep], s_spd[keep])
+
+    # course between consecutive fixes, on the branch of the integrated gyro so it can be averaged
+    dist = np.hypot(np.diff(fx), np.diff(fy))
+    moving = dist / np.maximum(np.diff(t_fix) / 1000.0, 1e-3) > p['min_course_speed']
+    t_crs = 0.5 * (t_fix[1:] + t_fix[:-1])[moving]
+    course = np.arctan2(np.diff(fy), np.diff(fx))[moving]
+    gyro = np.cumsum(yaw * h)
+    at = np.clip(np.rint((t_crs - grid[0]) / step).astype(int), 0, len(grid) - 1)
+    course = gyro[at] + np.unwrap(course - gyro[at])
+    crs_sigma = np.hypot(gps_sigma[1:], gps_sigma[:-1])[moving] / dist[moving]
+    z_h, w_h = on_grid(t_crs, grid, course, crs_sigma)
+
+    # heading and speed are independent: one stacked scan for both
+    u = np.stack([yaw * h, ax * h])
+    q = np.stack([p['heading_q'] * h, p['speed_q'] * h])
+    m0 = [course[0] - gyro[at[0]] if len(course) else 0.0, z_v[w_v > 0][0] if (w_v > 0).any() else 0.0]
+    (heading, speed), _ = smooth(u, q, np.stack([z_h, z_v]), np.stack([w_h, w_v]), m0)
+    speed = np.maximum(speed, 0)
+
+    # position: speed along the heading, corrected by the fixes
+    vx, vy = speed * np.cos(heading), speed * np.sin(heading)
+    z_x, w_xy = on_grid(t_fix, grid, fx, gps_sigma)
+    z_y, _ = on_grid(t_fix, grid, fy, gps_sigma)
+    # step k moves the car from row k-1 to row k at the mean of their velocities
+    mean_v = lambda v: 0.5 * (v + np.concatenate([v[:1], v[:-1]]))
+    u = np.stack([mean_v(vx) * h, mean_v(vy) * h])
+    (x, y), (px, py) = smooth(u, p['pos_q'] * h, np.stack([z_x, z_y]), np.stack([w_xy, w_xy]), [fx[0], fy[0]])
+
+    lat_f, lon_f = unproject(x, y, lat0, lon0)
+    pose = pd.DataFrame({'Interval': grid, 'x': x, 'y': y, 'heading': np.rad2deg(heading), 'speed': speed,
+                         'vx': vx, 'vy': vy, 'Latitude': lat_f, 'Longitude': lon_f, 'sigma_xy': np.sqrt(px + py)})
+    pose.attrs['origin'] = (lat0, lon0)
+    return pose
+
+def fuse_file(path, p=fusion_params):
+    return fuse(MultiRateRun.load(path, ['Interval'] + fusion_cols), p)
+
+def fuse_all(files, workers=None):
+    # {path: pose}, one run per task
+    if workers == 1:
+        return {f: fuse_file(f) for f in files}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(files, pool.map(fuse_file, files, chunksize=4)))
+
+def main(args):
+    folders = args.input_folders or sorted(glob.glob(os.path.join('data', 'test *')))
+    files = [f for folder in folders for f in sorted(glob.glob(os.path.join(folder, 'rc_*.csv')))]
+
+    # the scans against the per-sample filter and smoother on a synthetic channel
+    rng = np.random.default_rng(0)
+    n = 20000
+    u, q = rng.normal(0, 0.1, n), np.full(n, 0.01)
+    w = np.where(rng.random(n) < 0.2, 4.0, 0.0)
+    z = np.cumsum(u) + rng.normal(0, 0.5, n)
+    t0 = time.perf_counter()
+    ref, ref_p = kalman_loop(u, q, z, w, 0.0, 1e6)
+    t_loop = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    ms, ps = smooth(u, q, z, w, 0.0)
+    t_scan = time.perf_counter() - t0
+    print(f"scan vs loop on {n} samples: loop {t_loop*1000:.0f} ms, scan {t_scan*1000:.1f} ms, "
+          f"max difference {max(np.abs(ms - ref).max(), np.abs(ps - ref_p).max()):.1e}")
+
+    t0 = time.perf_counter()
+    poses = fuse_all(files, args.workers)
+    elapsed = time.perf_counter() - t0
+    rows = sum(len(pose) for pose in poses.values())
+    print(f"fused {len(files)} runs into {rows} 50 Hz poses in {elapsed:.2f} s")
+
+    # how far the track sits from the raw fixes, and how much smoother it is
+    resid, raw_jerk, fused_jerk = [], [], []
+    for path, pose in poses.items():
+        if len(pose) < 10:
+            continue
+        mr = MultiRateRun.load(path, ['Interval', 'Latitude', 'Longitude'])
+        t = mr.sampled_at(['Latitude', 'Longitude'])
+        fix = mr.align(['Latitude', 'Longitude'], t=t)
+        fix = fix[(fix.index >= pose['Interval'].iloc[0]) & (fix.index <= pose['Interval'].iloc[-1])]
+        lat0, lon0 = pose.attrs['origin']
+        fx, fy = project(fix['Latitude'].to_numpy(), fix['Longitude'].to_numpy(), lat0, lon0)
+        tt = fix.index.to_numpy(dtype=float)
+        px, py = np.interp(tt, pose['Interval'], pose['x']), np.interp(tt, pose['Interval'], pose['y'])
+        resid.append(np.hypot(fx - px, fy - py))
+        # second differences of position at the fix times while moving: the noise a plot would show
+        moving = np.interp(tt, pose['Interval'], pose['speed'])[1:-1] > 3
+        raw_jerk.append(np.hypot(np.diff(fx, 2), np.diff(fy, 2))[moving])
+        fused_jerk.append(np.hypot(np.diff(px, 2), np.diff(py, 2))[moving])
+    if resid:
+        resid = np.concatenate(resid)
+        print(f"distance to the GPS fixes: median {np.median(resid):.2f} m, 95% {np.percentile(resid, 95):.2f} m")
+        raw_jerk, fused_jerk = np.concatenate(raw_jerk), np.concatenate(fused_jerk)
+        print(f"second difference at moving fixes: raw {np.median(raw_jerk):.3f} m median, {np.percentile(raw_jerk, 95):.3f} m 95%; "
+              f"fused {np.median(fused_jerk):.3f} m median, {np.percentile(fused_jerk, 95):.3f} m 95%")
+    if args.output_folder is not None:
+        os.makedirs(args.output_folder, exist_ok=True)
+        for path, pose in poses.items():
+            name = os.path.basename(os.path.dirname(os.path.abspath(path))) + '_' + os.path.basename(path)
+            pose.to_csv(os.path.join(args.output_folder, name), index=False)
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Fuse GPS, IMU and wheel speeds into a smoothed 50 Hz track per run")
+    parser.add_argument("-i", "--input_folders", nargs='*', default=None, help="test folders (default: data/test *)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker processes (default: all cores, 1 to run in-process)")
+    parser.add_argument("-o", "--output_folder", default=None, help="folder to write one pose csv per run to")
+    args = parser.parse_args()
+    main(args)
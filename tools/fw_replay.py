@@ -0,0 +1,176 @@
+import pandas as pd
+import numpy as np
+import argparse as argp
+import time
+import os
+from fsm import resolve_states
+from cache import load_run
+
+# Replay of src/fsm/fsm_current.ino over logged data. Every logged CAN sample is
+# treated as one received packet: nextState() runs on it, then updateState()
+# latches the new state while returning the front pulse for the *previous* state.
+
+precision = 2  # UPDATE when updating racecapture precision (matches the firmware)
+
+midPulse, minPulse, maxPulse = 1500, 1000, 1945
+midPulseR, minPulseR, maxPulseR = 1500, 900, 1945
+pulseDelta = 1000
+
+front_pulses = np.array([maxPulse, midPulse, minPulse])
+rear_pulses = np.array([maxPulseR, midPulseR, minPulseR])
+
+# CAN packet layout in the firmware: accel X, accel Y, TPS, WSFR, WSFL, brake pressure, steering angle
+can_cols = ['AccelX', 'AccelY', 'TPS', 'WSFR', 'WSFL', 'FrontBP', 'SteerAng']
+can_scale = [10**precision, 10**precision, 1, 1, 1, 1, 1]
+
+def ffill(arr, fill=0.0):
+    arr = np.asarray(arr, dtype=float)
+    idx = np.where(np.isnan(arr), 0, np.arange(len(arr)))
+    np.maximum.accumulate(idx, out=idx)
+    out = arr[idx]
+    out[np.isnan(out)] = fill  # globals start zeroed on the board
+    return out
+
+def can_frame(df, byte_wrap=False):
+    # rows where at least one CAN channel was logged are the packets the board saw
+    present = df[can_cols].notna().any(axis=1).to_numpy()
+    can = np.empty((present.sum(), len(can_cols)))
+    for j, (col, scale) in enumerate(zip(can_cols, can_scale)):
+        can[:, j] = np.round(ffill(df[col].to_numpy())[present] * scale)
+    if byte_wrap:
+        # mcp.read() hands back one unsigned byte per channel
+        can = np.mod(can, 256)
+    return present, can
+
+def firmware_table(can, on, low_drag):
+    accel_x = -can[:, 0] / 100.0
+    accel_y = np.abs(can[:, 1]) / 100.0
+    TPS = can[:, 2]
+    wheel_speed = np.maximum(can[:, 3], can[:, 4])
+    brake_pressure = can[:, 5]
+    steering_angle = np.abs(can[:, 6])
+    on = on.astype(bool)
+    low_drag = low_drag.astype(bool)
+
+    N = len(can)
+    table = np.empty((N, 3), dtype=np.int8)
+
+    # case 1: medium downforce
+    to0 = (brake_pressure > 30) | (accel_x > 0.3) | (steering_angle > 40) | (accel_y > 1.1)
+    to2 = (accel_y < 0.7) & (steering_angle < 20) & (TPS > 15)
+    table[:, 1] = np.select([~on, low_drag, to0, to2], [0, 2, 0, 2], 1)
+
+    # case 2: DRS / low drag
+    to0 = (TPS < 50) & ((steering_angle > 40) | (accel_y > 1.1) | (brake_pressure > 30) | (accel_x > 0.3))
+    to1 = (wheel_speed > 15) & ((accel_y > 0.7) | (steering_angle > 20))
+    table[:, 2] = np.select([~on, low_drag, to0, to1], [0, 2, 0, 1], 2)
+
+    # default: maximum downforce
+    to2 = (TPS > 50) & (steering_angle < 30) & (accel_y < 0.7) & (brake_pressure < 30)
+    to1 = (wheel_speed > 15) & (accel_y < 1.1) & (steering_angle < 30) & (brake_pressure < 50) & (accel_x < 0.4)
+    table[:, 0] = np.select([~on, low_drag, to2, to1], [0, 2, 2, 1], 0)
+    return table
+
+def rate_limited(targets, start):
+    # moveServo() steps at most pulseDelta per packet, so resolve the servo
+    # position as another small FSM over every position it can land on
+    levels = sorted(set(targets.tolist()) | {start})
+    positions = set(levels)
+    frontier = list(positions)
+    while frontier:
+        p = frontier.pop()
+        for t in levels:
+            q = t if abs(t - p) <= pulseDelta else p + np.sign(t - p) * pulseDelta
+            if q not in positions:
+                positions.add(q)
+                frontier.append(q)
+    positions = sorted(positions)
+    pos_idx = {p: k for k, p in enumerate(positions)}
+    move = np.empty((len(levels), len(positions)), dtype=np.int8)
+    for i, t in enumerate(levels):
+        for p in positions:
+            q = t if abs(t - p) <= pulseDelta else p + np.sign(t - p) * pulseDelta
+            move[i, pos_idx[p]] = pos_idx[q]
+    target_idx = np.searchsorted(levels, targets)
+    return np.asarray(positions)[resolve_states(move[target_idx], initial=pos_idx[start])]
+
+def switch(df, col, default):
+    # switch positions are logged at 1 Hz; hold the first reading until it arrives
+    if col not in df or df[col].isna().all():
+        return np.full(len(df), default, dtype=float)
+    vals = df[col].to_numpy(dtype=float)
+    return ffill(vals, fill=vals[~np.isnan(vals)][0])
+
+def scaling_factor(sens):
+    return 0.8 - ((-50.0 + np.asarray(sens, dtype=float)) / (755.0*2.0))
+
+def replay(df, on=None, low_drag=None, sens=50, byte_wrap=False):
+    present, can = can_frame(df, byte_wrap)
+    N = len(can)
+
+    # switches default to the logged AA channels, falling back to constants
+    if on is None:
+        on = switch(df, 'AA_On', 1)[present]
+    elif np.isscalar(on):
+        on = np.full(N, on)
+    if low_drag is None:
+        low_drag = switch(df, 'AA_LowDrag', 0)[present]
+    elif np.isscalar(low_drag):
+        low_drag = np.full(N, low_drag)
+    if isinstance(sens, str):
+        sens = ffill(df[sens].to_numpy())[present]
+
+    state = resolve_states(firmware_table(can, on, low_drag))
+    # updateState() returns the pulse for the state it is leaving
+    front_state = np.concatenate([[0], state[:-1]])
+    front_pulse = front_pulses[front_state]
+    rear_pulse = rate_limited(rear_pulses[state], maxPulseR)
+
+    out = pd.DataFrame({
+        'Interval': df['Interval'].to_numpy()[present],
+        'state': state,
+        'front_state': front_state,
+        'front_pulse': front_pulse,
+        'rear_pulse': rear_pulse,
+        'scaling_factor': np.broadcast_to(scaling_factor(sens), (N,)),
+        'on': on.astype(int),
+        'low_drag': low_drag.astype(int),
+    })
+    return out
+
+def summarize(out):
+    counts = np.bincount(out['state'], minlength=3)
+    st = out['state'].to_numpy()
+    return {
+        'packets': len(out),
+        'time_in_state': (counts / max(len(out), 1)).round(3).tolist(),
+        'transitions': int(np.count_nonzero(np.diff(st))),
+        'front_moves': int(np.count_nonzero(np.diff(out['front_pulse'].to_numpy(), prepend=maxPulse))),
+        'rear_moves': int(np.count_nonzero(np.diff(out['rear_pulse'].to_numpy(), prepend=maxPulseR))),
+    }
+
+def main(args):
+    t0 = time.perf_counter()
+    packets = 0
+    for run in args.filenames:
+        df = load_run(run)
+        sens = args.sens_channel if args.sens_channel is not None else args.sens
+        out = replay(df, on=args.on, low_drag=args.low_drag, sens=sens, byte_wrap=args.bytes)
+        packets += len(out)
+        print(run, summarize(out))
+        if args.output_folder is not None:
+            name = f"{os.path.basename(os.path.dirname(run))}_{os.path.basename(run)}".replace(' ', '_')
+            out.to_csv(os.path.join(args.output_folder, name))
+    print(f"replayed {packets} packets from {len(args.filenames)} runs in {time.perf_counter()-t0:.2f} s")
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Replay fsm_current.ino over logged runs")
+    parser.add_argument("filenames", nargs='+', help="A list of csvs")
+    parser.add_argument("--on", type=int, choices=[0, 1], default=None, help="force the on/off switch (default: logged AA_On)")
+    parser.add_argument("--low_drag", type=int, choices=[0, 1], default=None, help="force the DRS switch (default: logged AA_LowDrag)")
+    parser.add_argument("--sens", type=float, default=50, help="constant pot reading (analogRead counts)")
+    parser.add_argument("--sens_channel", default=None, help="logged channel holding the pot reading")
+    parser.add_argument("--bytes", action='store_true', help="wrap CAN values to one unsigned byte like mcp.read()")
+    parser.add_argument("-o", "--output_folder", required=False, default=None, help="Path to the output folder")
+    args = parser.parse_args()
+    main(args)
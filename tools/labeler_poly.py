@@ -7,7 +7,40 @@ from matplotlib.path import Path
 from scipy.signal import savgol_filter
 import argparse as argp
 import os
-
+from cache import load_run
+from regions import RegionIndex, flatten, read_map, write_map, map_regions, map_xy, label_run, label_names
+from run import unproject
+
+
+# Define bounding-box regions, relative to the first GPS fix
+regions = {
+    'straight': [[
+        (-50, -40), 
+        (-10, -50), 
+        (-20, 10)
+    ]],
+    'hairpin': [[
+        (5, -20), 
+        (15, -20), 
+        (15, -5), 
+        (5, -5)
+    ]],
+    'slalom': [
+        [
+            (40, 30), 
+            (15, 25), 
+            (20, 40),
+            (-20, 22),
+            (20, 0)
+        ],
+        [
+            (0, -40), 
+            (40, -50), 
+            (30, 10)
+        ],
+
+    ]
+}
 
 def tupleSub(tlist, tsub):
     result = []
@@ -15,75 +48,71 @@ def tupleSub(tlist, tsub):
         result.append(tuple(map(lambda i, j: i - j, t, tsub)))
     return result
 
+def region_paths(regions, origin):
+    # polygons moved into the projected frame; later entries win when they overlap
+    origin_x, origin_y = origin
+    paths = {'example':[]}
+    for name, polys in regions.items():
+        for path in polys:
+            if paths.get(name) == None:
+                paths[name] = [Path(tupleSub(path, (-origin_x, -origin_y)))]
+            else:
+                paths[name].append(Path(tupleSub(path, (-origin_x, -origin_y))))
+    return paths
+
 def main(args):
     # Runs to plot separately
     folder_path = args.input_folder 
 
     frames = []
     originals = []
+    region_map = read_map(args.region_map) if args.region_map is not None else None
+    computed = 0
     for filename in os.listdir(folder_path):
         run = os.path.join(folder_path, filename)
         if os.path.isfile(run):  # Ensure it's a file, not a subdirectory
-            df = pd.read_csv(run)
+            df = load_run(run)
             gps = df.dropna(subset=['Latitude', 'Longitude']).copy()
             gps['run'] = filename.replace('.csv', '')
+            if region_map is not None:
+                # labels anchored in lat/lon, computed once per (run, map) and cached
+                codes, fresh = label_run(run, region_map)
+                gps['label'] = label_names(region_map, codes)
+                computed += fresh
             frames.append(gps)
     all_gps = pd.concat(frames, ignore_index=True)
 
-    lat0 = all_gps['Latitude'].mean()
-    lon0 = all_gps['Longitude'].mean()
-    m_lat = 111132.92 - 559.82*np.cos(2*np.deg2rad(lat0)) + 1.175*np.cos(4*np.deg2rad(lat0))
-    m_lon = 111412.84*np.cos(np.deg2rad(lat0)) - 93.5*np.cos(3*np.deg2rad(lat0))
-    all_gps['x'] = (all_gps['Longitude'] - lon0) * m_lon
-    all_gps['y'] = (all_gps['Latitude'] - lat0) * m_lat
-
-    origin_x, origin_y = all_gps['x'].iloc[0], all_gps['y'].iloc[0]
-
-    # Define bounding-box regions
-    regions = {
-        'straight': [[
-            (-50, -40), 
-            (-10, -50), 
-            (-20, 10)
-        ]],
-        'hairpin': [[
-            (5, -20), 
-            (15, -20), 
-            (15, -5), 
-            (5, -5)
-        ]],
-        'slalom': [
-            [
-                (40, 30), 
-                (15, 25), 
-                (20, 40),
-                (-20, 22),
-                (20, 0)
-            ],
-            [
-                (0, -40), 
-                (40, -50), 
-                (30, 10)
-            ],
-
-        ]
-    }
-
-    region_paths = {'example':[]}
-
-    for name, paths in regions.items():
-        for path in paths:
-            if region_paths.get(name) == None:
-                region_paths[name] = [Path(tupleSub(path, (-origin_x, -origin_y)))]
-            else:
-                region_paths[name].append(Path(tupleSub(path, (-origin_x, -origin_y))))
-
-    all_gps['label'] = 'unlabeled'
-
-    for name, paths in region_paths.items():
-        for path in paths:
-            mask = path.contains_points(all_gps[['x', 'y']].values)
-            all_gps.loc[mask, 'label'] = name
+    if region_map is not None:
+        lat0, lon0 = region_map['origin']
+        xy = map_xy(all_gps, region_map)
+        all_gps['x'], all_gps['y'] = xy[:, 0], xy[:, 1]
+        origin_x, origin_y = 0, 0
+        polygons = [(name, path.vertices.tolist()) for name, path in map_regions(region_map)]
+        print(f"labeled {len(frames)} runs: {computed} computed, {len(frames)-computed} from the label cache")
+    else:
+        lat0 = all_gps['Latitude'].mean()
+        lon0 = all_gps['Longitude'].mean()
+        m_lat = 111132.92 - 559.82*np.cos(2*np.deg2rad(lat0)) + 1.175*np.cos(4*np.deg2rad(lat0))
+        m_lon = 111412.84*np.cos(np.deg2rad(lat0)) - 93.5*np.cos(3*np.deg2rad(lat0))
+        all_gps['x'] = (all_gps['Longitude'] - lon0) * m_lon
+        all_gps['y'] = (all_gps['Latitude'] - lat0) * m_lat
+
+        origin_x, origin_y = all_gps['x'].iloc[0], all_gps['y'].iloc[0]
+
+        region_paths_ = region_paths(regions, (origin_x, origin_y))
+        index = RegionIndex(flatten(region_paths_))
+        all_gps['label'] = index.label(all_gps[['x', 'y']].values)
+        polygons = [(name, verts) for name, paths in regions.items() for verts in paths]
+
+        if args.export is not None:
+            # anchor the hardcoded regions at this folder's origin, in absolute lat/lon
+            latlon = []
+            for name, paths in region_paths_.items():
+                for path in paths:
+                    lat, lon = unproject(path.vertices[:, 0], path.vertices[:, 1], lat0, lon0)
+                    latlon.append((name, list(zip(lat, lon))))
+            write_map(args.export, latlon, name=os.path.basename(os.path.normpath(folder_path)))
+            print(f"wrote region map {args.export}")
 
     # Plot with axes labeled
     fig, ax = plt.subplots(figsize=(10,8))
@@ -96,6 +125,10 @@ def main(args):
         'unlabeled': 'lightgray'
     }
 
+    # regions from a map file may use names without a fixed color
+    extra = [n for n in dict.fromkeys(name for name, _ in polygons) if n not in color_map]
+    color_map.update({n: plt.cm.tab10(i % 10) for i, n in enumerate(extra)})
+
     scatters = {}
     for region, color in color_map.items():
         pts = all_gps[all_gps['label'] == region]
@@ -103,10 +136,9 @@ def main(args):
                     s=5, c=color, label=region, alpha=0.4)
         scatters[region] = sc
         
-    for name, paths in regions.items():
-        for verts in paths:
-            poly = np.array(verts + [verts[0]])
-            plt.plot(poly[:,0], poly[:,1], linestyle='--', color= color_map[name], lw=2)
+    for name, verts in polygons:
+        poly = np.array(list(verts) + [verts[0]])
+        plt.plot(poly[:,0], poly[:,1], linestyle='--', color= color_map[name], lw=2)
     
     if args.output_folder is not None:
         if args.output_file.endswith('csv'):
@@ -158,5 +190,7 @@ if __name__ == "__main__":
     parser.add_argument("-o", "--output_folder", required=False, help = "Path to the output folder")
     parser.add_argument("-t", "--output_file", required=False, help = "filename")
     parser.add_argument("-s", "--show_plot", required=False, help = "show plot", choices = ['y', 'n'])
+    parser.add_argument("-r", "--region_map", required=False, default=None, help = "region map (json, absolute lat/lon) to label with instead of the built-in regions")
+    parser.add_argument("-e", "--export", required=False, default=None, help = "write the built-in regions, anchored at this folder's origin, to a region map file")
     args = parser.parse_args()
     main(args)
\ No newline at end of file
@@ -0,0 +1,249 @@
+import pandas as pd
+import numpy as np
+import argparse as argp
+import glob
+import hashlib
+import json
+import os
+import time
+from cache import cache_root, cache_key
+from run import get_run, project
+
+# Laps from start/finish-line crossings. A gate file (data/gates/*.json) holds
+# the start/finish line and, optionally, a separate finish line (autocross
+# runs that leave a start box and come back to it) and sector lines, each as
+# two lat/lon points. Every fix-to-fix step of a run is tested against every
+# line at once (one cross-product test over a (lines, steps) array); the
+# crossing time is interpolated along the step. Consecutive start/finish
+# crossings, or a start and the next finish, bound a lap, and the first
+# crossing of each sector line in order splits it into sectors. The lap index
+# of a run is cached per (run, gate, track source) next to its other cache
+# entries, so "lap 3 of rc_12" or "the fastest lap of test 6" read a few small
+# json files instead of rescanning the runs.
+
+lap_params = {
+    'min_lap': 5.0,      # crossings closer than this (s) to the previous one are the same pass
+    'max_step': 50.0,    # steps longer than this (m) are GPS dropouts, not driving
+}
+
+gate_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'gates')
+
+def read_gate(path):
+    with open(path) as f:
+        gate = json.load(f)
+    gate.setdefault('sectors', [])
+    if 'origin' not in gate:
+        gate['origin'] = np.asarray(gate['start'], dtype=float).mean(axis=0).tolist()
+    return gate
+
+def write_gate(path, start, sectors=(), name='', finish=None, min_lap=None):
+    # start, finish and each sector: [(lat, lon), (lat, lon)]; one line per gate line
+    gate = {'name': name, 'start': [[float(a), float(b)] for a, b in start],
+            'sectors': [[[float(a), float(b)] for a, b in line] for line in sectors]}
+    lines = [f' "name": {json.dumps(name)}', f' "start": {json.dumps(gate["start"])}']
+    if finish is not None:
+        gate['finish'] = [[float(a), float(b)] for a, b in finish]
+        lines.append(f' "finish": {json.dumps(gate["finish"])}')
+    if min_lap is not None:
+        gate['min_lap'] = float(min_lap)
+        lines.append(f' "min_lap": {json.dumps(gate["min_lap"])}')
+    body = ',\n'.join('  ' + json.dumps(line) for line in gate['sectors'])
+    lines.append(f' "sectors": [\n{body}\n ]' if body else ' "sectors": []')
+    with open(path, 'w') as f:
+        f.write('{\n' + ',\n'.join(lines) + '\n}\n')
+    return read_gate(path)
+
+def folder_gate(folder):
+    # data/test 6 -> data/gates/test6.json
+    return os.path.join(gate_dir, os.path.basename(os.path.normpath(folder)).replace(' ', '') + '.json')
+
+def gate_hash(gate, p=lap_params):
+    # only what changes the laps: the lines and the debounce
+    canonical = json.dumps({'start': gate['start'], 'finish': gate.get('finish'), 'sectors': gate['sectors'],
+                            'min_lap': gate.get('min_lap', p['min_lap']), 'max_step': p['max_step']}, sort_keys=True)
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+def gate_lines(gate):
+    # (lines, 2, 2) in meters around the gate origin: start (and finish), then the sectors
+    pts = np.array([gate['start']] + ([gate['finish']] if 'finish' in gate else []) + gate['sectors'], dtype=float)
+    return np.stack(project(pts[..., 0], pts[..., 1], *gate['origin']), axis=-1)
+
+def crossings(xy, lines, max_step=lap_params['max_step']):
+    # every step xy[i] -> xy[i+1] that crosses a line: (line, step, fraction along the step)
+    p, d = xy[:-1], np.diff(xy, axis=0)                         # (steps, 2)
+    a, e = lines[:, 0], lines[:, 1] - lines[:, 0]               # (lines, 2)
+    ap = a[:, None, :] - p[None]                                # (lines, steps, 2)
+    denom = d[None, :, 0] * e[:, None, 1] - d[None, :, 1] * e[:, None, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = (ap[..., 0] * e[:, None, 1] - ap[..., 1] * e[:, None, 0]) / denom   # along the step
+        v = (ap[..., 0] * d[None, :, 1] - ap[..., 1] * d[None, :, 0]) / denom   # along the line
+    hit = (denom != 0) & (u >= 0) & (u < 1) & (v >= 0) & (v <= 1)
+    hit &= np.hypot(d[:, 0], d[:, 1])[None] <= max_step
+    line, step = np.nonzero(hit)
+    return line, step, u[line, step]
+
+def crossings_loop(xy, lines, max_step=lap_params['max_step']):
+    # reference: one step and one line at a time
+    out = []
+    for k, (a, b) in enumerate(lines):
+        for i in range(len(xy) - 1):
+            p, q = xy[i], xy[i+1]
+            d, e = q - p, b - a
+            denom = d[0]*e[1] - d[1]*e[0]
+            if denom == 0 or np.hypot(*d) > max_step:
+                continue
+            u = ((a[0]-p[0])*e[1] - (a[1]-p[1])*e[0]) / denom
+            v = ((a[0]-p[0])*d[1] - (a[1]-p[1])*d[0]) / denom
+            if 0 <= u < 1 and 0 <= v <= 1:
+                out.append((k, i, u))
+    out = np.array(out).reshape(-1, 3)
+    return out[:, 0].astype(int), out[:, 1].astype(int), out[:, 2]
+
+def debounce(times, min_lap):
+    # keep a crossing only if it comes min_lap after the last one kept
+    keep = []
+    for t in times:
+        if not keep or t - keep[-1] >= min_lap:
+            keep.append(t)
+    return np.array(keep)
+
+def find_laps(xy, t, gate, p=lap_params):
+    # xy (fixes, 2) in the gate frame, t (s) at each fix
+    line, step, u = crossings(xy, gate_lines(gate), p['max_step'])
+    when = t[step] + u * (t[step + 1] - t[step])
+    order = np.argsort(when, kind='stable')
+    line, step, when = line[order], step[order], when[order]
+    min_lap = gate.get('min_lap', p['min_lap'])
+    first_sector = 2 if 'finish' in gate else 1
+    starts = debounce(when[line == 0], min_lap)
+    if 'finish' in gate:
+        # each start to the first finish after it; the next lap starts after that finish
+        finishes = when[line == 1]
+        bounds = []
+        for t0 in starts:
+            if bounds and t0 < bounds[-1][1]:
+                continue
+            later = finishes[finishes >= t0 + min_lap]
+            if len(later):
+                bounds.append((t0, later[0]))
+    else:
+        bounds = list(zip(starts[:-1], starts[1:]))
+    laps = []
+    for n, (t0, t1) in enumerate(bounds):
+        # first crossing of each sector line after the previous split
+        splits = [t0]
+        for k in range(first_sector, first_sector + len(gate['sectors'])):
+            later = when[(line == k) & (when > splits[-1]) & (when < t1)] if not np.isnan(splits[-1]) else []
+            splits.append(later[0] if len(later) else np.nan)
+        splits.append(t1)
+        laps.append({
+            'lap': n + 1,
+            'start': int(step[when == t0][0] + 1), 'end': int(step[when == t1][0] + 1),   # fixes [start, end)
+            'start_time': float(t0), 'end_time': float(t1), 'time': float(t1 - t0),
+            'sectors': [None if np.isnan(s) else float(s) for s in np.diff(splits)],
+        })
+    return {'crossings': [float(c) for c in starts], 'laps': laps}
+
+def run_track(run, gate):
+    # positions of the run's fixes from its track source, in the gate frame, and time (s)
+    lat, lon = run.latlon()
+    xy = np.column_stack(project(np.asarray(lat, dtype=float), np.asarray(lon, dtype=float), *gate['origin']))
+    t = run.gps['Interval'].to_numpy(dtype=float) / 1000.0
+    return xy, t
+
+def lap_path(path, gate, source):
+    return os.path.join(cache_root, 'laps', cache_key(path), f"{gate_hash(gate)}_{source}.json")
+
+def lap_index(path, gate, refresh=False):
+    # the run's laps through the cache; returns (index, computed)
+    run = get_run(path)
+    entry = lap_path(path, gate, run.source)
+    if not refresh and os.path.exists(entry):
+        with open(entry) as f:
+            return json.load(f), False
+    index = find_laps(*run_track(run, gate), gate)
+    index.update({'run': path, 'gate': gate.get('name', ''), 'source': run.source})
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp = f"{entry}.tmp{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp, entry)
+    return index, True
+
+def lap(path, n, gate=None):
+    # lap n (from 1) of a run, or None; the gate defaults to the one of the run's test folder
+    gate = gate or read_gate(folder_gate(os.path.dirname(path)))
+    laps = lap_index(path, gate)[0]['laps']
+    return laps[n - 1] if 0 < n <= len(laps) else None
+
+def lap_table(files, gate):
+    # one row per lap of every run
+    rows = []
+    for path in files:
+        for entry in lap_index(path, gate)[0]['laps']:
+            rows.append(dict(entry, run=path))
+    columns = ['run', 'lap', 'start', 'end', 'start_time', 'end_time', 'time', 'sectors']
+    return pd.DataFrame(rows, columns=columns)
+
+def fastest(folder, gate=None):
+    # fastest lap of a test folder, or None
+    gate = gate or read_gate(folder_gate(folder))
+    table = lap_table(sorted(glob.glob(os.path.join(folder, 'rc_*.csv'))), gate)
+    return None if table.empty else table.loc[table['time'].idxmin()].to_dict()
+
+def main(args):
+    gate = read_gate(args.gate or folder_gate(args.input_folders[0]))
+    files = [f for folder in args.input_folders for f in sorted(glob.glob(os.path.join(folder, 'rc_*.csv')))]
+    print(f"gate {gate.get('name', '')}: start/finish and {len(gate['sectors'])} sector lines, {len(files)} runs")
+
+    # vectorized crossings against the per-step loop, over every run
+    lines = gate_lines(gate)
+    tracks = [run_track(get_run(f), gate)[0] for f in files]
+    t0 = time.perf_counter()
+    ref = [crossings_loop(xy, lines) for xy in tracks]
+    t_loop = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    out = [crossings(xy, lines) for xy in tracks]
+    t_vec = time.perf_counter() - t0
+    same = all(np.array_equal(a[1], b[1]) and np.allclose(a[2], b[2]) for a, b in zip(ref, out))
+    print(f"{sum(len(xy) for xy in tracks)} fixes: per-step loop {t_loop*1000:.0f} ms, vectorized {t_vec*1000:.1f} ms "
+          f"({t_loop/t_vec:.0f}x), {sum(len(c[1]) for c in out)} crossings, {'identical' if same else 'DIFFERENT'}")
+
+    # lap index: built (or refreshed), then read back
+    t0 = time.perf_counter()
+    computed = sum(lap_index(f, gate, args.refresh)[1] for f in files)
+    t_build = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    table = lap_table(files, gate)
+    t_read = time.perf_counter() - t0
+    print(f"lap index: {len(table)} laps, {computed} runs computed in {t_build*1000:.0f} ms, "
+          f"all read back in {t_read*1000:.1f} ms")
+    if not table.empty:
+        show = table.assign(run=table['run'].map(os.path.basename))
+        print(show[['run', 'lap', 'start', 'end', 'time', 'sectors']].to_string(index=False, float_format='%.2f'))
+
+    # queries on the index
+    if args.lap is not None:
+        path, n = args.lap[0], int(args.lap[1])
+        t0 = time.perf_counter()
+        found = lap(path, n, gate)
+        elapsed = time.perf_counter() - t0
+        print(f"lap {n} of {path}: {found} ({elapsed*1000:.2f} ms)")
+    for folder in args.input_folders:
+        t0 = time.perf_counter()
+        best = fastest(folder, gate)
+        elapsed = time.perf_counter() - t0
+        if best is None:
+            print(f"fastest lap in {folder}: none ({elapsed*1000:.1f} ms)")
+        else:
+            print(f"fastest lap in {folder}: {os.path.basename(best['run'])} lap {best['lap']}, "
+                  f"{best['time']:.2f} s ({elapsed*1000:.1f} ms)")
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Find laps with a start/finish gate, cache a lap index per run and query it")
+    parser.add_argument("input_folders", nargs='+', help="test folders, e.g. 'data/test 10'")
+    parser.add_argument("-g", "--gate", default=None, help="gate file (default: data/gates/<first folder>.json)")
+    parser.add_argument("-l", "--lap", nargs=2, default=None, metavar=('RUN', 'N'), help="look up lap N of this run")
+    parser.add_argument("--refresh", action='store_true', help="recompute lap indexes even if cached")
+    args = parser.parse_args()
+    main(args)
@@ -1,6 +1,8 @@
 import pandas as pd
+import numpy as np
 import argparse as argp
-from collections import defaultdict as dd
+import os
+from collections import defaultdict as dd, namedtuple
 
 def number_duplicates(data):
     counts = dd(int)
@@ -13,17 +15,117 @@ def number_duplicates(data):
             result.append(item)
     return result
 
-def main(args):
-    file_path = args.input_file
+# One entry per header field: "AccelX"|"G"|-3.0|3.0|25
+Channel = namedtuple('Channel', ['name', 'units', 'min', 'max', 'rate'])
 
+def read_header(file_path):
     with open(file_path, 'r') as file:
         header_line = file.readline().strip()
-        columns = [segment.split('|')[0].strip('"') for segment in header_line.split(',')]
+    fields = [segment.split('|') for segment in header_line.split(',')]
+    names = number_duplicates([f[0].strip('"') for f in fields])
+    schema = []
+    for name, f in zip(names, fields):
+        f = f + [''] * (5 - len(f))
+        schema.append(Channel(
+            name=name,
+            units=f[1].strip('"'),
+            min=float(f[2]) if f[2] else np.nan,
+            max=float(f[3]) if f[3] else np.nan,
+            rate=int(float(f[4])) if f[4] else 0,
+        ))
+    return schema
+
+def schema_for(path):
+    # csv exports live next to a logfiles/ folder holding the original .log
+    if path.endswith('.log'):
+        return read_header(path)
+    folder, name = os.path.split(path)
+    log = os.path.join(folder, 'logfiles', os.path.splitext(name)[0] + '.log')
+    return read_header(log) if os.path.exists(log) else None
+
+int_types = [np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32, np.int64]
+
+def narrow_dtype(values, channel=None):
+    # smallest dtype that holds every logged value of a channel without loss
+    v = values[~np.isnan(values)]
+    if v.size == 0:
+        return np.float32
+    lo, hi = v.min(), v.max()
+    if channel is not None and channel.min < channel.max:
+        # the header range is not enforced by the logger, so widen it by the data
+        lo, hi = min(lo, channel.min), max(hi, channel.max)
+    if np.all(v == np.round(v)):
+        for t in int_types:
+            info = np.iinfo(t)
+            if info.min <= lo and hi <= info.max:
+                return t
+    # float32 only if it reproduces every value at the precision it was logged with
+    d = logged_decimals(v)
+    if d is None:
+        return np.float64
+    v32 = v.astype(np.float32).astype(float)
+    return np.float32 if np.all(np.round(v32, d) == v) else np.float64
+
+def logged_decimals(v):
+    for d in range(7):
+        if np.all(np.abs(np.round(v, d) - v) <= 1e-9 * np.maximum(1.0, np.abs(v))):
+            return d
+    return None
+
+def to_float64(values, decimals=None):
+    # rounding a float32 channel at its logged precision gives back exactly the float64 the csv parser produced
+    values = np.asarray(values, dtype=float)
+    return values if decimals is None else np.round(values, decimals)
 
-    columns = number_duplicates(columns)
+nullable = {np.uint8: 'UInt8', np.int8: 'Int8', np.uint16: 'UInt16', np.int16: 'Int16',
+            np.uint32: 'UInt32', np.int32: 'Int32', np.int64: 'Int64'}
+
+def typed_frame(df, schema=None):
+    channels = {c.name: c for c in schema} if schema is not None else {}
+    out = {}
+    decimals = {}
+    for col in df.columns:
+        values = df[col].to_numpy(dtype=float)
+        t = narrow_dtype(values, channels.get(col))
+        if t is np.float32:
+            decimals[col] = logged_decimals(values[~np.isnan(values)])
+        if t in nullable:
+            # integer channels logged below 50 Hz keep their gaps as a mask
+            out[col] = pd.array(values, dtype=nullable[t]) if np.isnan(values).any() else values.astype(t)
+        else:
+            out[col] = values.astype(t)
+    typed = pd.DataFrame(out, index=df.index)
+    typed.attrs['units'] = {c: channels[c].units for c in df.columns if c in channels}
+    typed.attrs['rates'] = {c: channels[c].rate for c in df.columns if c in channels}
+    typed.attrs['decimals'] = decimals
+    return typed
+
+def read_log(file_path, typed=False):
+    schema = read_header(file_path)
+    columns = [c.name for c in schema]
 
     df = pd.read_csv(file_path, skiprows=1, names=columns, delimiter=',', na_values=['', ' '], on_bad_lines='warn')
+    return typed_frame(df, schema) if typed else df
+
+def iter_log(file_path, chunksize=10000, usecols=None):
+    # fixed-size chunks of rows; only one chunk is held in memory at a time
+    columns = [c.name for c in read_header(file_path)]
+    # columns are picked after parsing: with usecols pandas no longer drops lines with extra fields
+    reader = pd.read_csv(file_path, skiprows=1, names=columns, delimiter=',', na_values=['', ' '],
+                         on_bad_lines='warn', chunksize=chunksize)
+    with reader:
+        for chunk in reader:
+            yield chunk if usecols is None else chunk[usecols]
+
+def main(args):
+    df = read_log(args.input_file, typed=args.typed)
 
+    if args.typed:
+        wide = df.astype(float).memory_usage(deep=True).sum()
+        narrow = df.memory_usage(deep=True).sum()
+        for c in read_header(args.input_file):
+            print(f"{c.name:12s} {c.units:8s} {c.min:>8g} {c.max:>8g} {c.rate:>3d} Hz  {df[c.name].dtype}")
+        print(f"in memory: {wide/1e6:.2f} MB as float64, {narrow/1e6:.2f} MB typed ({wide/narrow:.1f}x smaller)")
     print(df.head())
     if args.output_file is not None:
         if str.endswith(args.output_file, ".csv"):
@@ -36,5 +138,6 @@ if __name__ == "__main__":
     parser = argp.ArgumentParser(description="Process log data from an input file")
     parser.add_argument("-i", "--input_file", required=True, help = "Path to the input file")
     parser.add_argument("-o", "--output_file", required=False, default = None, help = "Path to the output file")
+    parser.add_argument("-t", "--typed", action='store_true', help = "load channels with the narrowest dtype from the header metadata")
     args = parser.parse_args()
     main(args)
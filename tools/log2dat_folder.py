@@ -1,54 +1,119 @@
-import pandas as pd
 import argparse as argp
-from collections import defaultdict as dd
+import glob
+import json
 import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from log2dat import read_log
 
-def number_duplicates(data):
-    counts = dd(int)
-    result = []
-    for item in data:
-        counts[item] += 1
-        if counts[item] > 1:
-            result.append(f"{item}{counts[item] - 1}")
-        else:
-            result.append(item)
-    return result
+# Batch conversion of RaceCapture .log files. Every log is converted in its own
+# worker process, outputs are written to a temp file and renamed into place,
+# and logs whose output is newer than the log itself are skipped. As before,
+# nothing is written without an output folder: the logs are only parsed and
+# their rows and bad lines reported.
 
-def main(args):
-    folder_path = args.input_folder 
-    print(folder_path)
+def find_logs(folders):
+    # (log, root) pairs; root is the folder the log was found under (None for single files)
+    logs = {}
+    for folder in folders:
+        if os.path.isfile(folder):
+            logs.setdefault(folder, None)
+            continue
+        # keep the folder's own name in the mirrored layout
+        root = os.path.dirname(os.path.abspath(folder))
+        for log in glob.glob(os.path.join(folder, '**', '*.log'), recursive=True):
+            logs.setdefault(log, root)
+    return sorted(logs.items(), key=lambda item: item[0])
+
+def output_path(log, root, output_folder, output_type):
+    # test N/logfiles/rc_K.log -> <output_folder>/test N/rc_K.csv, None without an output folder
+    if output_folder is None:
+        return None
+    name = os.path.splitext(os.path.basename(log))[0] + '.' + output_type
+    folder = os.path.dirname(log)
+    if os.path.basename(folder) == 'logfiles':
+        folder = os.path.dirname(folder)
+    # mirror the layout under the output folder so runs from different test days never collide
+    folder = output_folder if root is None else os.path.join(output_folder, os.path.relpath(os.path.abspath(folder), root))
+    return os.path.normpath(os.path.join(folder, name))
+
+def up_to_date(log, out):
+    return os.path.exists(out) and os.path.getmtime(out) >= os.path.getmtime(log)
+
+def convert(log, out, output_type, force=False):
+    result = {'input': log, 'output': out, 'status': 'skipped', 'rows': None, 'bad_lines': None, 'seconds': 0.0}
+    if out is not None and not force and up_to_date(log, out):
+        return result
+    t0 = time.perf_counter()
     try:
-        for filename in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, filename)
-            if os.path.isfile(file_path):  # Ensure it's a file, not a subdirectory
-                try:
-                    with open(file_path, 'r') as file:
-                        print(f"Opened and processing: {filename}")
-                        header_line = file.readline().strip()
-                        columns = [segment.split('|')[0].strip('"') for segment in header_line.split(',')]
-
-                    columns = number_duplicates(columns)
-
-                    df = pd.read_csv(file_path, skiprows=1, names=columns, delimiter=',', na_values=['', ' '], on_bad_lines='warn')
-
-                    print(df.head())
-                    if args.output_folder is not None:
-                        if str.endswith(args.output_type, "csv"):
-                            df.to_csv(os.path.join(args.output_folder, filename.replace('.log', '.csv')))
-                        elif str.endswith(args.output_type, "xlsx"):
-                            df.to_excel(os.path.join(args.output_folder, filename.replace('.log', '.csv')))
-                        else: raise TypeError("Output type must be type .xlsx or .csv")
-                except Exception as e:
-                    print(f"Error opening {filename}: {e}")
-    except FileNotFoundError:
-      print(f"Error: Folder not found: {folder_path}")
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            df = read_log(log)
+        # pandas reports every dropped line as "Skipping line N: expected X fields, saw Y"
+        result['bad_lines'] = sum(str(w.message).count('Skipping line') for w in caught)
+        result['rows'] = len(df)
+        if out is None:
+            result['status'] = 'parsed'
+            result['seconds'] = round(time.perf_counter() - t0, 4)
+            return result
+
+        tmp = f"{out}.tmp{os.getpid()}"
+        if output_type == 'csv':
+            df.to_csv(tmp)
+        elif output_type == 'xlsx':
+            df.to_excel(tmp, engine='openpyxl')
+        else: raise TypeError("Output type must be type .xlsx or .csv")
+        os.replace(tmp, out)
+        result['status'] = 'converted'
     except Exception as e:
-      print(f"An error occurred: {e}")
+        result['status'] = 'error'
+        result['error'] = f"{type(e).__name__}: {e}"
+        if os.path.exists(f"{out}.tmp{os.getpid()}"):
+            os.remove(f"{out}.tmp{os.getpid()}")
+    result['seconds'] = round(time.perf_counter() - t0, 4)
+    return result
+
+def convert_all(logs, output_folder=None, output_type='csv', force=False, workers=None):
+    outs = [output_path(log, root, output_folder, output_type) for log, root in logs]
+    logs = [log for log, _ in logs]
+    for out in filter(None, outs):
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(convert, logs, outs, [output_type] * len(logs), [force] * len(logs)))
+
+def main(args):
+    t0 = time.perf_counter()
+    logs = find_logs(args.input_folder)
+    if not logs:
+        print(f"Error: no .log files found in {args.input_folder}")
+        return
+    results = convert_all(logs, args.output_folder, args.output_type, args.force, args.workers)
+    elapsed = time.perf_counter() - t0
+
+    for r in results:
+        if r['status'] in ('converted', 'parsed'):
+            print(f"{r['input']} -> {r['output'] or '(not written)'}: {r['rows']} rows, {r['bad_lines']} bad lines, {r['seconds']:.2f} s")
+        elif r['status'] == 'error':
+            print(f"Error converting {r['input']}: {r['error']}")
+
+    counts = {s: sum(r['status'] == s for r in results) for s in ('converted', 'parsed', 'skipped', 'error')}
+    mb = sum(os.path.getsize(r['input']) for r in results if r['status'] in ('converted', 'parsed')) / 1e6
+    print(f"{counts['converted']} converted, {counts['parsed']} parsed only, {counts['skipped']} up to date, {counts['error']} errors "
+          f"in {elapsed:.2f} s ({mb/elapsed:.1f} MB/s of logs)")
+
+    if args.summary is not None:
+        summary = {'seconds': round(elapsed, 4), 'counts': counts, 'files': results}
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=1)
 
 if __name__ == "__main__":
-    parser = argp.ArgumentParser(description="Process log data from an folder file")
-    parser.add_argument("-i", "--input_folder", required=True, help = "Path to the input folder")
-    parser.add_argument("-o", "--output_folder", required=False, default = None, help = "Path to the output folder")
+    parser = argp.ArgumentParser(description="Convert every log in one or more folders (searched recursively)")
+    parser.add_argument("-i", "--input_folder", nargs='+', required=True, help = "Folders (e.g. data/) or log files to convert")
+    parser.add_argument("-o", "--output_folder", required=False, default = None, help = "Path to the output folder, mirroring the input layout (without it nothing is written)")
     parser.add_argument("-t", "--output_type", required=False, default = 'csv', help = "output file type", choices = ['csv','xlsx'])
+    parser.add_argument("-f", "--force", action='store_true', help = "convert even if the output is up to date")
+    parser.add_argument("-w", "--workers", type=int, default=None, help = "worker processes (default: all cores)")
+    parser.add_argument("-s", "--summary", required=False, default = None, help = "write a json summary with per-file timing and bad-line counts")
     args = parser.parse_args()
     main(args)
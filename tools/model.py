@@ -0,0 +1,205 @@
+import numpy as np
+import argparse as argp
+import glob
+import json
+import os
+import time
+from run import get_run
+from fsm import compute_states
+from features import run_channels, window_stats, write_features, segment_types, feature_channels, stat_names
+from segment import segment_table, fix_labels
+from dataset import Store, build_store, fields
+
+# A small NumPy MLP on the window statistics of features.py. One shared stack
+# of ReLU layers feeds two softmax heads: the segment type of the window
+# (segment.py) and the aero state compute_states would be in at its last fix.
+# Training is mini-batch Adam over the memory-mapped store of dataset.py;
+# inference stacks every window of a run into one matrix, so scoring a run is
+# a few matrix products.
+
+heads = {'type': len(segment_types), 'state': 3}
+head_fields = {'type': 'y', 'state': 'state'}
+
+class MLP:
+    def __init__(self, n_in, hidden=(64, 64), seed=0, mean=None, std=None):
+        rng = np.random.default_rng(seed)
+        sizes = [n_in] + list(hidden)
+        self.params = {}
+        for i, (a, b) in enumerate(zip(sizes[:-1], sizes[1:])):
+            self.params[f'W{i}'] = (rng.normal(0, np.sqrt(2 / a), (a, b))).astype(np.float32)
+            self.params[f'b{i}'] = np.zeros(b, dtype=np.float32)
+        for name, n in heads.items():
+            self.params[f'W_{name}'] = (rng.normal(0, np.sqrt(1 / sizes[-1]), (sizes[-1], n))).astype(np.float32)
+            self.params[f'b_{name}'] = np.zeros(n, dtype=np.float32)
+        self.layers = len(hidden)
+        self.mean = np.zeros(n_in, dtype=np.float32) if mean is None else np.asarray(mean, dtype=np.float32).reshape(-1)
+        self.std = np.ones(n_in, dtype=np.float32) if std is None else np.asarray(std, dtype=np.float32).reshape(-1)
+
+    def forward(self, X):
+        # activations of every layer, and the logits of each head
+        h = [(X.reshape(len(X), -1) - self.mean) / self.std]
+        for i in range(self.layers):
+            h.append(np.maximum(h[-1] @ self.params[f'W{i}'] + self.params[f'b{i}'], 0))
+        logits = {name: h[-1] @ self.params[f'W_{name}'] + self.params[f'b_{name}'] for name in heads}
+        return h, logits
+
+    def predict(self, X):
+        _, logits = self.forward(X)
+        return {name: z.argmax(axis=1) for name, z in logits.items()}
+
+    def gradients(self, X, targets):
+        # mean cross-entropy summed over the heads, and its gradient for every parameter
+        h, logits = self.forward(X)
+        n = len(X)
+        grads, loss = {}, 0.0
+        back = np.zeros_like(h[-1])
+        for name, z in logits.items():
+            z = z - z.max(axis=1, keepdims=True)
+            p = np.exp(z)
+            p /= p.sum(axis=1, keepdims=True)
+            y = targets[name]
+            loss -= np.log(p[np.arange(n), y] + 1e-12).mean()
+            p[np.arange(n), y] -= 1
+            p /= n
+            grads[f'W_{name}'] = h[-1].T @ p
+            grads[f'b_{name}'] = p.sum(axis=0)
+            back += p @ self.params[f'W_{name}'].T
+        for i in reversed(range(self.layers)):
+            back *= h[i+1] > 0
+            grads[f'W{i}'] = h[i].T @ back
+            grads[f'b{i}'] = back.sum(axis=0)
+            back = back @ self.params[f'W{i}'].T
+        return loss, grads
+
+    def save(self, path):
+        np.savez(path, mean=self.mean, std=self.std, layers=self.layers, **self.params)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        model = cls.__new__(cls)
+        model.layers = int(data['layers'])
+        model.mean, model.std = data['mean'], data['std']
+        model.params = {k: data[k] for k in data.files if k not in ('mean', 'std', 'layers')}
+        return model
+
+def train(store, runs, epochs=10, batch_size=256, lr=1e-3, hidden=(64, 64), seed=0, log=print):
+    n_in = int(np.prod(store.X.shape[1:]))
+    model = MLP(n_in, hidden, seed, store.mean, store.std)
+    m = {k: np.zeros_like(v) for k, v in model.params.items()}
+    v = {k: np.zeros_like(v) for k, v in model.params.items()}
+    b1, b2, step = 0.9, 0.999, 0
+    loader = store.loader(batch_size, runs, shuffle=True, seed=seed, prefetch=4, fields=('X', 'y', 'state'))
+    for epoch in range(epochs):
+        total, batches = 0.0, 0
+        for X, y, state in loader:
+            loss, grads = model.gradients(X, {'type': y, 'state': state})
+            step += 1
+            for k, g in grads.items():
+                # Adam
+                m[k] = b1 * m[k] + (1 - b1) * g
+                v[k] = b2 * v[k] + (1 - b2) * g * g
+                model.params[k] -= lr * (m[k] / (1 - b1**step)) / (np.sqrt(v[k] / (1 - b2**step)) + 1e-8)
+            total += loss
+            batches += 1
+        if log is not None:
+            log(f"epoch {epoch}: loss {total / max(batches, 1):.3f}")
+    return model
+
+def evaluate(model, store, runs):
+    # accuracy of each head on the given runs
+    hits = {name: 0 for name in heads}
+    total = 0
+    for X, y, state in store.loader(8192, runs, shuffle=False, fields=('X', 'y', 'state')):
+        pred = model.predict(X)
+        hits['type'] += (pred['type'] == y).sum()
+        hits['state'] += (pred['state'] == state).sum()
+        total += len(y)
+    return {name: h / max(total, 1) for name, h in hits.items()}
+
+def score_run(model, run, window, stride=1):
+    # per-fix predictions for a whole run: every window in one batch; fixes before the
+    # first full window take its prediction
+    X = window_stats(run_channels(run), window, stride)
+    n = len(run.gps)
+    if not len(X):
+        return {name: np.zeros(n, dtype=int) for name in heads}
+    pred = model.predict(X)
+    last = np.arange(len(X)) * stride + window - 1
+    at = np.clip(np.searchsorted(last, np.arange(n)), 0, len(X) - 1)
+    return {name: p[at] for name, p in pred.items()}
+
+def store_ready(store_dir, files, window, stride):
+    # the store has every field the model reads, built from the current features of these runs at this window
+    try:
+        with open(os.path.join(store_dir, 'index.json')) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return (all(os.path.exists(os.path.join(store_dir, f'{k}.npy')) for k in fields)
+            and index.get('channels') == feature_channels and index.get('stats') == stat_names
+            and index.get('window') == window and index.get('stride') == stride
+            and [r['path'] for r in index.get('runs', [])] == list(files))
+
+def main(args):
+    feature_dir = os.path.join(args.cache_folder, 'features')
+    store_dir = os.path.join(args.cache_folder, 'dataset')
+    folders = args.input_folders or sorted(glob.glob(os.path.join('data', 'test *')))
+    files = [f for folder in folders for f in sorted(glob.glob(os.path.join(folder, 'rc_*.csv')))]
+    if args.rebuild or not store_ready(store_dir, files, args.window, args.stride):
+        t0 = time.perf_counter()
+        write_features(files, feature_dir, args.window, args.stride)
+        build_store(feature_dir, store_dir)
+        print(f"features and store built in {time.perf_counter() - t0:.2f} s")
+    store = Store(store_dir)
+    window = store.index['window']
+
+    # hold out whole runs
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(store.index['runs']))
+    val_runs, train_runs = order[:len(order) // 5], order[len(order) // 5:]
+    t0 = time.perf_counter()
+    model = train(store, train_runs, args.epochs, args.batch_size, args.lr, tuple(args.hidden), args.seed)
+    print(f"trained on {sum(e - s for s, e in store.run_ranges(train_runs))} windows in {time.perf_counter() - t0:.2f} s")
+    model.save(args.model_file)
+    acc = evaluate(model, store, val_runs)
+    print(f"held-out windows: segment type accuracy {acc['type']:.3f}, FSM state agreement {acc['state']:.3f}")
+
+    # latency and agreement per fix on the held-out runs, against the rule-based FSM
+    t_fsm, t_model, fixes, agree_state, agree_type = 0.0, 0.0, 0, 0, 0
+    for r in val_runs:
+        run = get_run(store.index['runs'][r]['path'])
+        gps = run.gps.copy()
+        if len(gps) < window:
+            continue
+        t0 = time.perf_counter()
+        states = compute_states(gps)
+        t_fsm += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        pred = score_run(model, run, window)
+        t_model += time.perf_counter() - t0
+        types = np.array([segment_types.index(t) for t in fix_labels(segment_table(run), len(gps))])
+        fixes += len(gps)
+        agree_state += (pred['state'] == states).sum()
+        agree_type += (pred['type'] == types).sum()
+    n = max(len(val_runs), 1)
+    print(f"{len(val_runs)} held-out runs, {fixes} fixes: FSM {t_fsm/n*1000:.2f} ms/run, "
+          f"model {t_model/n*1000:.2f} ms/run (windows included)")
+    print(f"per fix: state agrees with the FSM on {agree_state/max(fixes, 1):.3f}, "
+          f"segment type on {agree_type/max(fixes, 1):.3f}; model saved to {args.model_file}")
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Train the window MLP (segment type and aero state) and compare it with the FSM")
+    parser.add_argument("-i", "--input_folders", nargs='*', default=None, help="test folders (default: data/test *)")
+    parser.add_argument("-c", "--cache_folder", default='.cache', help="where the features and store live")
+    parser.add_argument("-m", "--model_file", default=os.path.join('.cache', 'model.npz'), help="where to save the weights")
+    parser.add_argument("-n", "--window", type=int, default=20, help="fixes per window (when building features)")
+    parser.add_argument("-s", "--stride", type=int, default=1, help="fixes between windows (when building features)")
+    parser.add_argument("-e", "--epochs", type=int, default=15, help="training epochs")
+    parser.add_argument("-b", "--batch_size", type=int, default=256, help="windows per batch")
+    parser.add_argument("--lr", type=float, default=1e-3, help="Adam learning rate")
+    parser.add_argument("--hidden", type=int, nargs='+', default=[64, 64], help="hidden layer sizes")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the split and initialization")
+    parser.add_argument("--rebuild", action='store_true', help="rebuild the features and store")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,144 @@
+import pandas as pd
+import numpy as np
+import argparse as argp
+import time
+from cache import load_run
+from log2dat import to_float64
+
+# RaceCapture logs put 1, 10, 25 and 50 Hz channels on one 50 Hz Interval grid,
+# so most cells are empty. A MultiRateRun keeps every channel only at the rows
+# where it was actually sampled. Channels sampled on exactly the same rows share
+# one timestamp array (a "group"). Alignment to any target grid is an explicit,
+# memoized operation instead of an ffill over the whole padded matrix.
+
+class MultiRateRun:
+    def __init__(self, base, groups, channels, units=None, rates=None, decimals=None):
+        self.base = base            # Interval (ms) of every row in the source log
+        self.groups = groups        # group id -> sample times (ms)
+        self.channels = channels    # name -> (group id, values at the group times)
+        self.units = units or {}
+        self.rates = rates or {}
+        self.decimals = decimals or {}
+        self._aligned = {}
+
+    @classmethod
+    def from_frame(cls, df, time_col='Interval'):
+        # a few logs start with a stray row stamped later than the next ones
+        if not df[time_col].is_monotonic_increasing:
+            df = df.sort_values(time_col, kind='stable')
+        base = df[time_col].to_numpy()
+        groups, channels, by_mask = {}, {}, {}
+        for col in df.columns:
+            if col == time_col:
+                continue
+            series = df[col]
+            present = series.notna().to_numpy()
+            if not present.any():
+                continue
+            key = present.tobytes()
+            if key not in by_mask:
+                by_mask[key] = len(groups)
+                groups[by_mask[key]] = np.ascontiguousarray(base[present])
+            values = series[present]
+            dtype = getattr(series.dtype, 'numpy_dtype', series.dtype)  # nullable ints lose their mask here
+            channels[col] = (by_mask[key], np.ascontiguousarray(values.to_numpy(dtype=dtype)))
+        return cls(base, groups, channels, df.attrs.get('units'), df.attrs.get('rates'), df.attrs.get('decimals'))
+
+    @classmethod
+    def load(cls, path, columns=None):
+        # columns must include 'Interval'; None loads every channel
+        return cls.from_frame(load_run(path, columns=columns, typed=True))
+
+    def __contains__(self, name):
+        return name in self.channels
+
+    def channel(self, name):
+        group, values = self.channels[name]
+        return self.groups[group], values
+
+    def sampled_at(self, names):
+        # times at which every one of the channels has a sample
+        t = self.channel(names[0])[0]
+        for name in names[1:]:
+            t = np.intersect1d(t, self.channel(name)[0])
+        return t
+
+    def native_rate(self, name):
+        # measured rate of a channel, from the median spacing of its own samples
+        t, _ = self.channel(name)
+        return 1000.0 / np.median(np.diff(t)) if len(t) > 1 else 0.0
+
+    def grid(self, rate_hz=None):
+        if rate_hz is None:
+            return self.base
+        step = 1000.0 / rate_hz
+        return np.arange(self.base[0], self.base[-1] + step/2, step)
+
+    def align(self, names, t=None, method='ffill', bfill=False):
+        # values of each channel at the times t (default: the original 50 Hz rows)
+        key = (tuple(names), 'base' if t is None else hash(np.asarray(t).tobytes()), method, bfill)
+        if key in self._aligned:
+            return self._aligned[key]
+        t = self.base if t is None else np.asarray(t)
+        out = {}
+        for name in names:
+            ts, values = self.channel(name)
+            values = to_float64(values, self.decimals.get(name))
+            if method == 'linear':
+                # np.interp holds the end values outside the sampled span
+                col = np.interp(t, ts, values)
+                if not bfill:
+                    col[t < ts[0]] = np.nan
+            else:
+                if method == 'nearest' and len(ts) > 1:
+                    idx = np.clip(np.searchsorted(ts, t), 1, len(ts) - 1)
+                    idx -= (t - ts[idx - 1]) < (ts[idx] - t)
+                    before = np.zeros(len(t), dtype=bool)
+                elif method == 'nearest':
+                    idx = np.zeros(len(t), dtype=int)
+                    before = np.zeros(len(t), dtype=bool)
+                else:
+                    # last sample at or before each target time
+                    idx = np.searchsorted(ts, t, side='right') - 1
+                    before = idx < 0
+                col = values[np.maximum(idx, 0)]
+                if not bfill:
+                    col[before] = np.nan
+            out[name] = col
+        frame = pd.DataFrame(out, index=pd.Index(t, name='Interval'))
+        self._aligned[key] = frame
+        return frame
+
+    def nbytes(self):
+        total = self.base.nbytes + sum(t.nbytes for t in self.groups.values())
+        return total + sum(v.nbytes for _, v in self.channels.values())
+
+def main(args):
+    dense_total, multi_total = 0, 0
+    for run in args.filenames:
+        df = load_run(run).sort_values('Interval', kind='stable')
+        # the padded side at the same narrow dtypes, so the ratio is the multi-rate saving alone
+        typed = load_run(run, typed=True)
+        t0 = time.perf_counter()
+        mr = MultiRateRun.load(run)
+        t_build = time.perf_counter() - t0
+
+        dense = typed.memory_usage(deep=True).sum()
+        dense_total += dense
+        multi_total += mr.nbytes()
+
+        # the aligned view must match what the tools get from ffill over the padded rows
+        cols = [c for c in ['AccelX', 'AccelY', 'TPS', 'Speed', 'FrontBP', 'SteerAng'] if c in mr]
+        aligned = mr.align(cols, bfill=True).to_numpy()
+        reference = df[cols].ffill().bfill().to_numpy(dtype=float)
+        close = np.array_equal(aligned, reference, equal_nan=True)
+        print(f"{run}: {dense/1e6:.2f} MB padded (typed), {mr.nbytes()/1e6:.2f} MB multi-rate, "
+              f"{len(mr.groups)} rate groups, built in {t_build*1000:.1f} ms, ffill {'matches' if close else 'DIFFERS'}")
+    print(f"total: {dense_total/1e6:.1f} MB padded (typed) vs {multi_total/1e6:.1f} MB multi-rate "
+          f"({dense_total/max(multi_total, 1):.1f}x smaller)")
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Compare padded 50 Hz frames with multi-rate channel storage")
+    parser.add_argument("filenames", nargs='+', help="A list of csvs or logs")
+    args = parser.parse_args()
+    main(args)
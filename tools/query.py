@@ -0,0 +1,265 @@
+import pandas as pd
+import numpy as np
+import argparse as argp
+import glob
+import json
+import operator
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from cache import cache_root, cache_key
+from multirate import MultiRateRun
+from run import Run
+from regions import read_map, map_index, map_xy
+
+# Queries across every run in data/test */. Each run is turned once into a
+# query table: one .npy column per channel on its 50 Hz rows (every channel
+# held at its last sample, as Run.gps does at the fixes), plus 'time' (s since
+# the first row) and 'state' (the FSM state of the last fix), and a meta.json
+# with the min/max of every column. A query is a list of predicates
+# ("AccelY > 1.1", "abs(AccelY) > 1.1", "state == 2", "time < 60"), an optional
+# region of a region map, and either columns to select or aggregations. Runs
+# whose min/max rule a predicate out are skipped without opening a column;
+# the rest are scanned on memory-mapped columns, one thread per run (the
+# comparisons run in NumPy without the GIL), reading only the columns the
+# query names.
+
+# channels kept in float64; the others are stored as float32
+wide_cols = ['Interval', 'Utc', 'Latitude', 'Longitude', 'time']
+skip_cols = ['Unnamed: 0']
+ops = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le, '==': operator.eq, '!=': operator.ne}
+agg_funcs = ['count', 'mean', 'min', 'max', 'sum']
+
+def table_dir(path):
+    return os.path.join(cache_root, 'query', cache_key(path))
+
+def build_table(path):
+    # write the run's query table; returns its meta
+    mr = MultiRateRun.load(path)
+    names = [c for c in mr.channels if c not in skip_cols]
+    frame = mr.align(names)
+    t = mr.base.astype(float)
+    cols = {'Interval': t, 'time': (t - t[0]) / 1000.0}
+    for c in names:
+        cols[c] = frame[c].to_numpy(dtype=np.float64 if c in wide_cols else np.float32)
+    # FSM state of the last fix at or before each row, -1 before the first fix
+    run = Run(path)
+    fix_t = run.gps['Interval'].to_numpy(dtype=float)
+    idx = np.searchsorted(fix_t, t, side='right') - 1
+    states = np.asarray(run.states, dtype=np.int8)
+    cols['state'] = np.where(idx >= 0, states[np.maximum(idx, 0)], -1).astype(np.int8) if len(states) else np.full(len(t), -1, np.int8)
+
+    entry = table_dir(path)
+    tmp = f"{entry}.tmp{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    meta = {'path': path, 'rows': len(t), 'columns': {}}
+    for c, v in cols.items():
+        np.save(os.path.join(tmp, f"{c}.npy"), v)
+        present = v[~np.isnan(v)] if v.dtype.kind == 'f' else v
+        meta['columns'][c] = [float(present.min()), float(present.max())] if len(present) else None
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    try:
+        os.replace(tmp, entry)
+    except OSError:
+        # another process finished the same table first
+        shutil.rmtree(tmp, ignore_errors=True)
+    return meta
+
+def read_meta(path):
+    with open(os.path.join(table_dir(path), 'meta.json')) as f:
+        return json.load(f)
+
+def build_tables(files, workers=None, refresh=False):
+    # meta of every run, building the tables that are missing (in parallel); returns (metas, built)
+    missing = [f for f in files if refresh or not os.path.exists(os.path.join(table_dir(f), 'meta.json'))]
+    for f in missing:
+        shutil.rmtree(table_dir(f), ignore_errors=True)
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(build_table, missing))
+    return {f: read_meta(f) for f in files}, len(missing)
+
+def parse_predicate(text):
+    # "AccelY > 1.1" or "abs(AccelY) > 1.1" -> (column, absolute, op, value)
+    m = re.fullmatch(r'\s*(abs\(\s*)?(\w+)\s*(?(1)\))\s*(>=|<=|==|!=|>|<)\s*(-?[\d.eE+-]+)\s*', text)
+    if m is None:
+        raise ValueError(f"cannot parse predicate '{text}' (expected e.g. 'AccelY > 1.1' or 'abs(AccelY) > 1.1')")
+    return m.group(2), m.group(1) is not None, m.group(3), float(m.group(4))
+
+def value_range(meta, column, absolute):
+    # [min, max] of a column (of its absolute value), None if the run does not have it
+    r = meta['columns'].get(column)
+    if r is None or not absolute:
+        return r
+    lo, hi = r
+    return [0.0 if lo <= 0 <= hi else min(abs(lo), abs(hi)), max(abs(lo), abs(hi))]
+
+def can_match(meta, preds):
+    # False when the min/max of some column rule a predicate out for every row
+    for column, absolute, op, value in preds:
+        r = value_range(meta, column, absolute)
+        if r is None:
+            return False
+        lo, hi = r
+        if ((op == '>' and hi <= value) or (op == '>=' and hi < value) or (op == '<' and lo >= value)
+                or (op == '<=' and lo > value) or (op == '==' and not lo <= value <= hi)
+                or (op == '!=' and lo == hi == value)):
+            return False
+    return True
+
+def region_box(region_map, region):
+    # lat/lon bounding box of the named region's polygons
+    verts = np.concatenate([np.asarray(r['polygon'], dtype=float) for r in region_map['regions'] if r['name'] == region])
+    return verts.min(axis=0), verts.max(axis=0)
+
+def in_box(meta, box):
+    lat, lon = meta['columns'].get('Latitude'), meta['columns'].get('Longitude')
+    if lat is None or lon is None:
+        return False
+    (lat0, lon0), (lat1, lon1) = box
+    return lat[0] <= lat1 and lat[1] >= lat0 and lon[0] <= lon1 and lon[1] >= lon0
+
+def scan_run(path, preds, columns, region_map=None, region=None):
+    # rows of one run that pass every predicate (and lie in the region), with the wanted columns
+    entry = table_dir(path)
+    load = lambda c: np.load(os.path.join(entry, f"{c}.npy"), mmap_mode='r')
+    mask = None
+    for column, absolute, op, value in preds:
+        if not os.path.exists(os.path.join(entry, f"{column}.npy")):
+            # the run does not log the channel: no row matches (as can_match says)
+            return None
+        v = load(column)
+        if mask is not None:
+            v = v[mask]
+        hit = ops[op](np.abs(v) if absolute else v, value)
+        mask = np.flatnonzero(hit) if mask is None else mask[hit]
+        if not len(mask):
+            return None
+    if region is not None:
+        lat, lon = load('Latitude'), load('Longitude')
+        lat, lon = (lat, lon) if mask is None else (lat[mask], lon[mask])
+        names = [r['name'] for r in region_map['regions']]
+        fixed = np.flatnonzero(~np.isnan(lat) & ~np.isnan(lon))    # no position before the first fix
+        codes = map_index(region_map).label_codes(map_xy(pd.DataFrame({'Latitude': lat[fixed], 'Longitude': lon[fixed]}), region_map))
+        hit = np.zeros(len(lat), dtype=bool)
+        hit[fixed] = np.isin(codes, [i for i, n in enumerate(names) if n == region])
+        mask = np.flatnonzero(hit) if mask is None else mask[hit]
+        if not len(mask):
+            return None
+    out = {}
+    for c in columns:
+        if c in ('run', 'test'):
+            continue
+        v = load(c) if os.path.exists(os.path.join(entry, f"{c}.npy")) else np.full(read_meta(path)['rows'], np.nan)
+        out[c] = np.asarray(v if mask is None else v[mask])
+    n = len(next(iter(out.values()))) if out else (len(mask) if mask is not None else read_meta(path)['rows'])
+    frame = pd.DataFrame(out, index=pd.RangeIndex(n))
+    frame['run'] = path
+    frame['test'] = os.path.basename(os.path.dirname(path))
+    return frame
+
+def parse_aggs(specs):
+    # ['count', 'mean:Speed', 'max:AccelY'] -> [(name, func, column)]
+    aggs = []
+    for spec in specs:
+        func, _, column = spec.partition(':')
+        if func not in agg_funcs or (func != 'count' and not column):
+            raise ValueError(f"cannot parse aggregation '{spec}' (expected count or one of {agg_funcs[1:]} as func:column)")
+        aggs.append((spec, func, column or None))
+    return aggs
+
+def query(files, where=(), select=None, aggs=None, by=None, region_map=None, region=None, workers=None, skip=True):
+    # matched rows (select) or aggregates (aggs, grouped by a column, 'run' or 'test'); also
+    # returns how many runs were scanned
+    metas, _ = build_tables(files, workers)
+    preds = [parse_predicate(w) for w in where]
+    aggs = parse_aggs(aggs or [])
+    known = {c for meta in metas.values() for c in meta['columns']}
+    unknown = sorted({p[0] for p in preds} - known)
+    if metas and unknown:
+        raise ValueError(f"no run has column(s) {', '.join(unknown)}")
+    box = region_box(region_map, region) if region is not None else None
+    candidates = [f for f in files if not skip or (can_match(metas[f], preds) and (box is None or in_box(metas[f], box)))]
+    if aggs:
+        columns = sorted({c for _, _, c in aggs if c} | ({by} if by else set()))
+    else:
+        columns = list(select or ['Interval', 'time'] + [p[0] for p in preds])
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        parts = [p for p in pool.map(lambda f: scan_run(f, preds, columns, region_map, region), candidates) if p is not None]
+    rows = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['run', 'test'] + [c for c in columns if c not in ('run', 'test')])
+    if not aggs:
+        return rows[['run', 'test'] + [c for c in columns if c not in ('run', 'test')]], len(candidates)
+    spec = {name: (column or 'run', func) for name, func, column in aggs}
+    key = by or rows.assign(all='all')['all']
+    return rows.groupby(key).agg(**spec), len(candidates)
+
+def baseline(files, preds):
+    # reference: what a one-off script does, parsing every csv and filtering its padded rows
+    total = 0
+    for f in files:
+        df = pd.read_csv(f).sort_values('Interval', kind='stable').ffill()
+        gps = Run(f).gps
+        idx = np.searchsorted(gps['Interval'].to_numpy(dtype=float), df['Interval'].to_numpy(dtype=float), side='right') - 1
+        df['state'] = np.where(idx >= 0, np.asarray(Run(f).states)[np.maximum(idx, 0)], -1)
+        df['time'] = (df['Interval'] - df['Interval'].iloc[0]) / 1000.0
+        mask = np.ones(len(df), dtype=bool)
+        for column, absolute, op, value in preds:
+            if column not in df:
+                mask[:] = False
+                continue
+            v = df[column].to_numpy(dtype=float)
+            mask &= ops[op](np.abs(v) if absolute else v, value)
+        total += mask.sum()
+    return total
+
+def main(args):
+    folders = args.input_folders or sorted(glob.glob(os.path.join('data', 'test *')))
+    files = [f for folder in folders for f in sorted(glob.glob(os.path.join(folder, 'rc_*.csv')))]
+    t0 = time.perf_counter()
+    _, built = build_tables(files, args.workers, args.refresh)
+    if built:
+        print(f"{built} query tables built in {time.perf_counter() - t0:.2f} s")
+    region_map = read_map(args.region_map) if args.region_map is not None else None
+
+    timings = {}
+    for skip in (False, True):
+        t0 = time.perf_counter()
+        try:
+            result, scanned = query(files, args.where, args.select, args.aggregate, args.by, region_map, args.region, args.workers, skip)
+        except ValueError as e:
+            print(e)
+            return
+        timings[skip] = (time.perf_counter() - t0, scanned)
+    print(f"{len(files)} runs: {timings[False][0]*1000:.0f} ms scanning all of them, "
+          f"{timings[True][0]*1000:.0f} ms with min/max skipping ({timings[True][1]} scanned)")
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        if args.aggregate:
+            print(result.to_string(float_format='%.3f'))
+        else:
+            print(f"{len(result)} rows matched")
+            shown = result.assign(run=result['run'].map(lambda p: os.path.join(os.path.basename(os.path.dirname(p)), os.path.basename(p))))
+            print(shown.head(args.limit).to_string(index=False))
+    if args.baseline:
+        preds = [parse_predicate(w) for w in args.where]
+        t0 = time.perf_counter()
+        n = baseline(files, preds)
+        print(f"re-reading every csv: {n} rows matched in {time.perf_counter() - t0:.2f} s")
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Query channel predicates, regions and aggregates across every run")
+    parser.add_argument("-i", "--input_folders", nargs='*', default=None, help="test folders (default: data/test *)")
+    parser.add_argument("-w", "--where", action='append', default=[], help="predicate, e.g. 'abs(AccelY) > 1.1' or 'state == 2' (repeatable, all must hold)")
+    parser.add_argument("-s", "--select", nargs='+', default=None, help="columns of the matched rows to return")
+    parser.add_argument("-a", "--aggregate", nargs='+', default=None, help="aggregations: count, mean:COL, min:COL, max:COL, sum:COL")
+    parser.add_argument("-b", "--by", default=None, help="group aggregations by a column, 'run' or 'test'")
+    parser.add_argument("-m", "--region_map", default=None, help="region map (json) for --region")
+    parser.add_argument("-r", "--region", default=None, help="only rows inside this region of the map")
+    parser.add_argument("-n", "--limit", type=int, default=20, help="matched rows to print")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker threads/processes (default: all cores)")
+    parser.add_argument("--refresh", action='store_true', help="rebuild the query tables")
+    parser.add_argument("--baseline", action='store_true', help="also time re-reading every csv for the same predicates")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,243 @@
+import pandas as pd
+import numpy as np
+import argparse as argp
+import glob
+import hashlib
+import json
+import os
+import time
+from matplotlib.path import Path
+from scipy.spatial import ConvexHull
+from cache import load_run, cache_root, cache_key
+from run import project
+
+# Point-in-polygon labeling with a uniform grid over the polygon bounding boxes.
+# Points are sorted by grid cell once; each polygon then only looks at the
+# points in the cells its bounding box covers, drops those outside the box, and
+# runs Path.contains_points on what is left. Polygons are applied in order, so
+# as in the original loop a later polygon overrides an earlier one.
+
+def flatten(region_paths):
+    # {name: [Path, ...]} -> [(name, Path), ...] in labeling order
+    return [(name, path) for name, paths in region_paths.items() for path in paths]
+
+def label_loop(regions, xy, unlabeled='unlabeled'):
+    # reference: every polygon against every point
+    labels = np.full(len(xy), unlabeled, dtype=object)
+    for name, path in regions:
+        labels[path.contains_points(xy)] = name
+    return labels
+
+class RegionIndex:
+    def __init__(self, regions, cell=None):
+        self.names = [name for name, _ in regions]
+        self.paths = [path for _, path in regions]
+        boxes = [(p.vertices.min(axis=0), p.vertices.max(axis=0)) for p in self.paths]
+        self.lo = np.array([b[0] for b in boxes]).reshape(-1, 2)
+        self.hi = np.array([b[1] for b in boxes]).reshape(-1, 2)
+        if not len(self.paths):
+            self.origin, self.cell, self.shape = np.zeros(2), 1.0, (0, 0)
+            return
+        self.origin = self.lo.min(axis=0)
+        if cell is None:
+            # a quarter of the median box side, so candidates hug each box; at most ~1M cells
+            extent = self.hi.max(axis=0) - self.origin
+            cell = max(float(np.median((self.hi - self.lo).max(axis=1))) / 4, np.sqrt(extent.prod() / 1e6), 1e-9)
+        self.cell = cell
+        self.shape = tuple((np.floor((self.hi.max(axis=0) - self.origin) / self.cell)).astype(int) + 1)
+
+    def cells(self, xy):
+        # flat cell id of each point (row-major in y), -1 outside the grid
+        ij = np.floor((xy - self.origin) / self.cell).astype(np.int64)
+        nx, ny = self.shape
+        inside = (ij[:, 0] >= 0) & (ij[:, 0] < nx) & (ij[:, 1] >= 0) & (ij[:, 1] < ny)
+        return np.where(inside, ij[:, 1] * nx + ij[:, 0], -1)
+
+    def label_codes(self, xy):
+        # index into self.names of the last polygon containing each point, -1 if none
+        xy = np.asarray(xy, dtype=float)
+        codes = np.full(len(xy), -1, dtype=np.int32)
+        if not len(self.paths) or not len(xy):
+            return codes
+        # points outside the grid cannot be in any polygon; the rest are kept in cell order
+        cell_ids = self.cells(xy)
+        inside = np.flatnonzero(cell_ids >= 0)
+        order = inside[np.argsort(cell_ids[inside], kind='stable')]
+        sorted_ids = cell_ids[order]
+        sorted_xy = xy[order]
+        nx, _ = self.shape
+        for k, path in enumerate(self.paths):
+            (i0, j0), (i1, j1) = np.floor((np.array([self.lo[k], self.hi[k]]) - self.origin) / self.cell).astype(int)
+            # cells of one grid row are contiguous ids, so each row is one slice of the sorted points
+            rows = np.arange(j0, j1 + 1) * nx
+            starts = np.searchsorted(sorted_ids, rows + i0, side='left')
+            ends = np.searchsorted(sorted_ids, rows + i1, side='right')
+            if not (ends > starts).any():
+                continue
+            pos = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)])
+            pts = np.concatenate([sorted_xy[s:e] for s, e in zip(starts, ends)])
+            box = np.all((pts >= self.lo[k]) & (pts <= self.hi[k]), axis=1)
+            pos, pts = pos[box], pts[box]
+            if len(pos):
+                codes[order[pos[path.contains_points(pts)]]] = k
+        return codes
+
+    def label(self, xy, unlabeled='unlabeled'):
+        names = np.array(self.names + [unlabeled], dtype=object)
+        return names[self.label_codes(xy)]
+
+# Region maps are json files anchored in absolute coordinates:
+#   {"name": ..., "origin": [lat, lon],
+#    "regions": [{"name": "straight", "polygon": [[lat, lon], ...]}, ...]}
+# Regions are applied in file order (a later region wins where they overlap).
+# Points and polygons are projected around the map's origin, so labels do not
+# depend on which runs are loaded together. The projection only scales lat and
+# lon, which leaves point-in-polygon tests unchanged, so the origin just sets
+# the plotting frame.
+
+def read_map(path):
+    with open(path) as f:
+        region_map = json.load(f)
+    if 'origin' not in region_map:
+        verts = np.concatenate([np.asarray(r['polygon'], dtype=float) for r in region_map['regions']])
+        region_map['origin'] = verts.mean(axis=0).tolist()
+    return region_map
+
+def write_map(path, regions, origin=None, name=''):
+    # regions: [(name, [(lat, lon), ...]), ...] in labeling order; one region per line
+    if origin is None:
+        origin = np.concatenate([np.asarray(poly, dtype=float) for _, poly in regions]).mean(axis=0)
+    region_map = {'name': name, 'origin': [float(v) for v in origin],
+                  'regions': [{'name': n, 'polygon': [[float(a), float(b)] for a, b in poly]} for n, poly in regions]}
+    body = ',\n'.join('  ' + json.dumps(r) for r in region_map['regions'])
+    with open(path, 'w') as f:
+        f.write(f'{{\n "name": {json.dumps(name)},\n "origin": {json.dumps(region_map["origin"])},\n "regions": [\n{body}\n ]\n}}\n')
+    return region_map
+
+def map_hash(region_map):
+    # only what changes the labels: origin, names, vertices and their order
+    canonical = json.dumps({'origin': region_map['origin'], 'regions': region_map['regions']}, sort_keys=True)
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+def map_regions(region_map):
+    # [(name, Path)] in meters around the map origin
+    lat0, lon0 = region_map['origin']
+    regions = []
+    for r in region_map['regions']:
+        poly = np.asarray(r['polygon'], dtype=float)
+        regions.append((r['name'], Path(np.column_stack(project(poly[:, 0], poly[:, 1], lat0, lon0)))))
+    return regions
+
+def map_xy(df, region_map):
+    return np.column_stack(project(df['Latitude'].to_numpy(dtype=float), df['Longitude'].to_numpy(dtype=float), *region_map['origin']))
+
+_indexes = {}
+
+def map_index(region_map):
+    key = map_hash(region_map)
+    if key not in _indexes:
+        _indexes[key] = RegionIndex(map_regions(region_map))
+    return _indexes[key]
+
+def label_path(path, region_map):
+    return os.path.join(cache_root, 'labels', cache_key(path), map_hash(region_map) + '.npy')
+
+def label_run(path, region_map, refresh=False):
+    # label codes of the run's GPS fixes (rows with Latitude and Longitude), cached per (run, map)
+    entry = label_path(path, region_map)
+    if not refresh and os.path.exists(entry):
+        return np.load(entry), False
+    gps = load_run(path, columns=['Latitude', 'Longitude']).dropna(subset=['Latitude', 'Longitude'])
+    codes = map_index(region_map).label_codes(map_xy(gps, region_map)).astype(np.int16)
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp = f"{entry}.tmp{os.getpid()}.npy"
+    np.save(tmp, codes)
+    os.replace(tmp, entry)
+    return codes, True
+
+def label_names(region_map, codes, unlabeled='unlabeled'):
+    names = np.array([r['name'] for r in region_map['regions']] + [unlabeled], dtype=object)
+    return names[codes]
+
+def project_all(frames):
+    # labeler_poly's frame: projected around the mean of all fixes
+    lat = np.concatenate([f['Latitude'].to_numpy(dtype=float) for f in frames])
+    lon = np.concatenate([f['Longitude'].to_numpy(dtype=float) for f in frames])
+    return np.column_stack(project(lat, lon, lat.mean(), lon.mean()))
+
+def track_segments(xy, n, width=8.0):
+    # n convex polygons covering consecutive stretches of one lap-like trace
+    dist = np.concatenate([[0], np.cumsum(np.hypot(*np.diff(xy, axis=0).T))])
+    edges = np.linspace(0, dist[-1], n + 1)
+    square = np.array([(-1, -1), (1, -1), (1, 1), (-1, 1)]) * width
+    regions = []
+    for k in range(n):
+        piece = xy[(dist >= edges[k]) & (dist <= edges[k+1])]
+        if len(piece) < 2:
+            continue
+        pts = (piece[:, None, :] + square[None]).reshape(-1, 2)
+        hull = pts[ConvexHull(pts).vertices]
+        regions.append((f'segment_{k}', Path(hull)))
+    return regions
+
+def label_folders(files, region_map, refresh=False):
+    computed = 0
+    labels = {}
+    for run in files:
+        labels[run], fresh = label_run(run, region_map, refresh)
+        computed += fresh
+    return labels, computed
+
+def main(args):
+    folders = args.input_folders or sorted(glob.glob(os.path.join('data', 'test *')))
+    files = [run for folder in folders for run in sorted(glob.glob(os.path.join(folder, 'rc_*.csv')))]
+    if args.region_map is not None:
+        # label every run with a map file, through the label cache
+        region_map = read_map(args.region_map)
+        t0 = time.perf_counter()
+        labels, computed = label_folders(files, region_map, args.refresh)
+        elapsed = time.perf_counter() - t0
+        counts = pd.Series(label_names(region_map, np.concatenate(list(labels.values())))).value_counts()
+        print(f"{len(files)} runs labeled in {elapsed:.3f} s ({computed} computed, {len(files)-computed} from cache)")
+        print(counts.to_string())
+        return
+
+    frames = []
+    for run in files:
+        df = load_run(run, columns=['Latitude', 'Longitude'])
+        frames.append(df.dropna(subset=['Latitude', 'Longitude']))
+    xy = project_all(frames)
+    if args.repeat > 1:
+        # more points over the same track, jittered by a few meters
+        rng = np.random.default_rng(0)
+        xy = np.concatenate([xy] + [xy + rng.normal(0, 2.0, xy.shape) for _ in range(args.repeat - 1)])
+    print(f"{len(frames)} runs, {len(xy)} points")
+
+    # the labeler_poly regions, offset to the first fix, plus a map of track segments
+    from labeler_poly import regions as poly_regions, region_paths
+    example = flatten(region_paths(poly_regions, xy[0]))
+    k = int(np.argmax([len(f) for f in frames]))
+    start = sum(len(f) for f in frames[:k])
+    segments = track_segments(xy[start:start + len(frames[k])], args.segments)
+
+    for title, regions in [('labeler_poly regions', example), (f'{len(segments)} track segments', segments)]:
+        t0 = time.perf_counter()
+        ref = label_loop(regions, xy)
+        t_loop = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        index = RegionIndex(regions)
+        labels = index.label(xy)
+        t_index = time.perf_counter() - t0
+        same = np.array_equal(ref, labels)
+        print(f"{title}: loop {t_loop:.3f} s, grid index {t_index:.3f} s ({t_loop/t_index:.1f}x), "
+              f"{(labels != 'unlabeled').sum()} labeled, {'identical' if same else 'DIFFERENT'}")
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Label runs with a region map, or benchmark grid-indexed labeling against the per-polygon loop")
+    parser.add_argument("-i", "--input_folders", nargs='*', default=None, help="test folders (default: data/test *)")
+    parser.add_argument("-n", "--segments", type=int, default=48, help="polygons in the synthetic track map")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="replicate the points (jittered) this many times")
+    parser.add_argument("-m", "--region_map", default=None, help="label the runs with this region map (json) instead of benchmarking")
+    parser.add_argument("--refresh", action='store_true', help="recompute labels even if cached")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,235 @@
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import matplotlib.pyplot as plt
+import argparse as argp
+import glob
+import html
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from matplotlib.collections import LineCollection, PathCollection
+from matplotlib.colors import Normalize
+from run import get_run
+
+# Headless rendering of the vis_* views. Each worker process builds a view's
+# figure once, with the view's own plot function on the first run it gets, and
+# for every later run only swaps in the segments, colors, norms, end marker,
+# limits and titles from the same *_panels function the plot function draws.
+
+def view_functions(view):
+    # (plot function, panels function, tight_layout rect) of a vis_* view
+    if view == 'all':
+        from vis_all import plot_all_metrics, all_panels
+        # every segment: the decimated level re-decimates per figure on draw (see decimate.py)
+        return (lambda run: plot_all_metrics(run, decimate=False)), all_panels, [0,0,1,0.96]
+    from vis_a import plot_accel, accel_panels
+    from vis_v import plot_speed, speed_panels
+    from vis_c import plot_curvature, curvature_panels
+    from vis_f import plot_states, states_panels
+    return {'a': (plot_accel, accel_panels, None), 'v': (plot_speed, speed_panels, None),
+            'c': (plot_curvature, curvature_panels, None), 'f': (plot_states, states_panels, None)}[view]
+
+views = ['all', 'v', 'a', 'c', 'f']
+subplot_params = ['left', 'right', 'bottom', 'top', 'wspace', 'hspace']
+
+class Scaffold:
+    def __init__(self, view):
+        self.plot, self.panels, self.rect = view_functions(view)
+        self.fig = None
+
+    def build(self, run):
+        # the first figure, and the artists that change from run to run on each of its panels
+        self.fig = self.plot(run)
+        if self.fig is None:
+            return
+        self.axes = []
+        for ax in self.fig.axes:
+            # the track is the line collection with a colorbar (colorbar axes hold others)
+            lcs = [c for c in ax.collections if isinstance(c, LineCollection) and c.colorbar is not None]
+            if not lcs:
+                continue
+            lc = lcs[0]
+            points = [c for c in ax.collections if isinstance(c, PathCollection)]
+            end = next(l for l in ax.lines if l.get_label() == 'End')
+            self.axes.append((ax, lc, lc.colorbar, points[0] if points else None, end))
+
+    def draw(self, run):
+        # the figure for a run, or None where the view's plot function draws nothing or fails
+        # (accel that does not straddle 0)
+        if self.fig is None:
+            before = set(plt.get_fignums())
+            try:
+                self.build(run)
+            except ValueError:
+                for n in set(plt.get_fignums()) - before:
+                    plt.close(n)
+                self.fig = None
+            return self.fig
+        try:
+            panels = self.panels(run)
+        except ValueError:
+            return None
+        if panels is None:
+            return None
+        for (ax, lc, cbar, points, end), p in zip(self.axes, panels):
+            lc.set_segments(p['segs'])
+            lc.set_array(p['values'])
+            if points is not None:
+                # before the colorbar, which widens a norm with vmin == vmax in place
+                pts, values = p['points']
+                points.set_offsets(pts)
+                points.set_array(values)
+                points.set_norm(Normalize(vmin=p['norm'].vmin, vmax=p['norm'].vmax))
+            if p['norm'] is not None:
+                # the state colorbar keeps its fixed ticks and labels
+                lc.set_norm(p['norm'])
+                cbar.update_normal(lc)
+            end.set_data([p['end'][0]], [p['end'][1]])
+            ax.set_title(p['title'])
+            # the data limits add_collection and plot give a new figure
+            ax.ignore_existing_data_limits = True
+            xy = np.concatenate([p['segs'].reshape(-1, 2), [[0, 0], p['end']]])
+            ax.update_datalim(xy[np.isfinite(xy).all(axis=1)])
+            ax.autoscale_view()
+        if self.fig._suptitle is not None:
+            self.fig._suptitle.set_text(os.path.basename(run.path))
+        # tick labels and titles change with the run, so the layout is redone as the plot function
+        # does it, starting like a new figure from the default subplot parameters (tight_layout
+        # moves on from wherever the last run left it)
+        self.fig.subplots_adjust(**{k: plt.rcParams[f'figure.subplot.{k}'] for k in subplot_params})
+        for ax in self.fig.axes:
+            ax.reset_position()
+        self.fig.tight_layout(rect=self.rect)
+        return self.fig
+
+_scaffolds = {}
+
+def output_name(path, view):
+    # data/test 5/rc_9.csv -> test 5/rc_9_all
+    folder = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    return os.path.join(folder, f"{os.path.splitext(os.path.basename(path))[0]}_{view}")
+
+def render_run(path, view_names, out_dir, formats, dpi, fresh=False):
+    t0 = time.perf_counter()
+    run = get_run(path)
+    written = {}
+    for view in view_names:
+        name = output_name(path, view)
+        os.makedirs(os.path.join(out_dir, os.path.dirname(name)), exist_ok=True)
+        if fresh:
+            # the interactive code path: a new figure per run
+            fig = fresh_figure(view, run)
+        else:
+            if view not in _scaffolds:
+                _scaffolds[view] = Scaffold(view)
+            fig = _scaffolds[view].draw(run)
+        if fig is None:
+            continue
+        fig.set_dpi(dpi)
+        written[view] = []
+        for fmt in formats:
+            target = os.path.join(out_dir, f"{name}.{fmt}")
+            if fmt == 'png':
+                # one Agg draw, written straight from the canvas buffer (savefig draws twice)
+                fig.canvas.draw()
+                Image.fromarray(np.asarray(fig.canvas.buffer_rgba())).save(target, compress_level=1)
+            else:
+                fig.savefig(target, dpi=dpi)
+            written[view].append(f"{name}.{fmt}")
+        if fresh:
+            plt.close(fig)
+    return path, written, time.perf_counter() - t0
+
+def fresh_figure(view, run):
+    try:
+        return view_functions(view)[0](run)
+    except ValueError:
+        # the interactive views fail on runs where accel does not straddle 0
+        plt.close('all')
+        return None
+
+def write_index(out_dir, results, view_names, formats):
+    img = 'png' if 'png' in formats else formats[0]
+    rows = []
+    for path, written, _ in results:
+        cells = []
+        for view in view_names:
+            files = written.get(view)
+            if not files:
+                cells.append('<td></td>')
+                continue
+            src = html.escape(next(f for f in files if f.endswith(img)))
+            links = ' '.join(f'<a href="{html.escape(f)}">{os.path.splitext(f)[1][1:]}</a>' for f in files)
+            cells.append(f'<td><a href="{src}"><img src="{src}" width="320"></a><br>{links}</td>')
+        rows.append(f'<tr><th>{html.escape(path)}</th>{"".join(cells)}</tr>')
+    header = ''.join(f'<th>{v}</th>' for v in view_names)
+    page = (f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>TR25 runs</title>'
+            f'<style>td,th{{padding:4px;vertical-align:top}} th{{text-align:left}}</style></head>\n'
+            f'<body><table>\n<tr><th>run</th>{header}</tr>\n' + '\n'.join(rows) + '\n</table></body></html>\n')
+    with open(os.path.join(out_dir, 'index.html'), 'w') as f:
+        f.write(page)
+
+def render_all(files, view_names, out_dir, formats, dpi=100, workers=None, fresh=False):
+    n = len(files)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # chunked so each worker keeps its scaffolds across several runs
+        chunksize = max(1, n // (4 * (workers or os.cpu_count() or 1)))
+        return list(pool.map(render_run, files, [view_names]*n, [out_dir]*n, [formats]*n, [dpi]*n, [fresh]*n, chunksize=chunksize))
+
+def compare_renders(results, fresh, out_dir, fresh_dir):
+    # pixel differences between the scaffold pngs and the ones the vis_* plot functions draw
+    fresh = {path: written for path, written, _ in fresh}
+    worst = {}
+    for path, written, _ in results:
+        views = set(written) | set(fresh[path])
+        for view in views:
+            if view not in written or view not in fresh[path]:
+                print(f"{path} {view}: drawn by {'the scaffold' if view in written else 'the plot function'} only")
+                continue
+            name = next(f for f in written[view] if f.endswith('.png'))
+            a = np.asarray(Image.open(os.path.join(out_dir, name)).convert('RGB'), dtype=int)
+            b = np.asarray(Image.open(os.path.join(fresh_dir, name)).convert('RGB'), dtype=int)
+            diff = (np.abs(a - b).max(axis=-1) > 0).mean() if a.shape == b.shape else 1.0
+            if diff > worst.get(view, (-1, None))[0]:
+                worst[view] = (diff, path)
+    for view, (diff, path) in sorted(worst.items()):
+        print(f"view {view}: at most {diff*100:.3f}% of pixels differ ({path})")
+
+def main(args):
+    files = []
+    for name in args.inputs:
+        files += sorted(glob.glob(os.path.join(name, 'rc_*.csv'))) if os.path.isdir(name) else [name]
+    if not files:
+        print(f"Error: no runs found in {args.inputs}")
+        return
+
+    t0 = time.perf_counter()
+    results = render_all(files, args.views, args.output_folder, args.formats, args.dpi, args.workers, args.fresh)
+    write_index(args.output_folder, results, args.views, args.formats)
+    elapsed = time.perf_counter() - t0
+
+    images = sum(len(f) for _, written, _ in results for f in written.values())
+    print(f"rendered {images} images of {len(files)} runs in {elapsed:.2f} s "
+          f"({sum(r[2] for r in results):.2f} s of worker time), index at {os.path.join(args.output_folder, 'index.html')}")
+
+    if args.compare and not args.fresh and 'png' in args.formats:
+        fresh_dir = os.path.join(args.output_folder, 'fresh')
+        t0 = time.perf_counter()
+        fresh = render_all(files, args.views, fresh_dir, ['png'], args.dpi, args.workers, fresh=True)
+        print(f"rendered them again with a new figure per run in {time.perf_counter() - t0:.2f} s")
+        compare_renders(results, fresh, args.output_folder, fresh_dir)
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Render run views to image files without opening windows")
+    parser.add_argument("inputs", nargs='+', help="csvs or folders of rc_*.csv")
+    parser.add_argument("-o", "--output_folder", default='renders', help="folder for the images and index.html")
+    parser.add_argument("-v", "--views", nargs='+', default=['all'], choices=list(views), help="views to render")
+    parser.add_argument("-f", "--formats", nargs='+', default=['png'], choices=['png', 'svg'], help="image formats")
+    parser.add_argument("--dpi", type=int, default=100, help="resolution of png output")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--fresh", action='store_true', help="build a new figure per run with the vis_* plot functions (for comparison)")
+    parser.add_argument("--compare", action='store_true', help="also render with --fresh into <output_folder>/fresh and report the pixels that differ")
+    args = parser.parse_args()
+    main(args)
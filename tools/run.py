@@ -0,0 +1,241 @@
+import pandas as pd
+import numpy as np
+import argparse as argp
+import glob
+import os
+import time
+from collections import Counter
+from scipy.signal import savgol_filter
+from fsm import sensor_cols, compute_states
+from multirate import MultiRateRun
+
+# One analysis core for the vis_* views. A Run computes each derived channel
+# the first time it is asked for and keeps it, so plotting several views of a
+# run in one process projects, differentiates and smooths it only once.
+# Channels that depend on the projection are memoized per origin.
+# The track comes from the raw GPS fixes, or with source 'fused' (or
+# TR25_TRACK=fused in the environment) from fusion.py's 50 Hz track sampled at
+# the fixes, so every view and label built on a Run can switch over.
+
+def meters_per_degree(lat0):
+    m_lat = 111132.92 - 559.82*np.cos(2*np.deg2rad(lat0)) + 1.175*np.cos(4*np.deg2rad(lat0))
+    m_lon = 111412.84*np.cos(np.deg2rad(lat0)) - 93.5*np.cos(3*np.deg2rad(lat0))
+    return m_lat, m_lon
+
+def project(lat, lon, lat0, lon0):
+    m_lat, m_lon = meters_per_degree(lat0)
+    return (lon - lon0) * m_lon, (lat - lat0) * m_lat
+
+def unproject(x, y, lat0, lon0):
+    m_lat, m_lon = meters_per_degree(lat0)
+    return lat0 + np.asarray(y) / m_lat, lon0 + np.asarray(x) / m_lon
+
+def time_step(utc):
+    # seconds between fixes, 0 before the first one
+    dt = np.diff(utc, prepend=np.nan) / 1000.0
+    dt[0] = 0
+    return dt
+
+def speed_from(x, y, dt):
+    dist = np.hypot(np.diff(x, prepend=np.nan), np.diff(y, prepend=np.nan))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = dist / dt
+    speed[np.isnan(speed)] = 0
+    return speed
+
+def smooth_accel(speed, dt):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        accel = np.diff(speed, prepend=np.nan) / dt
+    accel[np.isnan(accel)] = 0
+    # Savitzky-Golay smoothing, window length <= N, odd and at least 7
+    N = len(accel)
+    if N >= 7:
+        wl = min(51, N if N%2 else N-1)
+        wl = max(7, wl)
+        accel = savgol_filter(accel, window_length=wl, polyorder=2, mode='interp')
+    return accel
+
+def curvature(x, y):
+    # signed curvature, smoothed over 31 fixes
+    dx, dy = np.gradient(x), np.gradient(y)
+    ddx, ddy = np.gradient(dx), np.gradient(dy)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        curv = (dx*ddy - dy*ddx)/(dx*dx + dy*dy)**1.5
+    curv = np.nan_to_num(curv)
+    # steps under 1 cm are standing still (raw fixes repeat exactly, a fused track creeps)
+    curv[np.hypot(dx, dy) < 1e-2] = 0
+    if len(curv) >= 31:
+        curv = savgol_filter(curv, window_length=31, polyorder=2, mode='interp')
+    return curv
+
+mps_to_mph = 2.2369362920544
+wheel_cols = ['WSFR', 'WSFL', 'WSRR', 'WSRL']
+gps_cols = ['Latitude', 'Longitude', 'Utc'] + sensor_cols + ['Yaw'] + wheel_cols
+fusion_cols = ['Latitude', 'Longitude', 'GPSDOP', 'GPSQual', 'Speed', 'WSFR', 'Yaw', 'AccelX']
+track_source = os.environ.get('TR25_TRACK', 'gps')
+
+class Run:
+    def __init__(self, path, source=None):
+        self.path = path
+        self.source = source or track_source
+        self.computed = Counter()  # how often each channel was computed
+        self._cache = {}
+
+    def _memo(self, name, key, compute):
+        if (name, key) not in self._cache:
+            self.computed[name] += 1
+            self._cache[name, key] = compute()
+        return self._cache[name, key]
+
+    def _origin(self, origin):
+        return self.origin if origin is None else tuple(origin)
+
+    @property
+    def gps(self):
+        # one row per GPS fix, sensor channels held at their last sample
+        def compute():
+            mr = MultiRateRun.load(self.path, ['Interval'] + gps_cols)
+            cols = [c for c in gps_cols if c in mr]
+            return mr.align(cols, t=mr.sampled_at(['Latitude', 'Longitude']), bfill=True).reset_index()
+        return self._memo('gps', None, compute)
+
+    @property
+    def origin(self):
+        # default projection center: the mean fix of this run
+        return self._memo('origin', None, lambda: (self.gps['Latitude'].mean(), self.gps['Longitude'].mean()))
+
+    @property
+    def dt(self):
+        return self._memo('dt', None, lambda: time_step(self.gps['Utc'].to_numpy(dtype=float)))
+
+    @property
+    def states(self):
+        return self._memo('states', None, lambda: compute_states(self.gps))
+
+    @property
+    def pose(self):
+        # fused 50 Hz track (see fusion.py)
+        def compute():
+            from fusion import fuse
+            return fuse(MultiRateRun.load(self.path, ['Interval'] + fusion_cols))
+        return self._memo('pose', None, compute)
+
+    def latlon(self):
+        # position at each GPS fix from the selected source
+        def compute():
+            lat, lon = self.gps['Latitude'].to_numpy(), self.gps['Longitude'].to_numpy()
+            pose = self.pose if self.source == 'fused' else None
+            if pose is None or len(pose) < 2:
+                return lat, lon
+            t = self.gps['Interval'].to_numpy(dtype=float)
+            return np.interp(t, pose['Interval'], pose['Latitude']), np.interp(t, pose['Interval'], pose['Longitude'])
+        return self._memo('latlon', None, compute)
+
+    def xy(self, origin=None):
+        origin = self._origin(origin)
+        return self._memo('xy', origin, lambda: project(*self.latlon(), *origin))
+
+    def speed(self, origin=None):
+        origin = self._origin(origin)
+        return self._memo('speed', origin, lambda: speed_from(*self.xy(origin), self.dt))
+
+    def speed_mph(self, origin=None):
+        return self.speed(origin) * mps_to_mph
+
+    def accel(self, origin=None):
+        origin = self._origin(origin)
+        return self._memo('accel', origin, lambda: smooth_accel(self.speed(origin), self.dt))
+
+    def curvature(self, origin=None):
+        origin = self._origin(origin)
+        return self._memo('curvature', origin, lambda: curvature(*self.xy(origin)))
+
+    def start(self, origin=None):
+        # first fix where the car moves
+        valid = np.flatnonzero(self.speed(origin) > 0)
+        return valid[0] if valid.size > 0 else 0
+
+    def track(self, origin=None):
+        # x/y with the origin moved to the first movement
+        origin = self._origin(origin)
+        def compute():
+            x, y = self.xy(origin)
+            s = self.start(origin)
+            return x - x[s], y - y[s]
+        return self._memo('track', origin, compute)
+
+    def lod(self, origin=None):
+        # nested levels of detail of the track (see decimate.py)
+        origin = self._origin(origin)
+        def compute():
+            from decimate import run_lod
+            return run_lod(self, origin)
+        return self._memo('lod', origin, compute)
+
+    def segments(self, origin=None):
+        # (N-1, 2, 2) line segments between consecutive fixes, for LineCollection
+        origin = self._origin(origin)
+        def compute():
+            pts = np.column_stack(self.track(origin))
+            return np.stack([pts[:-1], pts[1:]], axis=1)
+        return self._memo('segments', origin, compute)
+
+_runs = {}
+
+def get_run(path):
+    # every view in the process shares one Run per file
+    key = os.path.abspath(path)
+    if key not in _runs:
+        _runs[key] = Run(path)
+    return _runs[key]
+
+def main(args):
+    global track_source
+    track_source = args.source
+    import matplotlib
+    if not args.show:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from vis_a import plot_accel
+    from vis_v import plot_speed
+    from vis_c import plot_curvature
+    from vis_f import plot_states
+    from vis_all import plot_all_metrics
+    views = {'a': plot_accel, 'v': plot_speed, 'c': plot_curvature, 'f': plot_states, 'all': plot_all_metrics}
+
+    files = []
+    for name in args.inputs:
+        files += sorted(glob.glob(os.path.join(name, 'rc_*.csv'))) if os.path.isdir(name) else [name]
+
+    t0 = time.perf_counter()
+    for path in files:
+        run = get_run(path)
+        for view in args.views:
+            try:
+                views[view](run)
+            except ValueError as e:
+                # e.g. accel percentiles that do not straddle 0 on runs where the car barely moves
+                print(f"{path}: view {view} skipped ({e})")
+            if args.show:
+                plt.show()
+            else:
+                for n in plt.get_fignums():
+                    plt.figure(n).canvas.draw()
+            plt.close('all')
+    elapsed = time.perf_counter() - t0
+
+    total = Counter()
+    for run in _runs.values():
+        total.update(run.computed)
+    print(f"{len(args.views)} views of {len(files)} runs in {elapsed:.2f} s")
+    for name, n in total.items():
+        print(f"  {name:10s} computed {n} times ({n/len(files):.0f} per run)")
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Plot several views of each run, sharing derived channels between them")
+    parser.add_argument("inputs", nargs='+', help="csvs or folders of rc_*.csv")
+    parser.add_argument("-v", "--views", nargs='+', default=['a', 'v', 'c', 'f', 'all'], choices=['a', 'v', 'c', 'f', 'all'], help="views to draw")
+    parser.add_argument("--show", action='store_true', help="show each figure instead of only drawing it")
+    parser.add_argument("-s", "--source", default=track_source, choices=['gps', 'fused'], help="track from the raw fixes or the fused track (default: $TR25_TRACK or gps)")
+    args = parser.parse_args()
+    main(args)
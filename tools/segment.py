@@ -0,0 +1,158 @@
+import pandas as pd
+import numpy as np
+import argparse as argp
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from run import get_run
+
+# Automatic corner/straight/slalom/hairpin segmentation. Every GPS fix is
+# classified as straight, left or right from yaw rate, lateral G and path
+# curvature; runs of equal class become segments. Turns that sweep more than
+# a hairpin's worth of heading are hairpins, and chains of short turns that
+# alternate direction with little straight between them are merged into one
+# slalom. All steps work on whole arrays (per fix, then per segment).
+
+segment_params = {
+    'yaw': 12.0,         # yaw rate (deg/s) that counts as turning
+    'accel_y': 0.3,      # lateral accel (G) that counts as turning
+    'curv': 1/40,        # path curvature (1/m) that counts as turning
+    'min_speed': 15.0,   # below this speed (kph) a fix is never a turn
+    'min_fixes': 5,      # shorter runs of one class are absorbed by the previous one
+    'hairpin': 135.0,    # heading change (deg) of a hairpin
+    'slalom_turn': 100.0,# largest heading change (deg) of one slalom element
+    'slalom_gap': 1.0,   # longest straight (s) between slalom elements
+    'slalom_min': 3,     # turns in a slalom
+}
+
+segment_types = ['straight', 'corner', 'hairpin', 'slalom']
+
+def run_lengths(labels):
+    # start index and value of each run of equal labels
+    starts = np.flatnonzero(np.concatenate([[True], labels[1:] != labels[:-1]]))
+    return starts, labels[starts]
+
+def fix_classes(yaw, ay, curv, speed, p=segment_params):
+    # 0 straight, +1 left, -1 right
+    moving = speed > p['min_speed']
+    turning = moving & ((np.abs(yaw) > p['yaw']) | (np.abs(ay) > p['accel_y']) | (np.abs(curv) > p['curv']))
+    # direction from the yaw rate, falling back to curvature when the gyro reads ~0
+    direction = np.where(np.abs(yaw) > 1.0, np.sign(yaw), np.sign(curv))
+    return np.where(turning, direction, 0).astype(np.int8)
+
+def absorb_short(labels, min_fixes):
+    # runs shorter than min_fixes take the class of the run before them
+    starts, values = run_lengths(labels)
+    lengths = np.diff(np.append(starts, len(labels)))
+    keep = lengths >= min_fixes
+    keep[0] = True
+    kept = np.where(keep, np.arange(len(starts)), 0)
+    np.maximum.accumulate(kept, out=kept)
+    return np.repeat(values[kept], lengths)
+
+def segment(yaw, ay, curv, speed, dt, p=segment_params):
+    n = len(yaw)
+    labels = absorb_short(fix_classes(yaw, ay, curv, speed, p), p['min_fixes'])
+    starts, direction = run_lengths(labels)
+    ends = np.append(starts[1:], n)
+
+    heading = np.add.reduceat(yaw * dt, starts)          # deg turned in each segment
+    seg_time = np.add.reduceat(dt, starts)
+    kind = np.where(direction == 0, 0, np.where(np.abs(heading) >= p['hairpin'], 2, 1))
+
+    # slaloms: consecutive turns of alternating direction, each small, joined by short straights
+    turn = np.flatnonzero(direction != 0)
+    if len(turn) > 1:
+        a, b = turn[:-1], turn[1:]
+        between = np.cumsum(np.where(direction == 0, seg_time, 0))
+        gap = between[b - 1] - between[a]                  # straight time between turn a and turn b
+        small = np.abs(heading[turn]) < p['slalom_turn']
+        link = (direction[a] != direction[b]) & (gap <= p['slalom_gap']) & small[:-1] & small[1:]
+        chain = np.concatenate([[0], np.cumsum(~link)])
+        count = np.bincount(chain)
+        in_slalom = count[chain] >= p['slalom_min']
+        if in_slalom.any():
+            first = np.full(chain.max() + 1, len(starts))
+            last = np.full(chain.max() + 1, -1)
+            np.minimum.at(first, chain[in_slalom], turn[in_slalom])
+            np.maximum.at(last, chain[in_slalom], turn[in_slalom])
+            chains = np.flatnonzero(last >= 0)
+            # every segment from a chain's first turn to its last becomes one slalom
+            cover = np.zeros(len(starts) + 1, dtype=int)
+            np.add.at(cover, first[chains], 1)
+            np.add.at(cover, last[chains] + 1, -1)
+            inside = np.cumsum(cover[:-1]) > 0
+            head = np.zeros(len(starts), dtype=bool)
+            head[first[chains]] = True
+            keep = ~inside | head
+            ends = ends.copy()
+            ends[first[chains]] = ends[last[chains]]
+            kind = kind.copy()
+            kind[first[chains]] = 3
+            direction = direction.copy()
+            direction[first[chains]] = 0
+            starts, ends, kind, direction = starts[keep], ends[keep], kind[keep], direction[keep]
+            heading = np.add.reduceat(yaw * dt, starts)
+    return starts, ends, kind, direction, heading
+
+def segment_table(run, p=segment_params):
+    gps = run.gps
+    yaw = gps['Yaw'].to_numpy(dtype=float)
+    ay = gps['AccelY'].to_numpy(dtype=float)
+    speed = gps['Speed'].to_numpy(dtype=float)
+    utc = gps['Utc'].to_numpy(dtype=float)
+    if len(gps) == 0:
+        return pd.DataFrame(columns=['run', 'start', 'end', 'type', 'direction', 'duration', 'heading_change',
+                                     'peak_lat_g', 'entry_kph', 'exit_kph', 'min_kph'])
+    starts, ends, kind, direction, heading = segment(yaw, ay, run.curvature(), speed, run.dt, p)
+    return pd.DataFrame({
+        'run': run.path,
+        'start': starts,                     # first GPS fix of the segment
+        'end': ends,                         # one past the last fix
+        'type': np.array(segment_types)[kind],
+        'direction': np.array(['right', '', 'left'])[direction + 1],
+        'duration': (utc[ends - 1] - utc[starts]) / 1000.0,
+        'heading_change': heading,
+        'peak_lat_g': np.maximum.reduceat(np.abs(ay), starts),
+        'entry_kph': speed[starts],
+        'exit_kph': speed[ends - 1],
+        'min_kph': np.minimum.reduceat(speed, starts),
+    })
+
+def fix_labels(table, n):
+    # per-fix segment type, e.g. as training labels
+    lengths = (table['end'] - table['start']).to_numpy()
+    return np.repeat(table['type'].to_numpy(), lengths)[:n]
+
+def segment_file(path):
+    return segment_table(get_run(path))
+
+def segment_all(files, workers=None):
+    if workers == 1:
+        return pd.concat([segment_file(f) for f in files], ignore_index=True)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return pd.concat(pool.map(segment_file, files, chunksize=4), ignore_index=True)
+
+def main(args):
+    folders = args.input_folders or sorted(glob.glob(os.path.join('data', 'test *')))
+    files = [f for folder in folders for f in sorted(glob.glob(os.path.join(folder, 'rc_*.csv')))]
+    t0 = time.perf_counter()
+    table = segment_all(files, args.workers)
+    elapsed = time.perf_counter() - t0
+
+    fixes = table.groupby('run')['end'].max().sum()
+    print(f"segmented {len(files)} runs ({fixes} GPS fixes) into {len(table)} segments in {elapsed:.2f} s")
+    summary = table.groupby('type').agg(count=('start', 'size'), seconds=('duration', 'sum'),
+                                        peak_lat_g=('peak_lat_g', 'median'), min_kph=('min_kph', 'median'))
+    print(summary.round(2).to_string())
+    if args.output_file is not None:
+        table.to_csv(args.output_file, index=False)
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Split runs into straight/corner/hairpin/slalom segments")
+    parser.add_argument("-i", "--input_folders", nargs='*', default=None, help="test folders (default: data/test *)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker processes (default: all cores, 1 to run in-process)")
+    parser.add_argument("-o", "--output_file", default=None, help="csv to write the segment table to")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,219 @@
+import pandas as pd
+import numpy as np
+import argparse as argp
+import os
+import tempfile
+import time
+import tracemalloc
+from log2dat import iter_log
+from cache import load_run
+from fsm import sensor_cols, thresholds, transition_table, resolve_states
+from run import project, time_step, speed_from, smooth_accel, curvature, mps_to_mph
+
+# Chunk-by-chunk processing of a run. Every stage keeps only the carry-over it
+# needs (last sensor values, FSM state, a short window of GPS fixes), so peak
+# memory depends on the chunk size and never on the length of the log.
+
+# the FSM reads these five; the steer angle is still a placeholder there
+fsm_cols = sensor_cols[:5]
+stream_cols = ['Interval', 'Utc', 'Latitude', 'Longitude'] + fsm_cols
+
+def iter_run(path, chunksize=10000, usecols=stream_cols):
+    if path.endswith('.log'):
+        yield from iter_log(path, chunksize, usecols)
+    else:
+        with pd.read_csv(path, chunksize=chunksize, usecols=usecols) as reader:
+            yield from reader
+
+def derive(x, y, utc):
+    # speed, smoothed accel and smoothed signed curvature, computed as a Run computes them
+    dt = time_step(utc)
+    speed = speed_from(x, y, dt)
+    return {'speed': speed, 'speed_mph': speed * mps_to_mph, 'accel': smooth_accel(speed, dt), 'curv': curvature(x, y)}
+
+# samples of context a derived value needs on each side: accel takes 2 diffs and
+# 25 savgol samples, and the end-of-run interp fit needs 51 accels past the 2 diffs
+left_context, right_context, full_window = 28, 25, 51
+
+class GpsRows:
+    # GPS fixes out of a stream of 50 Hz rows, with the sensors held at their last
+    # sample. Fixes that arrive before a sensor's first sample are held back and
+    # back-filled with it, matching ffill().bfill() over the whole run. At most
+    # max_pending fixes are held: past that, a sensor not logged yet is NaN until
+    # its first sample (where the whole-run bfill would differ), so a session
+    # that never logs a channel still streams in flat memory.
+    def __init__(self, sensors=fsm_cols, max_pending=full_window):
+        self.sensors = list(sensors)
+        self.last = np.full(len(self.sensors), np.nan)
+        self.first = np.full(len(self.sensors), np.nan)
+        self.pending = []
+        self.held = 0
+        self.max_pending = max_pending
+
+    def update(self, chunk):
+        raw = chunk[self.sensors].to_numpy(dtype=float)
+        for j in np.flatnonzero(np.isnan(self.first)):
+            seen = np.flatnonzero(~np.isnan(raw[:, j]))
+            if len(seen):
+                self.first[j] = raw[seen[0], j]
+
+        # forward fill, seeded with the last values of the previous chunk
+        vals = np.vstack([self.last, raw])
+        idx = np.where(np.isnan(vals), 0, np.arange(len(vals))[:, None])
+        np.maximum.accumulate(idx, axis=0, out=idx)
+        vals = vals[idx, np.arange(vals.shape[1])]
+        self.last = vals[-1]
+
+        fix = (chunk['Latitude'].notna() & chunk['Longitude'].notna()).to_numpy()
+        rows = pd.DataFrame(vals[1:][fix], columns=self.sensors)
+        for col in ['Utc', 'Latitude', 'Longitude']:
+            rows[col] = chunk[col].to_numpy(dtype=float)[fix]
+        if self.pending is None:
+            return rows
+        self.pending.append(rows)
+        self.held += len(rows)
+        return rows.iloc[:0] if np.isnan(self.first).any() and self.held < self.max_pending else self.flush()
+
+    def flush(self):
+        if self.pending is None:
+            return pd.DataFrame(columns=self.sensors + ['Utc', 'Latitude', 'Longitude'], dtype=float)
+        rows = pd.concat(self.pending, ignore_index=True)
+        rows[self.sensors] = rows[self.sensors].fillna(pd.Series(self.first, index=self.sensors))
+        self.pending = None
+        return rows
+
+class RunStream:
+    def __init__(self, lat0=None, lon0=None, th=thresholds):
+        self.gps = GpsRows()
+        self.lat0, self.lon0 = lat0, lon0  # projection origin; defaults to the first fix
+        self.th = th
+        self.state = 0
+        self.buf = None
+        self.total = 0
+        self.emitted = 0  # rows at the head of buf that were already emitted (kept as context)
+
+    def update(self, chunk):
+        return self._push(self.gps.update(chunk), final=False)
+
+    def flush(self):
+        return self._push(self.gps.flush(), final=True)
+
+    def _push(self, rows, final):
+        if len(rows):
+            ax, ay, tps, sp, bp = (rows[c].to_numpy() for c in fsm_cols)
+            sa = np.zeros(len(rows))  # steer angle placeholder, as in compute_states
+            states = resolve_states(transition_table(ax, ay, tps, sp, bp, sa, self.th), initial=self.state)
+            self.state = states[-1]
+            rows = rows.assign(state=states)
+            if self.lat0 is None:
+                self.lat0, self.lon0 = rows['Latitude'].iloc[0], rows['Longitude'].iloc[0]
+            x, y = project(rows['Latitude'].to_numpy(), rows['Longitude'].to_numpy(), self.lat0, self.lon0)
+            rows = rows.assign(x=x, y=y)
+            self.buf = rows if self.buf is None else pd.concat([self.buf, rows], ignore_index=True)
+            self.total += len(rows)
+        if self.buf is None or (self.total < full_window and not final):
+            return None
+
+        # only emit rows whose derived values can no longer change
+        start = self.emitted
+        end = len(self.buf) if final else len(self.buf) - right_context
+        if end <= start:
+            return None
+        d = derive(self.buf['x'].to_numpy(), self.buf['y'].to_numpy(), self.buf['Utc'].to_numpy())
+        out = self.buf.iloc[start:end].assign(**{k: v[start:end] for k, v in d.items()})
+        self.emitted = min(end, left_context)
+        self.buf = self.buf.iloc[end - self.emitted:].reset_index(drop=True)
+        return out.reset_index(drop=True)
+
+    def provisional(self):
+        # the held-back fixes with derived values from the data seen so far; state,
+        # x and y are already final, speed/accel/curvature may still change; curvature
+        # needs two fixes
+        if self.buf is None or len(self.buf) < 2:
+            return None
+        start = self.emitted
+        d = derive(self.buf['x'].to_numpy(), self.buf['y'].to_numpy(), self.buf['Utc'].to_numpy())
+        return self.buf.iloc[start:].assign(**{k: v[start:] for k, v in d.items()}).reset_index(drop=True)
+
+def stream_run(path, chunksize=10000, lat0=None, lon0=None, th=thresholds):
+    rs = RunStream(lat0, lon0, th)
+    for chunk in iter_run(path, chunksize):
+        out = rs.update(chunk)
+        if out is not None:
+            yield out
+    out = rs.flush()
+    if out is not None:
+        yield out
+
+def batch_run(path):
+    # whole-file reference: the same math on the fully loaded run
+    df = load_run(path, columns=stream_cols)
+    df[fsm_cols] = df[fsm_cols].ffill().bfill()
+    gps = df.dropna(subset=['Latitude', 'Longitude']).reset_index(drop=True)
+    ax, ay, tps, sp, bp = (gps[c].to_numpy(dtype=float) for c in fsm_cols)
+    gps['state'] = resolve_states(transition_table(ax, ay, tps, sp, bp, np.zeros(len(gps))))
+    lat0, lon0 = gps['Latitude'].iloc[0], gps['Longitude'].iloc[0]
+    gps['x'], gps['y'] = project(gps['Latitude'].to_numpy(), gps['Longitude'].to_numpy(), lat0, lon0)
+    for k, v in derive(gps['x'].to_numpy(), gps['y'].to_numpy(), gps['Utc'].to_numpy(dtype=float)).items():
+        gps[k] = v
+    return gps
+
+def repeat_log(path, times):
+    # a long synthetic session: the body of a log replayed back to back with shifted timestamps
+    schema_line, body = None, []
+    with open(path) as f:
+        schema_line = f.readline()
+        body = f.read().splitlines()
+    first = body[0].split(',')
+    span = float(body[-1].split(',')[0]) - float(first[0]) + 20
+    fd, out = tempfile.mkstemp(suffix='.log')
+    with os.fdopen(fd, 'w') as f:
+        f.write(schema_line)
+        for k in range(times):
+            for line in body:
+                fields = line.split(',', 2)
+                if len(fields) < 3 or not fields[0]:
+                    continue
+                t = int(float(fields[0]) + k * span)
+                utc = int(float(fields[1]) + k * span) if fields[1] else ''
+                f.write(f"{t},{utc},{fields[2]}\n")
+    return out
+
+def main(args):
+    if args.check:
+        ref = batch_run(args.filename)
+        out = pd.concat(stream_run(args.filename, args.chunksize), ignore_index=True)
+        cols = ['Utc', 'x', 'y', 'state', 'speed', 'accel', 'curv']
+        same = len(out) == len(ref) and np.allclose(out[cols].to_numpy(dtype=float), ref[cols].to_numpy(dtype=float), rtol=1e-9, atol=1e-9, equal_nan=True)
+        print(f"{args.filename}: {len(out)} fixes streamed in chunks of {args.chunksize}, "
+              f"{'matches' if same else 'DIFFERS FROM'} the whole-file computation")
+
+    for times in args.repeat:
+        path = repeat_log(args.filename, times) if times > 1 else args.filename
+        try:
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            rows = fixes = 0
+            rs = RunStream()
+            for chunk in iter_run(path, args.chunksize):
+                rows += len(chunk)
+                out = rs.update(chunk)
+                fixes += 0 if out is None else len(out)
+            out = rs.flush()
+            fixes += 0 if out is None else len(out)
+            elapsed = time.perf_counter() - t0
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        finally:
+            if path != args.filename:
+                os.remove(path)
+        print(f"x{times}: {rows} rows, {fixes} fixes in {elapsed:.2f} s, peak traced memory {peak/1e6:.1f} MB")
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Stream a log chunk by chunk through projection, speed, curvature and the FSM")
+    parser.add_argument("filename", help="log or csv to stream")
+    parser.add_argument("-c", "--chunksize", type=int, default=5000, help="rows per chunk")
+    parser.add_argument("--check", action='store_true', help="compare against the whole-file computation")
+    parser.add_argument("--repeat", type=int, nargs='*', default=[1], help="replay the log this many times back to back to show memory stays flat")
+    args = parser.parse_args()
+    main(args)
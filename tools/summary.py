@@ -0,0 +1,129 @@
+import pandas as pd
+import numpy as np
+import argparse as argp
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from cache import cache_root, cache_key
+from multirate import MultiRateRun
+from log2dat import to_float64
+from run import Run
+from query import parse_predicate, ops
+
+# One index file summarizing every run: duration, samples per channel,
+# min/max/mean of the key channels, GPS bounding box and valid fixes, and the
+# time spent in each FSM state. Entries carry the cache key of their source
+# (path, size, mtime), so updating the index only summarizes new or changed
+# files (in parallel) and drops the ones that are gone. Listing and filtering
+# runs then reads one json file and never opens a log.
+
+summary_channels = ['Speed', 'AccelX', 'AccelY', 'Yaw', 'TPS', 'FrontBP', 'RPM', 'EngineTemp']
+index_path = os.path.join(cache_root, 'summary.json')
+# bump when summarize changes; entries of another format are summarized again
+summary_format = 2
+
+def summarize(path):
+    mr = MultiRateRun.load(path)
+    entry = {
+        'path': path, 'test': os.path.basename(os.path.dirname(path)),
+        'rows': len(mr.base), 'duration': float(mr.base[-1] - mr.base[0]) / 1000.0 if len(mr.base) else 0.0,
+        'samples': {name: len(values) for name, (_, values) in mr.channels.items() if name != 'Unnamed: 0'},
+    }
+    for c in summary_channels:
+        # typed channels are float32; widened at their logged precision, as MultiRateRun.align does
+        values = to_float64(mr.channel(c)[1], mr.decimals.get(c)) if c in mr else np.zeros(0)
+        values = values[~np.isnan(values)]
+        for stat, fn in [('min', np.min), ('max', np.max), ('mean', np.mean)]:
+            entry[f'{c}_{stat}'] = float(fn(values)) if len(values) else None
+
+    run = Run(path)
+    gps = run.gps
+    lat, lon = gps['Latitude'].to_numpy(dtype=float), gps['Longitude'].to_numpy(dtype=float)
+    valid = (lat != 0) & (lon != 0)
+    if 'GPSQual' in mr:
+        t, qual = mr.channel('GPSQual')
+        at = np.clip(np.searchsorted(t, gps['Interval'].to_numpy(), side='right') - 1, 0, len(t) - 1)
+        valid &= qual.astype(float)[at] > 0
+    entry['fixes'] = len(gps)
+    entry['valid_fixes'] = int(valid.sum())
+    box = [float(lat[valid].min()), float(lat[valid].max()), float(lon[valid].min()), float(lon[valid].max())] if valid.any() else [None] * 4
+    entry.update(zip(['lat_min', 'lat_max', 'lon_min', 'lon_max'], box))
+    # each fix holds its state until the next one
+    dt = np.diff(gps['Interval'].to_numpy(dtype=float), append=gps['Interval'].iloc[-1] if len(gps) else 0) / 1000.0
+    by_state = np.bincount(np.asarray(run.states, dtype=int), weights=dt, minlength=3) if len(gps) else np.zeros(3)
+    entry.update({f'state{s}_s': float(v) for s, v in enumerate(by_state)})
+    return entry
+
+def _summarize(job):
+    path, key = job
+    return dict(summarize(path), key=key, format=summary_format)
+
+def read_index(path=index_path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def update_index(files, path=index_path, workers=None, refresh=False):
+    # summaries of the given runs, computing only new or changed ones; returns (index, computed)
+    index = read_index(path)
+    wanted = {os.path.abspath(f): f for f in files}
+    keys = {a: cache_key(f) for a, f in wanted.items()}
+    stale = [(f, keys[a]) for a, f in wanted.items() if refresh or index.get(a, {}).get('key') != keys[a]
+             or index.get(a, {}).get('format') != summary_format]
+    gone = [a for a in index if not os.path.exists(a)]
+    if stale:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for entry in pool.map(_summarize, stale):
+                index[os.path.abspath(entry['path'])] = entry
+    for a in gone:
+        del index[a]
+    if stale or gone:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp{os.getpid()}"
+        with open(tmp, 'w') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(tmp, path)
+    return index, len(stale)
+
+def summary_table(index, where=()):
+    # one row per run (sample counts left out), filtered by predicates on its columns
+    table = pd.DataFrame([{k: v for k, v in e.items() if k not in ('samples', 'key', 'format')} for e in index.values()])
+    if table.empty:
+        return table
+    mask = np.ones(len(table), dtype=bool)
+    for column, absolute, op, value in map(parse_predicate, where):
+        v = table[column].to_numpy(dtype=float) if column in table else np.full(len(table), np.nan)
+        mask &= ops[op](np.abs(v) if absolute else v, value)
+    return table[mask].sort_values('path').reset_index(drop=True)
+
+def main(args):
+    folders = args.input_folders or sorted(glob.glob(os.path.join('data', 'test *')))
+    files = [f for folder in folders for f in sorted(glob.glob(os.path.join(folder, 'rc_*.csv')))]
+    t0 = time.perf_counter()
+    index, computed = update_index(files, args.index, args.workers, args.refresh)
+    print(f"{len(index)} runs in {args.index}: {computed} summarized in {time.perf_counter() - t0:.2f} s, "
+          f"{os.path.getsize(args.index)/1e3:.0f} kB")
+
+    t0 = time.perf_counter()
+    wanted = {os.path.abspath(f) for f in files}
+    table = summary_table({a: e for a, e in read_index(args.index).items() if a in wanted}, args.where)
+    elapsed = time.perf_counter() - t0
+    print(f"{len(table)} runs listed in {elapsed*1000:.1f} ms")
+    cols = ['path', 'duration', 'valid_fixes', 'Speed_max', 'AccelY_min', 'AccelY_max', 'state0_s', 'state1_s', 'state2_s']
+    cols += [c for c in args.columns if c not in cols]
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print(table[[c for c in cols if c in table]].to_string(index=False, float_format='%.2f'))
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Keep a one-file summary index of every run and list runs from it")
+    parser.add_argument("-i", "--input_folders", nargs='*', default=None, help="test folders (default: data/test *)")
+    parser.add_argument("-o", "--index", default=index_path, help="index file")
+    parser.add_argument("-w", "--where", action='append', default=[], help="filter, e.g. 'duration > 60' or 'Speed_max > 50' (repeatable)")
+    parser.add_argument("-c", "--columns", nargs='+', default=[], help="extra columns to list")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--refresh", action='store_true', help="summarize every run again")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,149 @@
+import pandas as pd
+import numpy as np
+import argparse as argp
+import glob
+import os
+import time
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from fsm import sensor_cols, thresholds, transition_table, resolve_states
+from fw_replay import front_pulses, rear_pulses, pulseDelta
+from cache import load_run
+
+# Sweep the compute_states thresholds over every logged run. All runs are
+# concatenated into one sensor matrix in shared memory; workers attach to it
+# read-only and evaluate a chunk of configurations each.
+
+def load_runs(folders):
+    files = []
+    for folder in folders:
+        files += sorted(glob.glob(os.path.join(folder, 'rc_*.csv')))
+    blocks, dts, starts = [], [], []
+    offset = 0
+    for run in files:
+        df = load_run(run)
+        # same preparation as vis_all: fill the 50 Hz data before taking GPS rows
+        df[sensor_cols] = df[sensor_cols].ffill().bfill()
+        gps = df.dropna(subset=['Latitude', 'Longitude']).reset_index(drop=True)
+        if len(gps) == 0:
+            continue
+        blocks.append(gps[sensor_cols].to_numpy(dtype=float))
+        dts.append(np.diff(gps['Interval'].to_numpy(dtype=float), prepend=gps['Interval'].iloc[0]) / 1000.0)
+        starts.append(offset)
+        offset += len(gps)
+    data = np.ascontiguousarray(np.concatenate(blocks))
+    return files, data, np.concatenate(dts), np.asarray(starts)
+
+_shared = {}
+
+def attach(specs):
+    # worker initializer: map the shared arrays without copying them
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        arr.flags.writeable = False
+        _shared[name] = (shm, arr)
+
+def evaluate(data, dt, starts, th):
+    ax, ay, tps, sp, bp, sa = data.T
+    sa = np.zeros(len(ax))  # steer angle sensor is still a placeholder in compute_states
+    table = transition_table(ax, ay, tps, sp, bp, sa, th)
+    # every run starts from state 0: make its first row a constant map so the
+    # scan over the concatenated runs resets at each boundary
+    table[starts] = table[starts, :1]
+    states = resolve_states(table)
+
+    change = np.diff(states) != 0
+    change[starts[1:] - 1] = False
+    prev, cur = states[:-1][change], states[1:][change]
+    # moveServo() steps at most pulseDelta per packet, so a long rear move takes two
+    rear_steps = 1 + (np.abs(rear_pulses[cur] - rear_pulses[prev]) > pulseDelta)
+    front_steps = (front_pulses[cur] != front_pulses[prev]).astype(int)
+
+    time_in_state = np.bincount(states, weights=dt, minlength=3)
+    return {
+        'time_0': time_in_state[0],
+        'time_1': time_in_state[1],
+        'time_2': time_in_state[2],
+        'transitions': int(change.sum()),
+        'actuations': int(front_steps.sum() + rear_steps.sum()),
+    }
+
+def run_chunk(configs):
+    data = _shared['data'][1]
+    dt = _shared['dt'][1]
+    starts = _shared['starts'][1]
+    return [dict(th, **evaluate(data, dt, starts, th)) for th in configs]
+
+def parse_grid(specs):
+    # name=start:stop:step or name=v1,v2,v3
+    axes = {}
+    for spec in specs:
+        name, values = spec.split('=')
+        if name not in thresholds:
+            raise KeyError(f"Unknown threshold {name}, expected one of {list(thresholds)}")
+        if ':' in values:
+            start, stop, step = (float(v) for v in values.split(':'))
+            axes[name] = np.round(np.arange(start, stop + step/2, step), 6).tolist()
+        else:
+            axes[name] = [float(v) for v in values.split(',')]
+    return axes
+
+def grid_configs(axes):
+    names = list(axes)
+    return [dict(thresholds, **dict(zip(names, combo))) for combo in itertools.product(*axes.values())]
+
+def random_configs(axes, n, seed=0):
+    rng = np.random.default_rng(seed)
+    lo = {k: min(v) for k, v in axes.items()}
+    hi = {k: max(v) for k, v in axes.items()}
+    return [dict(thresholds, **{k: float(rng.uniform(lo[k], hi[k])) for k in axes}) for _ in range(n)]
+
+def sweep(configs, data, dt, starts, workers=None, chunksize=8):
+    arrays = {'data': data, 'dt': dt, 'starts': starts}
+    shms, specs = [], {}
+    for name, arr in arrays.items():
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+        shms.append(shm)
+        specs[name] = (shm.name, arr.shape, arr.dtype)
+    try:
+        chunks = [configs[i:i+chunksize] for i in range(0, len(configs), chunksize)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=attach, initargs=(specs,)) as pool:
+            results = [r for chunk in pool.map(run_chunk, chunks) for r in chunk]
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+    return pd.DataFrame(results)
+
+def main(args):
+    t0 = time.perf_counter()
+    folders = args.input_folders or sorted(glob.glob(os.path.join('data', 'test *')))
+    files, data, dt, starts = load_runs(folders)
+    print(f"loaded {len(starts)} runs ({len(data)} GPS samples) in {time.perf_counter()-t0:.2f} s")
+
+    axes = parse_grid(args.grid)
+    configs = random_configs(axes, args.samples, args.seed) if args.samples else grid_configs(axes)
+
+    t0 = time.perf_counter()
+    results = sweep(configs, data, dt, starts, workers=args.workers)
+    elapsed = time.perf_counter() - t0
+    print(f"evaluated {len(configs)} configurations in {elapsed:.2f} s "
+          f"({len(configs)*len(data)/elapsed/1e6:.1f} M sample-configs/s)")
+
+    print(results.sort_values('actuations').head(10).to_string(index=False))
+    if args.output_file is not None:
+        results.to_csv(args.output_file, index=False)
+
+if __name__ == "__main__":
+    parser = argp.ArgumentParser(description="Sweep FSM thresholds over all logged runs")
+    parser.add_argument("-i", "--input_folders", nargs='*', default=None, help="test folders (default: data/test *)")
+    parser.add_argument("-g", "--grid", nargs='+', required=True, help="threshold ranges, e.g. brake=20:40:5 accel_y=0.9,1.1,1.3")
+    parser.add_argument("-n", "--samples", type=int, default=None, help="draw this many random configurations inside the grid bounds")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for --samples")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("-o", "--output_file", required=False, default=None, help="csv to write the results to")
+    args = parser.parse_args()
+    main(args)